@@ -0,0 +1,152 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Export and import virtualenvs as compressed archives, to use them in other machines."""
+
+import io
+import json
+import logging
+import shutil
+import sys
+import tarfile
+from pathlib import Path
+from uuid import uuid4
+
+from fades import FadesError, envbuilder, helpers
+
+logger = logging.getLogger(__name__)
+
+# names inside the archive
+ENTRY_NAME = "entry.json"
+LOCKFILE_NAME = "lockfile.txt"
+VENV_DIRNAME = "venv"
+
+
+def _open_archive(filepath, mode):
+    """Open the archive, streaming it from stdin or to stdout if filepath is '-'."""
+    if str(filepath) == '-':
+        fileobj = sys.stdin.buffer if mode == 'r' else sys.stdout.buffer
+        return tarfile.open(fileobj=fileobj, mode=mode + '|' + ('*' if mode == 'r' else 'xz'))
+    return tarfile.open(filepath, mode=mode + ':' + ('*' if mode == 'r' else 'xz'))
+
+
+def export_venv(venv, filepath):
+    """Pack the venv and its cache information into a compressed archive.
+
+    The cache information is stored first, so the archive can be streamed when importing.
+    """
+    if venv.get('incomplete'):
+        raise FadesError("Can not export an incomplete virtualenv")
+    env_path = venv['metadata']['env_path']
+    logger.debug("Exporting virtual environment %s to %s", env_path, filepath)
+
+    entry = dict(venv)
+    entry['metadata'] = dict(venv['metadata'])
+    entry['metadata']['env_path'] = str(env_path)
+    entry['metadata']['env_bin_path'] = str(venv['metadata']['env_bin_path'])
+    with _open_archive(filepath, 'w') as tar:
+        _add_file(tar, ENTRY_NAME, json.dumps(entry).encode('utf8'))
+        fingerprint = venv.get('fingerprint')
+        if fingerprint is not None:
+            lockfile = envbuilder.get_lockfile_path(fingerprint)
+            if lockfile.exists():
+                _add_file(tar, LOCKFILE_NAME, lockfile.read_bytes())
+        tar.add(env_path, arcname=VENV_DIRNAME)
+
+
+def _add_file(tar, name, content):
+    """Add a file to the archive, from its content."""
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tar.addfile(info, io.BytesIO(content))
+
+
+def _is_safe(member):
+    """Tell if the archive member is something we would extract."""
+    path = Path(member.name)
+    if path.is_absolute() or '..' in path.parts:
+        return False
+    if member.islnk():
+        # hard links are only safe inside the venv
+        return _is_safe(tarfile.TarInfo(member.linkname))
+    return path.parts[0] == VENV_DIRNAME and not (member.isdev() or member.isfifo())
+
+
+def import_venv(filepath, venvscache):
+    """Unpack the venv from the archive into a new location, and register it in the cache.
+
+    Return the metadata of the imported venv.
+    """
+    if not hasattr(tarfile, 'tar_filter'):
+        # without extraction filters, members could be written through links to outside
+        logger.error("Can't import virtualenvs safely with this Python, please upgrade it")
+        raise FadesError("Extraction filters not available to import the virtualenv")
+
+    basedir = helpers.get_basedir()
+    new_uuid = str(uuid4())
+    tempdir = basedir / ".importing-{}".format(new_uuid)
+    tempdir.mkdir()
+    entry = lockfile_content = None
+    try:
+        with _open_archive(filepath, 'r') as tar:
+            for member in tar:
+                if member.name == ENTRY_NAME:
+                    entry = json.load(tar.extractfile(member))
+                elif member.name == LOCKFILE_NAME:
+                    lockfile_content = tar.extractfile(member).read()
+                elif _is_safe(member):
+                    _extract(tar, member, tempdir)
+                else:
+                    logger.warning("Ignoring unexpected member in the archive: %r", member.name)
+
+        if entry is None or not (tempdir / VENV_DIRNAME).is_dir():
+            raise FadesError("Invalid virtualenv archive")
+
+        env_path = basedir / new_uuid
+        (tempdir / VENV_DIRNAME).rename(env_path)
+    except tarfile.TarError as error:
+        logger.error("Error reading virtualenv archive %s: %s", filepath, error)
+        raise FadesError("Invalid virtualenv archive")
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    envbuilder.relocate_venv(env_path, Path(entry['metadata']['env_path']))
+    metadata = dict(entry['metadata'])
+    metadata['env_path'] = env_path
+    metadata['env_bin_path'] = helpers.get_env_bin_path(env_path)
+
+    fingerprint = entry.get('fingerprint')
+    if fingerprint is not None and lockfile_content is not None:
+        lockfile = envbuilder.get_lockfile_path(fingerprint)
+        if not lockfile.exists():
+            lockfile.parent.mkdir(exist_ok=True)
+            lockfile.write_bytes(lockfile_content)
+
+    venvscache.store(
+        entry['installed'], metadata, entry['interpreter'], entry['options'],
+        fingerprint=fingerprint, distributions=entry.get('distributions'))
+    logger.info("Virtual environment imported at %s", env_path)
+    return metadata
+
+
+def _extract(tar, member, destination):
+    """Extract the member, using the safest possible filter (but allowing absolute symlinks).
+
+    The venv links to the interpreter with absolute symlinks, that's why the "data" filter
+    can't be used.
+    """
+    tar.extract(member, destination, filter='tar')
@@ -0,0 +1,87 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Run the child program over many inputs, several at the same time, in the same virtualenv."""
+
+import concurrent.futures
+import logging
+import subprocess
+import sys
+
+from fades import FadesError, helpers
+
+logger = logging.getLogger(__name__)
+
+# separates the options common to all the runs from the inputs
+INPUTS_SEPARATOR = '--'
+
+
+def split_inputs(child_options):
+    """Separate the child options common to all the runs and the inputs (one per run).
+
+    The inputs are what comes after the separator; without it all are inputs. If no input
+    is given there, they are read from stdin (one per line).
+    """
+    if INPUTS_SEPARATOR in child_options:
+        idx = child_options.index(INPUTS_SEPARATOR)
+        common, inputs = child_options[:idx], child_options[idx + 1:]
+    else:
+        common, inputs = [], child_options
+    if not inputs:
+        logger.debug("Reading the inputs from stdin")
+        inputs = [line.strip() for line in sys.stdin]
+        inputs = [item for item in inputs if item]
+    return common, inputs
+
+
+def _run(cmd):
+    """Run the command, return its returncode."""
+    try:
+        return subprocess.call(cmd, stdin=subprocess.DEVNULL)
+    except FileNotFoundError:
+        logger.error("Command not found: %s", cmd[0])
+        raise FadesError("Command not found")
+
+
+def run_batch(cmd, child_options, workers):
+    """Run the command for each input, up to `workers` at the same time.
+
+    Return the worst of all the return codes.
+    """
+    common, inputs = split_inputs(child_options)
+    logger.debug("Running %s over %d inputs, %d at the same time", cmd, len(inputs), workers)
+
+    failed = []
+    returncodes = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run, cmd + common + [item]): item for item in inputs}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                returncode = future.result()
+                returncodes.append(returncode)
+                if returncode:
+                    failed.append((futures[future], returncode))
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, the %d inputs not started will not be run",
+                           sum(future.cancel() for future in futures))
+            raise
+
+    logger.info("Ran %d inputs: %d succeeded, %d failed",
+                len(inputs), len(inputs) - len(failed), len(failed))
+    for item, returncode in sorted(failed):
+        logger.warning("Failed with returncode %d: %s", returncode, item)
+    return helpers.get_worst_returncode(returncodes)
@@ -18,17 +18,59 @@
 """The cache manager for virtualenvs."""
 
 import copy
+import hashlib
 import json
 import logging
+import os
+import re
 import time
+from contextlib import contextmanager
 from pathlib import Path
 
-from fades import REPO_VCS
-from fades.multiplatform import filelock
+from packaging.utils import canonicalize_name
+
+from fades import FadesError, REPO_PYPI, REPO_VCS, helpers
+from fades.multiplatform import atomic_write, filelock, leaselock, remove_lockfile, trylock
 from fades.parsing import VCSDependency, NameVerDependency
 
 logger = logging.getLogger(__name__)
 
+# how many seconds to wait for the index lock before giving up
+INDEX_LOCK_TIMEOUT = 60
+
+# removals are appended to the index as "tombstones", which are purged when compacting
+TOMBSTONE_KEY = 'removed'
+TOMBSTONE_PREFIX = '{"%s": ' % (TOMBSTONE_KEY,)
+
+# compact the index when it accumulates this quantity of tombstones
+COMPACTION_THRESHOLD = 50
+
+# old versions identified the interpreter by its path (e.g. "/usr/bin/python3.12")
+OLD_INTERPRETER_KEY_RE = re.compile(r'"interpreter": "(/|[A-Za-z]:\\\\)')
+
+# marks the venvs whose old interpreter identifier couldn't be migrated
+UNKNOWN_INTERPRETER_KEY = 'unknown_interpreter'
+
+
+def canonicalize_options(options):
+    """Return the options in a canonical form, so equivalent ones are always equal."""
+    if isinstance(options, dict) and options.get('venv_options'):
+        options = dict(options, venv_options=sorted(options['venv_options']))
+    return options
+
+
+def _canonicalize_venv(venv):
+    """Normalize the names and options of a stored venv (which may come from old versions)."""
+    installed = venv.get("installed")
+    if isinstance(installed, dict) and isinstance(installed.get(REPO_PYPI), dict):
+        installed[REPO_PYPI] = {
+            canonicalize_name(name): ver for name, ver in installed[REPO_PYPI].items()}
+    if venv.get("distributions"):
+        venv["distributions"] = {
+            canonicalize_name(name): ver for name, ver in venv["distributions"].items()}
+    if "options" in venv:
+        venv["options"] = canonicalize_options(venv["options"])
+
 
 def load_venv(src: str) -> dict:
     """Load virtualenv information from the stored string."""
@@ -36,6 +78,7 @@ def load_venv(src: str) -> dict:
     metadata = venv["metadata"]
     for key in ("env_path", "env_bin_path"):
         metadata[key] = Path(metadata[key])
+    _canonicalize_venv(venv)
     return venv
 
 
@@ -48,29 +91,71 @@ def dump_venv(venv: dict) -> str:
     return json.dumps(venv)
 
 
+def _migrate_line(line: str) -> str:
+    """Return the stored venv line in the current canonical form."""
+    try:
+        return dump_venv(load_venv(line))
+    except (ValueError, KeyError, TypeError):
+        # not a venv (or not one we understand), keep it untouched
+        return line
+
+
+def _needs_interpreter_migration(line: str) -> bool:
+    """Tell if the stored venv has an old interpreter identifier not tried to migrate yet."""
+    return bool(OLD_INTERPRETER_KEY_RE.search(line)) and UNKNOWN_INTERPRETER_KEY not in line
+
+
+def get_fingerprint(requirements, interpreter, options) -> str:
+    """Return an unique identifier for a request of a venv."""
+    reqs = {repo: sorted(str(dep) for dep in deps) for repo, deps in requirements.items()}
+    request = dict(requirements=reqs, interpreter=interpreter, options=options)
+    serialized = json.dumps(request, sort_keys=True)
+    return hashlib.sha256(serialized.encode('utf8')).hexdigest()
+
+
 class VEnvsCache:
     """A cache for virtualenvs."""
 
-    def __init__(self, filepath: Path):
-        """Init."""
-        logger.debug("Using cache index: %r", filepath)
+    def __init__(self, filepath: Path, max_extras=0, lower_layers=()):
+        """Init.
+
+        By default a venv is only used if all it has installed was requested; if `max_extras`
+        is given, venvs with up to that quantity of not requested installed packages are
+        also used.
+
+        The `lower_layers` are the indexes of other caches (e.g. system wide, or baked in a
+        container image) that are also searched for venvs, which are used in place; they are
+        never written.
+        """
+        logger.debug("Using cache index: %r (lower layers: %s)", filepath, lower_layers)
         self.filepath = filepath
+        self.max_extras = max_extras
+        self.lower_layers = [VEnvsCache(layer_filepath) for layer_filepath in lower_layers]
         self.lockpath = filepath.with_name(filepath.name + ".lock")
+        self.locksdir = filepath.with_name("locks")
 
-    def _venv_match(self, installed, requirements):
+    def _venv_match(self, installed, requirements, distributions=None):
         """Return True if what is installed satisfies the requirements.
 
         This method has multiple exit-points, but only for None (because
         if *anything* is not satisified, the venv is no good). Only after
         all was checked, and it didn't exit, the venv is ok and it so
-        returns the satisfying dependencies.
+        returns the satisfying dependencies, and the quantity of extra
+        installed stuff (that was not requested).
+
+        The `distributions` are all that is present in the venv (e.g. what was installed
+        as dependencies of the installed stuff), and can also satisfy PyPI requirements.
         """
+        if distributions is None:
+            distributions = {}
+
         if not requirements:
             # special case for no requirements, where we can't actually
             # check anything: the venv is useful if nothing installed too
-            return None if installed else []
+            return None if installed else ([], 0)
 
         satisfying_deps = []
+        extras_qty = 0
         for repo, req_deps in requirements.items():
             useful_inst = set()
             if repo not in installed:
@@ -82,29 +167,37 @@ class VEnvsCache:
             else:
                 inst_namevers = {(dep, ver) for (dep, ver) in installed[repo].items()}
 
+            transitive_reqs = set()
             for req in req_deps:
+                req_name = req.name if repo == REPO_VCS else canonicalize_name(req.name)
                 for inst_name, inst_ver in inst_namevers:
-                    if req.name == inst_name and req.specifier.contains(inst_ver):
+                    if req_name == inst_name and req.specifier.contains(inst_ver):
                         useful_inst.add((inst_name, inst_ver))
                         break
                 else:
-                    # nothing installed satisfied that requirement
-                    return None
-
-            # assure *all* that is installed is useful for the requirements
-            if useful_inst == inst_namevers:
-                inst_reqs = set()
-                for name, ver in inst_namevers:
-                    if ver is None:
-                        inst_reqs.add(VCSDependency(name))
-                    else:
-                        inst_reqs.add(NameVerDependency(name, ver))
-                satisfying_deps.extend(inst_reqs)
-            else:
+                    dist_ver = distributions.get(req_name) if repo != REPO_VCS else None
+                    if dist_ver is None or not req.specifier.contains(dist_ver):
+                        # nothing installed satisfied that requirement
+                        return None
+                    # already present, brought by other installed stuff
+                    transitive_reqs.add(NameVerDependency(req_name, dist_ver))
+
+            # assure that what is installed is useful for the requirements (*all* of it,
+            # unless some extra stuff is allowed)
+            extras_qty += len(inst_namevers - useful_inst)
+            if extras_qty > self.max_extras:
                 return None
 
+            inst_reqs = set()
+            for name, ver in useful_inst:
+                if ver is None:
+                    inst_reqs.add(VCSDependency(name))
+                else:
+                    inst_reqs.add(NameVerDependency(name, ver))
+            satisfying_deps.extend(inst_reqs | transitive_reqs)
+
         # it did it through!
-        return satisfying_deps
+        return satisfying_deps, extras_qty
 
     def _match_by_uuid(self, current_venvs, uuid):
         """Select a venv matching exactly by uuid."""
@@ -116,7 +209,18 @@ class VEnvsCache:
                 return venv
 
     def _select_better_fit(self, matching_venvs):
-        """Receive a list of matching venvs, and decide which one is the best fit."""
+        """Receive a list of matching venvs, and decide which one is the best fit.
+
+        Each item in the list is the satisfying dependencies and the venv, optionally with
+        the quantity of extra stuff installed in it; the venvs with less extras are always
+        preferred.
+        """
+        extras = [item[2] if len(item) > 2 else 0 for item in matching_venvs]
+        less_extras = min(extras)
+        matching_venvs = [
+            item[:2] for item, extras_qty in zip(matching_venvs, extras)
+            if extras_qty == less_extras]
+
         # keep the venvs in a separate array, to pick up the winner, and the (sorted, to compare
         # each dependency with its equivalent) in other structure to later compare
         venvs = []
@@ -150,6 +254,7 @@ class VEnvsCache:
 
         Several venvs can be found in this case, will return the better fit.
         """
+        options = canonicalize_options(options)
         matching_venvs = []
         for venv_str in current_venvs:
             venv = load_venv(venv_str)
@@ -158,10 +263,15 @@ class VEnvsCache:
             if venv.get('options') != options or venv.get('interpreter') != interpreter:
                 continue
 
+            if venv.get('incomplete'):
+                # its creation failed half way, can only be resumed
+                continue
+
             # requirements complying: result can be None (no comply) or a score to later sort
-            matching = self._venv_match(venv['installed'], requirements)
-            if matching is not None:
-                matching_venvs.append((matching, venv))
+            match = self._venv_match(venv['installed'], requirements, venv.get('distributions'))
+            if match is not None:
+                matching, extras_qty = match
+                matching_venvs.append((matching, venv, extras_qty))
 
         if not matching_venvs:
             return
@@ -185,18 +295,144 @@ class VEnvsCache:
         logger.debug("Found a matching venv! %s", venv)
         return venv['metadata']
 
+    def _lock(self, shared=False):
+        """Lock the index: shared for readers, exclusive for writers."""
+        return filelock(self.lockpath, shared=shared, timeout=INDEX_LOCK_TIMEOUT)
+
+    def _get_lockpath(self, name):
+        """Return the path for a fine grained lock."""
+        self.locksdir.mkdir(exist_ok=True)
+        return self.locksdir / (name + ".lock")
+
+    def get_venv_lockpath(self, uuid):
+        """Return the path of the lock for a specific venv (e.g. for other process to take it)."""
+        return self._get_lockpath("venv-" + uuid)
+
+    def lock_venv(self, uuid):
+        """Lock a specific venv while it's being changed (updated or destroyed)."""
+        return filelock(self.get_venv_lockpath(uuid))
+
+    def lock_request(self, fingerprint):
+        """Lock a venv request, so only one process builds the venv for it."""
+        return filelock(self._get_lockpath("request-" + fingerprint))
+
+    def _read_layers(self):
+        """Yield the venvs of each layer: this cache first, and then the lower layers.
+
+        The lower layers are read-only (so can't be locked), and its venvs that are missing
+        in disk are ignored (as they can't be removed from there).
+        """
+        with self._lock(shared=True):
+            lines = self._read_cache()
+        if any(_needs_interpreter_migration(line) for line in lines):
+            # stored by an old version, need to be migrated to be found
+            self.compact()
+            with self._lock(shared=True):
+                lines = self._read_cache()
+        yield lines
+        for layer in self.lower_layers:
+            lines = layer._read_cache()
+            yield [line for line in lines if load_venv(line)['metadata']['env_path'].exists()]
+
+    def in_lower_layer(self, env_path):
+        """Tell if the venv belongs to a lower (read-only) layer."""
+        return any(Path(env_path).parent == layer.filepath.parent for layer in self.lower_layers)
+
     def get_venv(self, requirements=None, interpreter='', uuid='', options=None):
-        """Find a venv that serves these requirements, if any."""
-        lines = self._read_cache()
-        return self._select(lines, requirements, interpreter, uuid=uuid, options=options)
+        """Find a venv that serves these requirements, if any.
+
+        The layers are searched in order, so a venv in a lower layer is used only if there
+        isn't one in the upper layers.
+        """
+        for lines in self._read_layers():
+            venv = self._select(lines, requirements, interpreter, uuid=uuid, options=options)
+            if venv is not None:
+                return venv
+
+    def get_entry(self, uuid):
+        """Return the whole cache entry (not only its metadata) of a venv, if any."""
+        for lines in self._read_layers():
+            venv = self._match_by_uuid(lines, uuid)
+            if venv is not None:
+                return venv
+
+    @contextmanager
+    def claim_incomplete(self, requirements, interpreter, options):
+        """Find an incomplete venv that can be resumed for these requirements, if any.
+
+        Yield its metadata and what is installed there (None if there isn't any). The venv is
+        locked meanwhile, so no other process resumes it too; it's kept in the cache until
+        it's stored again, so it can be resumed later if this is interrupted.
+        """
+        options = canonicalize_options(options)
+        with self._lock(shared=True):
+            lines = self._read_cache()
+
+        for line in reversed(lines):
+            venv = load_venv(line)
+            if not venv.get('incomplete'):
+                continue
+            if venv.get('options') != options or venv.get('interpreter') != interpreter:
+                continue
+            if not self._all_requested(venv['installed'], requirements):
+                continue
+
+            env_path = venv['metadata']['env_path']
+            with trylock(self._get_lockpath("venv-" + env_path.name)) as locked:
+                if not locked:
+                    logger.debug("Incomplete venv being resumed by other process: %s", env_path)
+                    continue
+                # check again, it may have been resumed or removed before locking it
+                with self._lock(shared=True):
+                    still_there = line in self._read_cache()
+                if not still_there:
+                    continue
+                if not env_path.exists():
+                    logger.debug("Missing directory for the incomplete venv: %s", env_path)
+                    self.remove(env_path)
+                    continue
+
+                logger.debug("Found an incomplete venv to resume: %s", env_path)
+                yield venv['metadata'], venv['installed']
+                return
+        yield None
+
+    def _all_requested(self, installed, requirements):
+        """Tell if everything installed satisfies some of the requirements."""
+        for repo, inst_deps in installed.items():
+            for inst_name, inst_ver in inst_deps.items():
+                for req in requirements.get(repo, []):
+                    req_name = req.name if repo == REPO_VCS else canonicalize_name(req.name)
+                    if req_name == inst_name and req.specifier.contains(inst_ver):
+                        break
+                else:
+                    return False
+        return True
+
+    def get_entries(self):
+        """Return the whole cache entries of all the venvs."""
+        with self._lock(shared=True):
+            lines = self._read_cache()
+        return [load_venv(line) for line in lines]
 
     def get_venvs_metadata(self):
         """Yield metadata of each existing venv."""
-        for line in self._read_cache():
+        with self._lock(shared=True):
+            lines = self._read_cache()
+        for line in lines:
             yield load_venv(line)['metadata']
 
-    def store(self, installed_stuff, metadata, interpreter, options):
-        """Store the virtualenv metadata for the indicated installed_stuff."""
+    def store(self, installed_stuff, metadata, interpreter, options, fingerprint=None,
+              distributions=None, incomplete=False, replace=False):
+        """Store the virtualenv metadata for the indicated installed_stuff.
+
+        Optionally, all the `distributions` present in the virtualenv are also stored, so
+        later requests can be served by dependencies that were not explicitly installed.
+
+        If the virtualenv is `incomplete` (its creation failed half way) it's only stored
+        to be resumed later, it's never used as it is. If it `replace`s a stored one (e.g.
+        an incomplete virtualenv that was resumed), the old entry is removed in the same write.
+        """
         new_content = {
             'timestamp': int(time.mktime(time.localtime())),
             'installed': installed_stuff,
@@ -204,31 +440,234 @@ class VEnvsCache:
             'interpreter': interpreter,
             'options': options
         }
+        if fingerprint is not None:
+            new_content['fingerprint'] = fingerprint
+        if distributions is not None:
+            new_content['distributions'] = distributions
+        if incomplete:
+            new_content['incomplete'] = True
         logger.debug("Storing installed=%s metadata=%s interpreter=%s options=%s",
                      installed_stuff, metadata, interpreter, options)
-        with filelock(self.lockpath):
-            self._write_cache([dump_venv(new_content)], append=True)
+        lines = [dump_venv(new_content)]
+        if replace:
+            lines.insert(0, json.dumps({TOMBSTONE_KEY: str(metadata['env_path'])}))
+        # appends are atomic, so several processes can store at the same time
+        with self._lock(shared=True):
+            self._write_cache(lines, append=True)
+
+    def update(self, env_path: Path, **changes):
+        """Update the stored information of a virtualenv."""
+        self._update(env_path, lambda venv: venv.update(changes))
+
+    def add_installed(self, env_path: Path, installed, distributions):
+        """Record more dependencies installed in the virtualenv, with all its distributions."""
+        def add(venv):
+            for repo, repo_installed in installed.items():
+                venv['installed'].setdefault(repo, {}).update(repo_installed)
+            venv['distributions'] = distributions
+        self._update(env_path, add)
+
+    def _update(self, env_path: Path, change):
+        """Change the stored information of a virtualenv, with the given function.
+
+        The updated venv is appended after a tombstone for the old one, in a single write;
+        the venv is locked meanwhile, so other processes can keep using the index.
+        """
+        with self.lock_venv(Path(env_path).name), self._lock(shared=True):
+            for line in self._read_cache():
+                venv = load_venv(line)
+                if venv['metadata']['env_path'] == Path(env_path):
+                    break
+            else:
+                logger.debug("Virtualenv to update not found in cache: %s", env_path)
+                return
+            change(venv)
+            logger.debug("Updated virtualenv in cache: %s %s", env_path, venv)
+            tombstone = json.dumps({TOMBSTONE_KEY: str(env_path)})
+            self._write_cache([tombstone, dump_venv(venv)], append=True)
 
     def remove(self, env_path: Path):
-        """Remove metadata for a given virtualenv from cache."""
-        with filelock(self.lockpath):
-            cache = self._read_cache()
-            logger.debug("Removing virtualenv from cache: %s", env_path)
-            lines = [line for line in cache if load_venv(line)["metadata"]["env_path"] != env_path]
-            self._write_cache(lines)
+        """Remove metadata for a given virtualenv from cache.
+
+        The removal is recorded appending a tombstone to the index (so it doesn't block
+        other processes), which is purged later when compacting.
+        """
+        logger.debug("Removing virtualenv from cache: %s", env_path)
+        tombstone = json.dumps({TOMBSTONE_KEY: str(env_path)})
+        with self._lock(shared=True):
+            self._write_cache([tombstone], append=True)
+            _, tombstones_qty = self._read_index()
+        if tombstones_qty >= COMPACTION_THRESHOLD:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the index with only the live venvs, purging all the tombstones.
+
+        The venvs are also migrated to the current canonical form, if needed, and the
+        fine grained locks of venvs and requests that are not in the index anymore are
+        removed.
+        """
+        with self._lock():
+            lines, tombstones_qty = self._read_index()
+            migrated = [_migrate_line(line) for line in lines]
+            migrated = self._migrate_interpreters(migrated)
+            if tombstones_qty or migrated != lines:
+                logger.debug("Compacting index, purging %d tombstones", tombstones_qty)
+                self._write_cache(migrated)
+            self._prune_locks(migrated)
+
+    def _migrate_interpreters(self, lines):
+        """Identify the interpreter of the venvs stored by old versions as it's done now.
+
+        The old identifier is the interpreter's path, so it's probed. If that's not possible
+        (it's not there anymore, or the probe failed) the venv is kept as it is, marked to
+        not try again until the next compaction; it will be removed when cleaning the
+        unused venvs.
+        """
+        new_keys = {}
+        migrated = []
+        for line in lines:
+            if not OLD_INTERPRETER_KEY_RE.search(line):
+                migrated.append(line)
+                continue
+            try:
+                venv = load_venv(line)
+                old_key = venv['interpreter']
+            except (ValueError, KeyError, TypeError):
+                migrated.append(line)
+                continue
+
+            if old_key not in new_keys:
+                new_keys[old_key] = None
+                if os.path.exists(old_key):
+                    try:
+                        new_keys[old_key], _ = helpers.get_interpreter_version(old_key)
+                    except FadesError:
+                        pass
+            if new_keys[old_key] is None:
+                logger.debug("Interpreter %r not available, can't migrate its venvs", old_key)
+                venv[UNKNOWN_INTERPRETER_KEY] = True
+            else:
+                venv['interpreter'] = new_keys[old_key]
+                venv.pop(UNKNOWN_INTERPRETER_KEY, None)
+                # it was calculated with the old identifier, so it can't match any request
+                venv.pop('fingerprint', None)
+            migrated.append(dump_venv(venv))
+        return migrated
+
+    def _prune_locks(self, lines):
+        """Remove the lock files of the venvs and requests not present in the index.
+
+        Those in use are kept (e.g. a request whose venv is being built right now).
+        """
+        if not self.locksdir.exists():
+            return
+        live = set()
+        for line in lines:
+            try:
+                venv = json.loads(line)
+                live.add("venv-" + Path(venv['metadata']['env_path']).name + ".lock")
+            except (ValueError, KeyError, TypeError):
+                continue
+            if venv.get('fingerprint'):
+                live.add("request-" + venv['fingerprint'] + ".lock")
+
+        removed = 0
+        for lockpath in self.locksdir.iterdir():
+            if lockpath.name not in live and remove_lockfile(lockpath):
+                removed += 1
+        logger.debug("Removed %d unused lock files", removed)
+
+    def _read_index(self):
+        """Read the index, returning the live venvs lines and how many tombstones were found.
+
+        Lines not ended in newline are ignored: they are being appended right now by
+        other process.
+        """
+        if not self.filepath.exists():
+            logger.debug("Index not found, starting empty")
+            return [], 0
+
+        with open(self.filepath, 'rt', encoding='utf8') as fh:
+            raw_lines = [x.strip() for x in fh if x.endswith('\n')]
+
+        lines = [line for line in raw_lines if not line.startswith(TOMBSTONE_PREFIX)]
+        tombstones_qty = len(raw_lines) - len(lines)
+        if not tombstones_qty:
+            return lines, 0
+
+        # a tombstone only kills the venvs stored *before* it (the same path may be reused)
+        removed = set()
+        live_lines = []
+        for line in reversed(raw_lines):
+            if line.startswith(TOMBSTONE_PREFIX):
+                removed.add(json.loads(line)[TOMBSTONE_KEY])
+                continue
+            try:
+                env_path = json.loads(line)["metadata"]["env_path"]
+            except (ValueError, KeyError, TypeError):
+                env_path = None
+            if env_path not in removed:
+                live_lines.append(line)
+        live_lines.reverse()
+        return live_lines, tombstones_qty
 
     def _read_cache(self):
         """Read virtualenv metadata from cache."""
-        if self.filepath.exists():
-            with open(self.filepath, 'rt', encoding='utf8') as fh:
-                lines = [x.strip() for x in fh]
-        else:
-            logger.debug("Index not found, starting empty")
-            lines = []
+        lines, _ = self._read_index()
         return lines
 
     def _write_cache(self, lines, append=False):
-        """Write virtualenv metadata to cache."""
-        mode = 'at' if append else 'wt'
-        with open(self.filepath, mode, encoding='utf8') as fh:
-            fh.writelines(line + '\n' for line in lines)
+        """Write virtualenv metadata to cache.
+
+        A full rewrite is done to a temporary file which then replaces the index, so
+        readers never find it half written.
+        """
+        if append:
+            # use a single write in append mode, which is atomic
+            content = ''.join(line + '\n' for line in lines).encode('utf8')
+            fd = os.open(self.filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, content)
+            finally:
+                os.close(fd)
+        else:
+            atomic_write(self.filepath, lines)
+
+
+class SharedVEnvsCache(VEnvsCache):
+    """A cache for virtualenvs in a network filesystem, shared by several machines.
+
+    As flock and concurrent appends are not reliable there, the writers take a lease lock and
+    always rewrite the whole index (atomically, so readers don't need to lock).
+    """
+
+    def __init__(self, filepath: Path):
+        super().__init__(filepath)
+        self._lease_held = False
+
+    @contextmanager
+    def _lock(self, shared=False):
+        """Lock the index only for writers, supporting nested locking."""
+        if shared or self._lease_held:
+            yield
+            return
+        with leaselock(self.lockpath, timeout=INDEX_LOCK_TIMEOUT):
+            self._lease_held = True
+            try:
+                yield
+            finally:
+                self._lease_held = False
+
+    def _write_cache(self, lines, append=False):
+        """Write virtualenv metadata to cache, never appending."""
+        with self._lock():
+            if append:
+                lines = self._read_cache() + lines
+            atomic_write(self.filepath, lines)
+
+    def get_matching_entry(self, requirements, interpreter, options):
+        """Return the whole cache entry of a venv that serves these requirements, if any."""
+        venv = self._match_by_requirements(self._read_cache(), requirements, interpreter, options)
+        if venv is not None and venv['metadata']['env_path'].exists():
+            return venv
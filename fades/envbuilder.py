@@ -16,18 +16,26 @@
 
 """Tools to create, destroy and handle usage of virtual environments."""
 
+import hashlib
+import importlib.metadata
+import json
 import logging
 import os
 import shutil
+import sys
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 from uuid import uuid4
 from venv import EnvBuilder
 
+from packaging.utils import canonicalize_name
+
 from fades import FadesError, REPO_PYPI, REPO_VCS
 from fades import helpers, cache
-from fades.pipmanager import PipManager
-from fades.multiplatform import filelock
+from fades.parsing import VCSDependency
+from fades.pipmanager import PipManager, get_shared_pip
+from fades.multiplatform import atomic_write, filelock, semaphore
 
 logger = logging.getLogger(__name__)
 
@@ -43,9 +51,10 @@ class _FadesEnvBuilder(EnvBuilder):
     and ``destroy_env``.
     """
 
-    def __init__(self):
-        basedir = helpers.get_basedir()
-        self.env_path = basedir / str(uuid4())
+    def __init__(self, env_path=None):
+        if env_path is None:
+            env_path = helpers.get_basedir() / str(uuid4())
+        self.env_path = env_path
         self.env_bin_path = Path(".")
         logger.debug("Env will be created at: %s", self.env_path)
 
@@ -88,6 +97,9 @@ class _FadesEnvBuilder(EnvBuilder):
     def create_env(self, interpreter, is_current, options):
         """Create the virtual environment and return its info."""
         venv_options = options['venv_options']
+        if options.get('shared_pip'):
+            # dependencies will be installed using a pip shared by all venvs
+            self.pip_installed = self.with_pip = False
         if is_current:
             # apply venv options
             logger.debug("Creating virtual environment internally; options=%s", venv_options)
@@ -101,10 +113,8 @@ class _FadesEnvBuilder(EnvBuilder):
             self.create_with_external_venv(interpreter, venv_options)
         logger.debug("env_bin_path: %s", self.env_bin_path)
 
-        # Re check if pip was installed (supporting both binary and .exe for Windows)
-        pip_bin = self.env_bin_path / "pip"
-        pip_exe = self.env_bin_path / "pip.exe"
-        if not (pip_bin.exists() or pip_exe.exists()):
+        # Re check if pip was installed
+        if not _pip_is_installed(self.env_bin_path):
             logger.debug("pip isn't installed in the venv, setting pip_installed=False")
             self.pip_installed = False
 
@@ -115,63 +125,394 @@ class _FadesEnvBuilder(EnvBuilder):
         self.env_bin_path = Path(context.bin_path)
 
 
-def create_venv(requested_deps, interpreter, is_current, options, pip_options, avoid_pip_upgrade):
-    """Create a new virtualvenv with the requirements of this script."""
-    # create virtual environment
+def relocate_venv(env_path, old_env_path):
+    """Fix a venv that was moved from its original location.
+
+    The venv structure doesn't depend on where it lives, but scripts' shebangs, activation
+    scripts and the venv config hold the absolute path where it was created.
+    """
+    logger.debug("Relocating virtual environment from %s to %s", old_env_path, env_path)
+    old_path = str(old_env_path).encode('utf8')
+    new_path = str(env_path).encode('utf8')
+    candidates = [env_path / "pyvenv.cfg"]
+    candidates.extend(helpers.get_env_bin_path(env_path).iterdir())
+    for filepath in candidates:
+        if filepath.is_symlink() or not filepath.is_file():
+            continue
+        content = filepath.read_bytes()
+        if old_path not in content or b'\0' in content:
+            # nothing to fix, or binary file
+            continue
+        filepath.write_bytes(content.replace(old_path, new_path))
+
+
+def _copy_venv(src_path, dest_path):
+    """Copy the venv to its new location, atomically (so it's never used half copied)."""
+    temp_path = dest_path.with_name(".copying-" + dest_path.name)
+    try:
+        shutil.copytree(src_path, temp_path, symlinks=True)
+        temp_path.rename(dest_path)
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    relocate_venv(dest_path, src_path)
+
+
+def materialize_venv(venv, venvscache):
+    """Copy a venv from the shared cache to the local one, where it's kept.
+
+    Return the metadata of the local venv, or None if it couldn't be copied.
+    """
+    shared_env_path = venv['metadata']['env_path']
+    env_path = helpers.get_basedir() / str(uuid4())
+    logger.info("Copying the virtualenv from the shared cache")
+    logger.debug("Copying virtual environment from %s to %s", shared_env_path, env_path)
+    try:
+        _copy_venv(shared_env_path, env_path)
+    except OSError as error:
+        logger.warning("Error copying the virtualenv from the shared cache: %s", error)
+        return
+
+    metadata = dict(
+        venv['metadata'], env_path=env_path, env_bin_path=helpers.get_env_bin_path(env_path))
+    venvscache.store(
+        venv['installed'], metadata, venv['interpreter'], venv['options'],
+        fingerprint=venv.get('fingerprint'), distributions=venv.get('distributions'))
+    return metadata
+
+
+def publish_venv(venv, shared_cache):
+    """Copy a local venv to the shared cache, so other machines can use it."""
+    fingerprint = venv.get('fingerprint')
+    if fingerprint is not None and any(
+            entry.get('fingerprint') == fingerprint for entry in shared_cache.get_entries()):
+        logger.debug("Virtualenv already published in the shared cache by other machine")
+        return
+
+    env_path = venv['metadata']['env_path']
+    shared_env_path = shared_cache.filepath.parent / env_path.name
+    logger.debug("Copying virtual environment from %s to %s", env_path, shared_env_path)
+    try:
+        _copy_venv(env_path, shared_env_path)
+    except OSError as error:
+        logger.warning("Error copying the virtualenv to the shared cache: %s", error)
+        return
+
+    metadata = dict(
+        venv['metadata'], env_path=shared_env_path,
+        env_bin_path=helpers.get_env_bin_path(shared_env_path))
+    shared_cache.store(
+        venv['installed'], metadata, venv['interpreter'], venv['options'],
+        fingerprint=fingerprint, distributions=venv.get('distributions'))
+
+
+def _pip_is_installed(env_bin_path):
+    """Tell if pip is installed in the venv (supporting both binary and .exe for Windows)."""
+    return (env_bin_path / "pip").exists() or (env_bin_path / "pip.exe").exists()
+
+
+class SparePool:
+    """A pool of ready to use empty venvs, to hide the venv creation latency.
+
+    Spare venvs are kept for each combination of interpreter and options (as the venvs
+    depend on both), and claimed atomically renaming them to a new UUID.
+    """
+
+    def __init__(self, size, interpreter, options):
+        self.size = size
+        key = json.dumps(dict(interpreter=interpreter, options=options), sort_keys=True)
+        key_hash = hashlib.sha256(key.encode('utf8')).hexdigest()[:16]
+        self.pooldir = helpers.get_basedir() / "spares" / key_hash
+
+    def _get_spares(self):
+        """Return the spare venvs ready to use."""
+        if not self.pooldir.exists():
+            return []
+        return sorted(path for path in self.pooldir.iterdir() if not path.name.startswith('.'))
+
+    def claim(self):
+        """Get a spare venv, if any, moving it to its final location; return its data."""
+        for spare_path in self._get_spares():
+            env_path = helpers.get_basedir() / str(uuid4())
+            try:
+                spare_path.rename(env_path)
+            except FileNotFoundError:
+                # other process claimed it first
+                continue
+            logger.debug("Claimed spare virtual environment %s", spare_path)
+            relocate_venv(env_path, spare_path)
+            env_bin_path = helpers.get_env_bin_path(env_path)
+            return {
+                'env_path': env_path,
+                'env_bin_path': env_bin_path,
+                'pip_installed': _pip_is_installed(env_bin_path),
+            }
+        logger.debug("No spare virtual environments available")
+
+    def give_back(self, venv_data):
+        """Put an unused empty venv in the pool, if it's not full; return if it was done."""
+        self.pooldir.mkdir(parents=True, exist_ok=True)
+        with filelock(self.pooldir / ".fill.lock"):
+            if len(self._get_spares()) >= self.size:
+                return False
+            env_path = venv_data['env_path']
+            spare_path = self.pooldir / env_path.name
+            env_path.rename(spare_path)
+            relocate_venv(spare_path, env_path)
+        logger.debug("Virtual environment %s recycled to the spare pool", env_path)
+        return True
+
+    def fill(self, interpreter, is_current, options):
+        """Create spare venvs until reaching the pool size."""
+        self.pooldir.mkdir(parents=True, exist_ok=True)
+        with filelock(self.pooldir / ".fill.lock"):
+            missing = self.size - len(self._get_spares())
+            for _ in range(missing):
+                uuid = str(uuid4())
+                building_path = self.pooldir / ('.building-' + uuid)
+                env = _FadesEnvBuilder(building_path)
+                try:
+                    env.create_env(interpreter, is_current, options)
+                except Exception:
+                    shutil.rmtree(building_path, ignore_errors=True)
+                    raise
+                # only expose the venv when it's complete
+                spare_path = self.pooldir / uuid
+                building_path.rename(spare_path)
+                relocate_venv(spare_path, building_path)
+                logger.debug("Created spare virtual environment %s", spare_path)
+
+    def replenish_in_background(self, interpreter, options):
+        """Launch other fades process to fill the pool."""
+        cmd = [sys.executable, "-m", "fades", "--fill-spare-venvs", "-q",
+               "--spare-venvs={}".format(self.size)]
+        if interpreter is not None:
+            cmd.append("--python={}".format(interpreter))
+        cmd.extend("--venv-options={}".format(option) for option in options['venv_options'])
+        if options.get('shared_pip'):
+            cmd.append("--shared-pip")
+        helpers.spawn_detached(cmd)
+
+
+def prepare_venv(interpreter, is_current, options, spare_pool=None):
+    """Create an empty virtualenv, or get it from the spare pool if possible."""
+    if spare_pool is not None:
+        venv_data = spare_pool.claim()
+        if venv_data is not None:
+            return venv_data
+
     env = _FadesEnvBuilder()
     env_path, env_bin_path, pip_installed = env.create_env(interpreter, is_current, options)
     venv_data = {}
     venv_data['env_path'] = env_path
     venv_data['env_bin_path'] = env_bin_path
     venv_data['pip_installed'] = pip_installed
+    return venv_data
 
-    # install deps
-    installed = {}
+
+def recycle_venv(venv_data, spare_pool=None):
+    """Get rid of a prepared but unused venv: put it in the spare pool or destroy it."""
+    if spare_pool is not None and spare_pool.give_back(venv_data):
+        return
+    destroy_venv(venv_data['env_path'])
+
+
+class IncompleteVenvError(FadesError):
+    """The venv creation failed, but some dependencies were installed."""
+
+    def __init__(self, venv_data, installed):
+        super().__init__('Dependency installation failed')
+        self.venv_data = venv_data
+        self.installed = installed
+
+
+def get_lockfile_path(fingerprint):
+    """Return the path for the lockfile of a request."""
+    return helpers.get_basedir() / "lockfiles" / (fingerprint + ".txt")
+
+
+def get_distributions(env_path):
+    """Return the name and version of all the distributions present in the venv."""
+    site_packages = [str(path) for path in helpers.get_env_site_packages(Path(env_path))]
+    distributions = {}
+    for dist in importlib.metadata.distributions(path=site_packages):
+        name = dist.metadata['Name']
+        if name is not None:
+            distributions[canonicalize_name(name)] = dist.version
+    return distributions
+
+
+def compile_in_background(venv_data):
+    """Compile to bytecode all the venv's installed modules, in background and in parallel."""
+    site_packages = helpers.get_env_site_packages(venv_data['env_path'])
+    if not site_packages:
+        logger.warning("No site-packages found to compile in %s", venv_data['env_path'])
+        return
+    python_exe = venv_data['env_bin_path'] / "python"
+    cmd = [python_exe, "-m", "compileall", "-q", "-j", "0"] + site_packages
+    helpers.spawn_detached(cmd)
+
+
+@contextmanager
+def build_slot(max_builds):
+    """Context manager to not build more than `max_builds` venvs at the same time in the machine.
+
+    Without a limit (None or zero) it just lets go.
+    """
+    if not max_builds:
+        yield
+        return
+
+    with semaphore(helpers.get_basedir() / 'build-slots', max_builds) as waited:
+        if waited >= 1:
+            logger.info("Waited %.1f seconds for other virtualenvs builds to finish", waited)
+        else:
+            logger.debug("Got a build slot after %.3f seconds", waited)
+        yield
+
+
+def create_venv(
+        requested_deps, interpreter, is_current, options, pip_options, avoid_pip_upgrade,
+        spare_pool=None, venv_data=None, deferred_compile=False, parallel_install=False,
+        fingerprint=None, already_installed=None):
+    """Create a new virtualvenv with the requirements of this script.
+
+    If `venv_data` is given, that already prepared empty virtualenv is used. If
+    `deferred_compile` is set, modules are not compiled to bytecode when installed (the
+    caller is in charge of it). If `parallel_install` is set, PyPI dependencies are installed
+    all together, in parallel.
+
+    If the request `fingerprint` is given, what is resolved when installing from PyPI is
+    saved pinned with hashes, and replayed without resolving anything in a future rebuild
+    for the same request.
+
+    If the installation fails after some dependencies were installed, the venv is kept
+    and IncompleteVenvError is raised; its creation can be resumed later passing it
+    and what was `already_installed` there.
+    """
+    if venv_data is None:
+        venv_data = prepare_venv(interpreter, is_current, options, spare_pool)
+    env_path = venv_data['env_path']
+    env_bin_path = venv_data['env_bin_path']
+    pip_installed = venv_data['pip_installed']
+
+    if options.get('shared_pip'):
+        shared_pip = get_shared_pip(avoid_pip_upgrade)
+    else:
+        shared_pip = None
+
+    # the lockfile is not captured if pip is not upgraded, as old ones can't report, nor
+    # when resuming, as what was installed before would be missing
+    if already_installed is None:
+        already_installed = {}
+    lockfile = None if fingerprint is None else get_lockfile_path(fingerprint)
+    capture_lock = not (
+        lockfile is None or parallel_install or avoid_pip_upgrade or already_installed)
+
+    # install deps (starting from what was installed before, as it's still there even if
+    # the installation fails before getting to that repo)
+    installed = {repo: dict(repo_installed) for repo, repo_installed in already_installed.items()}
     for repo in requested_deps.keys():
         if repo in (REPO_PYPI, REPO_VCS):
             mgr = PipManager(
                 env_bin_path, pip_installed=pip_installed, options=pip_options,
-                avoid_pip_upgrade=avoid_pip_upgrade)
+                avoid_pip_upgrade=avoid_pip_upgrade, shared_pip=shared_pip,
+                deferred_compile=deferred_compile, capture_lock=capture_lock)
         else:
             logger.warning("Install from %r not implemented", repo)
             continue
-        installed[repo] = {}
 
         repo_requested = requested_deps[repo]
         logger.debug("Installing dependencies for repo %r: requested=%s", repo, repo_requested)
-        for dependency in repo_requested:
+        repo_installed = already_installed.get(repo, {})
+        pending = [
+            dependency for dependency in repo_requested
+            if not _is_installed(dependency, repo_installed)]
+        if len(pending) < len(repo_requested):
+            logger.debug("Already installed from a previous attempt: %s", repo_installed)
+
+        replayed = False
+        if repo == REPO_PYPI and lockfile is not None and lockfile.exists():
             try:
-                mgr.install(dependency)
+                mgr.install_locked(lockfile)
             except Exception:
+                logger.warning("Couldn't install from the lock file, resolving again")
+            else:
+                replayed = True
+
+        done = []
+        try:
+            if replayed:
+                pass
+            elif parallel_install and repo == REPO_PYPI and mgr.supports_parallel_install():
+                mgr.install_parallel(pending)
+            else:
+                for dependency in pending:
+                    mgr.install(dependency)
+                    done.append(dependency)
+        except Exception:
+            installed[repo] = dict(repo_installed)
+            installed[repo].update(_get_installed_versions(mgr, repo, done))
+            if not any(installed.values()):
                 logger.debug("Installation Step failed, removing virtual environment")
                 destroy_venv(env_path)
                 raise FadesError('Dependency installation failed')
+            logger.debug("Installation Step failed, keeping the incomplete virtual environment")
+            raise IncompleteVenvError(venv_data, installed)
 
-            if repo == REPO_VCS:
-                # no need to request the installed version, as we'll always compare
-                # to the url itself
-                project = dependency.url
-                version = None
-            else:
-                # always store the installed dependency, as in the future we'll select the venv
-                # based on what is installed, not what used requested (remember that user may
-                # request >, >=, etc!)
-                project = dependency.name
-                version = mgr.get_version(project)
-            installed[repo][project] = version
+        if repo == REPO_PYPI and capture_lock and not replayed:
+            lock_lines = mgr.get_lock_lines()
+            if lock_lines:
+                logger.debug("Saving resolved dependencies to %s", lockfile)
+                lockfile.parent.mkdir(exist_ok=True)
+                atomic_write(lockfile, lock_lines)
+
+        installed[repo] = _get_installed_versions(mgr, repo, repo_requested)
 
         logger.debug("Installed dependencies: %s", installed)
     return venv_data, installed
 
 
+def _get_installed_versions(mgr, repo, dependencies):
+    """Return the installed version of each dependency."""
+    installed = {}
+    for dependency in dependencies:
+        if repo == REPO_VCS:
+            # no need to request the installed version, as we'll always compare
+            # to the url itself
+            project = dependency.url
+            version = None
+        else:
+            # always store the installed dependency, as in the future we'll select the venv
+            # based on what is installed, not what used requested (remember that user may
+            # request >, >=, etc!)
+            project = canonicalize_name(dependency.name)
+            version = mgr.get_version(project)
+        installed[project] = version
+    return installed
+
+
+def _is_installed(dependency, installed):
+    """Tell if the dependency is satisfied by what is installed."""
+    if isinstance(dependency, VCSDependency):
+        return dependency.url in installed
+    version = installed.get(canonicalize_name(dependency.name))
+    return version is not None and dependency.specifier.contains(version)
+
+
 def destroy_venv(env_path, venvscache=None):
     """Destroy a venv."""
-    # remove the venv itself in disk
-    logger.debug("Destroying virtual environment at: %s", env_path)
-    shutil.rmtree(env_path, ignore_errors=True)
+    if venvscache is None:
+        logger.debug("Destroying virtual environment at: %s", env_path)
+        shutil.rmtree(env_path, ignore_errors=True)
+        return
+
+    with venvscache.lock_venv(Path(env_path).name):
+        # remove the venv itself in disk
+        logger.debug("Destroying virtual environment at: %s", env_path)
+        shutil.rmtree(env_path, ignore_errors=True)
 
-    # remove venv from cache
-    if venvscache is not None:
+        # remove venv from cache
         venvscache.remove(env_path)
 
 
@@ -186,8 +527,10 @@ class UsageManager:
 
     def store_usage_stat(self, venv_data, cache):
         """Log an usage record for venv_data."""
-        with open(self.stat_file_path, 'at') as f:
-            self._write_venv_usage(f, venv_data)
+        # appends can be done in parallel, only need to exclude the compaction
+        with filelock(self.stat_file_lock, shared=True):
+            with open(self.stat_file_path, 'at') as f:
+                self._write_venv_usage(f, venv_data)
 
     def _create_initial_usage_file_if_not_exists(self):
         if not self.stat_file_path.exists():
@@ -231,16 +574,32 @@ class UsageManager:
                         # usage_file wasn't updated.
                         continue
                     env_path = venv_meta['env_path']
+                    if self.venvscache.in_lower_layer(env_path):
+                        # not ours to remove
+                        logger.debug("Keeping virtual environment from a read-only cache "
+                                     "layer: %s", env_path)
+                        continue
                     logger.info("Destroying virtual environment at: %s", env_path)
                     destroy_venv(env_path, self.venvscache)
 
             self._write_compacted_dict_usage_to_file(venvs_dict)
+        self.venvscache.compact()
+
+    def get_usage_counts(self):
+        """Return how many times each venv (by uuid) was used since the last compaction."""
+        counts = {}
+        with filelock(self.stat_file_lock, shared=True):
+            with open(self.stat_file_path, 'rt') as fh:
+                for line in fh:
+                    if line.strip():
+                        uuid = line.split()[0]
+                        counts[uuid] = counts.get(uuid, 0) + 1
+        return counts
 
     def _get_compacted_dict_usage_from_file(self):
         all_lines = open(self.stat_file_path).readlines()
         return dict(x.split() for x in all_lines)
 
     def _write_compacted_dict_usage_to_file(self, dict_usage):
-        with open(self.stat_file_path, 'wt') as file_:
-            for uuid, date in dict_usage.items():
-                file_.write('{} {}\n'.format(uuid, date))
+        lines = ['{} {}'.format(uuid, date) for uuid, date in dict_usage.items()]
+        atomic_write(self.stat_file_path, lines)
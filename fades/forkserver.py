@@ -0,0 +1,283 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Run the child program forking it from a server that already imported its dependencies.
+
+The server is this same module run by the virtualenv's Python (so it must only use the
+stdlib): it imports the indicated modules and then waits for requests in an unix socket.
+For each request it forks, and the child takes the client's stdin, stdout and stderr
+(passed through the socket) and runs the program. The server leaves after some time
+without requests.
+
+The client part is used by fades, which gets the child's pid (to send it the signals)
+and its returncode.
+"""
+
+import array
+import atexit
+import importlib
+import json
+import logging
+import os
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# the server leaves after these seconds without being used
+IDLE_TIMEOUT = 15 * 60
+
+# the limit for the socket path in most systems, minus some margin
+MAX_SOCKET_PATH = 90
+
+# stdin, stdout and stderr
+STDIO_FDS = [0, 1, 2]
+
+# forking and passing file descriptors is needed (e.g. not available in Windows)
+SUPPORTED = hasattr(os, 'fork') and hasattr(socket, 'send_fds')
+
+
+class ForkedProcess:
+    """The child program running forked from the server, handled like a subprocess."""
+
+    def __init__(self, sock, pid):
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+        self.pid = pid
+        self.returncode = None
+
+    def wait(self):
+        """Wait the child to finish, return its returncode."""
+        if self.returncode is None:
+            line = self._reader.readline()
+            self._reader.close()
+            self._sock.close()
+            if line:
+                self.returncode = int(line)
+            else:
+                logger.error("Lost the connection with the fork server")
+                self.returncode = 1
+        return self.returncode
+
+
+def get_server_command(python_exe, socket_path, modules):
+    """Return the command to start the server for that socket, pre-importing the modules."""
+    return [str(python_exe), __file__, str(socket_path)] + list(modules)
+
+
+def run(socket_path, argv, is_module):
+    """Run the child forking it from the server listening in the socket.
+
+    The child gets this process' stdio, environment and current directory. Return the
+    ForkedProcess, or None if it couldn't be started (e.g. there is no server yet).
+    """
+    request = dict(argv=argv, module=is_module, env=dict(os.environ), cwd=os.getcwd())
+    payload = json.dumps(request).encode('utf8') + b'\n'
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+        socket.send_fds(sock, [payload], STDIO_FDS)
+        reader = sock.makefile('rb')
+        line = reader.readline()
+        reader.close()
+        pid = int(line)
+    except (OSError, ValueError) as error:
+        logger.debug("Couldn't run the child in the fork server at %s: %r", socket_path, error)
+        sock.close()
+        return None
+    logger.debug("Child forked from the server at %s, pid=%d", socket_path, pid)
+    return ForkedProcess(sock, pid)
+
+
+def _receive_request(conn):
+    """Receive the request and the stdio file descriptors."""
+    fds = array.array('i')
+    msg, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_SPACE(len(STDIO_FDS) * fds.itemsize))
+    for level, type_, data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    while msg and not msg.endswith(b'\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        msg += chunk
+    return json.loads(msg.decode('utf8')), list(fds)
+
+
+def _print_exception(exc):
+    """Print the exception traceback from the child program on, as Python does."""
+    own_files = (__file__, runpy.__file__, '<frozen runpy>')
+    tb = exc.__traceback__
+    while tb is not None and tb.tb_frame.f_code.co_filename in own_files:
+        tb = tb.tb_next
+    traceback.print_exception(type(exc), exc, tb)
+
+
+def _run_child(request, fds):
+    """Take the client's stdio, environment and current dir, and run the program; never return."""
+    for target_fd, fd in zip(STDIO_FDS, fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+    sys.stdin = open(0, 'rt', closefd=False)
+    sys.stdout = open(1, 'wt', buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, 'wt', buffering=1, closefd=False)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = request['argv']
+
+    try:
+        if request['module']:
+            sys.path.insert(0, os.getcwd())
+            runpy.run_module(sys.argv[0], run_name='__main__', alter_sys=True)
+        else:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+            runpy.run_path(sys.argv[0], run_name='__main__')
+        returncode = 0
+    except SystemExit as exc:
+        if exc.code is None:
+            returncode = 0
+        elif isinstance(exc.code, int):
+            returncode = exc.code
+        else:
+            print(exc.code, file=sys.stderr)
+            returncode = 1
+    except KeyboardInterrupt as exc:
+        # die by the signal, as Python does
+        _print_exception(exc)
+        returncode = None
+    except BaseException as exc:
+        _print_exception(exc)
+        returncode = 1
+
+    try:
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        if returncode is None:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGINT)
+        os._exit(1 if returncode is None else returncode)
+
+
+def _get_returncode(status):
+    """Convert the wait status to a returncode like subprocess does."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def serve(socket_path, modules):
+    """Import the modules, and fork a child for each request received in the socket."""
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            # the child will fail (or not) when really importing it
+            pass
+
+    # a child finishing wakes up the loop, to report it right away
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    # bind in other path and move it, so clients never see a socket not yet listening
+    temp_path = "{}.{}".format(socket_path, os.getpid())
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(temp_path)
+    os.chmod(temp_path, 0o600)
+    listener.listen(64)
+    os.rename(temp_path, socket_path)
+    socket_inode = os.stat(socket_path).st_ino
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    selector.register(wakeup_read, selectors.EVENT_READ)
+    running = {}  # pid -> connection with its client
+    try:
+        while True:
+            events = selector.select(timeout=IDLE_TIMEOUT)
+            if not events and not running:
+                break
+
+            for key, _ in events:
+                if key.fileobj is listener:
+                    conn, _ = listener.accept()
+                    try:
+                        request, fds = _receive_request(conn)
+                    except (OSError, ValueError):
+                        conn.close()
+                        continue
+
+                    pid = os.fork()
+                    if pid == 0:
+                        signal.set_wakeup_fd(-1)
+                        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                        selector.close()
+                        listener.close()
+                        os.close(wakeup_read)
+                        os.close(wakeup_write)
+                        for other_conn in running.values():
+                            other_conn.close()
+                        conn.close()
+                        _run_child(request, fds)
+
+                    for fd in fds:
+                        os.close(fd)
+                    try:
+                        conn.sendall("{}\n".format(pid).encode('ascii'))
+                    except OSError:
+                        pass
+                    running[pid] = conn
+                else:
+                    try:
+                        os.read(wakeup_read, 512)
+                    except BlockingIOError:
+                        pass
+
+            # report all the children that finished
+            while running:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                conn = running.pop(pid, None)
+                if conn is not None:
+                    try:
+                        conn.sendall("{}\n".format(_get_returncode(status)).encode('ascii'))
+                    except OSError:
+                        pass
+                    conn.close()
+    finally:
+        # leave the socket if it's not ours anymore (other server replaced it)
+        try:
+            if os.stat(socket_path).st_ino == socket_inode:
+                os.unlink(socket_path)
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    # don't let the rest of fades modules (in this directory) shadow the child's ones
+    del sys.path[0]
+    serve(sys.argv[1], sys.argv[2:])
@@ -16,9 +16,11 @@
 
 """A collection of utilities for fades."""
 
+import hashlib
 import json
 import logging
 import os
+import shutil
 import subprocess
 import sys
 import tempfile
@@ -27,18 +29,21 @@ from pathlib import Path
 from urllib import request, parse
 from urllib.error import HTTPError
 
-from packaging.requirements import Requirement
 from packaging.version import Version
 
 from fades import FadesError, _version
+from fades.multiplatform import atomic_write
+from fades.parsing import PyPIDependency
 
 logger = logging.getLogger(__name__)
 
-# command to retrieve the version from an external Python
-SHOW_VERSION_CMD = """
-import sys, json
-d = dict(path=sys.executable)
-d.update(zip('major minor micro releaselevel serial'.split(), sys.version_info))
+# command to retrieve what identifies an external Python
+PROBE_INTERPRETER_CMD = """
+import json, os, platform, sys, sysconfig
+d = dict(
+    path=os.path.realpath(sys.executable), version=platform.python_version(),
+    implementation=sys.implementation.name, soabi=sysconfig.get_config_var('SOABI'),
+    platform=sysconfig.get_platform(), build=platform.python_build())
 print(json.dumps(d))
 """
 
@@ -53,6 +58,10 @@ STDOUT_LOG_PREFIX = ":: "
 # 'fades' in it, it's a different dir for each user, and accessable by different versions of fades
 SNAP_BASEDIR_NAME = 'SNAP_USER_COMMON'
 
+# a read-only cache shared by all the users, which (if exists) is searched for venvs before
+# building them in the user's own cache
+SYSTEM_CACHE_DIR = Path('/var/cache/fades')
+
 
 class ExecutionError(Exception):
     """Execution of subprocess ended not in 0."""
@@ -88,6 +97,19 @@ def logged_exec(cmd):
     return stdout
 
 
+def spawn_detached(cmd):
+    """Start a command in background, not attached to this process nor its terminal."""
+    logger.debug("Spawning in background: %r", cmd)
+    return subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+
+
+def get_worst_returncode(returncodes):
+    """Return the worst returncode: zero if all were ok, else the farthest from zero."""
+    return max(returncodes, key=abs, default=0)
+
+
 def _get_basedirectory():
     from xdg import BaseDirectory
     return BaseDirectory
@@ -124,27 +146,66 @@ def get_confdir() -> Path:
     return _get_specific_dir('config')
 
 
+def _is_script(filepath):
+    """Tell if the file is a script (e.g. a pyenv shim) instead of a real executable."""
+    try:
+        with open(filepath, 'rb') as fh:
+            return fh.read(2) == b'#!'
+    except OSError:
+        return True
+
+
+def _probe_interpreter(interpreter):
+    """Get what identifies the interpreter, caching it as it's costly to find out.
+
+    The cached probe is valid while the interpreter's binary is not changed; scripts (like
+    pyenv shims) are never cached, as the interpreter they run depends on the context.
+    """
+    executable = shutil.which(interpreter)
+    cache_key = stat_key = None
+    if executable is not None and not _is_script(executable):
+        cache_key = os.path.abspath(executable)
+        stat = os.stat(executable)
+        stat_key = [stat.st_mtime, stat.st_size]
+
+    cache_path = get_basedir() / 'interpreters.json'
+    try:
+        with open(cache_path, 'rt', encoding='utf8') as fh:
+            probes = json.load(fh)
+    except (OSError, ValueError):
+        probes = {}
+
+    cached = probes.get(cache_key)
+    if cache_key is not None and cached is not None and cached['stat'] == stat_key:
+        return cached['info']
+
+    args = [interpreter, '-c', PROBE_INTERPRETER_CMD]
+    try:
+        probe_result = logged_exec(args)
+    except Exception as error:
+        logger.error("Error getting requested interpreter version: %s", error)
+        raise FadesError("Could not get interpreter version")
+    info = json.loads(probe_result[0])
+
+    if cache_key is not None:
+        probes[cache_key] = dict(stat=stat_key, info=info)
+        atomic_write(cache_path, [json.dumps(probes)])
+    return info
+
+
 def _get_interpreter_info(interpreter=None):
-    """Return the interpreter's full path using pythonX.Y format."""
+    """Return an identifier for the interpreter, unique for its build, ABI and platform.
+
+    This way all the different names for the same interpreter (symlinks, shims, etc.) are
+    identified the same.
+    """
     if interpreter is None:
         # If interpreter is None by default returns the current interpreter data.
-        major, minor = sys.version_info[:2]
-        executable = sys.executable
-    else:
-        args = [interpreter, '-c', SHOW_VERSION_CMD]
-        try:
-            requested_interpreter_info = logged_exec(args)
-        except Exception as error:
-            logger.error("Error getting requested interpreter version: %s", error)
-            raise FadesError("Could not get interpreter version")
-        requested_interpreter_info = json.loads(requested_interpreter_info[0])
-        executable = requested_interpreter_info['path']
-        major = requested_interpreter_info['major']
-        minor = requested_interpreter_info['minor']
-    if executable[-1].isdigit():
-        executable = executable.split(".")[0][:-1]
-    interpreter = "{}{}.{}".format(executable, major, minor)
-    return interpreter
+        interpreter = sys.executable
+    info = _probe_interpreter(interpreter)
+    serialized = json.dumps(info, sort_keys=True)
+    digest = hashlib.sha256(serialized.encode('utf8')).hexdigest()
+    return "{}{}-{}".format(info['implementation'], info['version'], digest[:16])
 
 
 def get_interpreter_version(requested_interpreter):
@@ -207,7 +268,7 @@ def check_pypi_updates(dependencies):
                             dependency.name, latest_version)
         else:
             name_plus = "{}=={}".format(dependency.name, latest_version)
-            dependencies_up_to_date.append(Requirement(name_plus))
+            dependencies_up_to_date.append(PyPIDependency(name_plus, module=dependency.module))
             logger.info("The latest version of %r is %s and will use it.",
                         dependency.name, latest_version)
 
@@ -368,3 +429,9 @@ def get_env_bin_path(base_env_path):
         if binpath.exists():
             return binpath
     raise ValueError(f"Binary subdir not found in {base_env_path!r}")
+
+
+def get_env_site_packages(base_env_path):
+    """Find and return the environment's site-packages directories in a multiplatformy way."""
+    return sorted(base_env_path.glob("lib/python*/site-packages")) + sorted(
+        base_env_path.glob("Lib/site-packages"))
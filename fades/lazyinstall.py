@@ -0,0 +1,131 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Install dependencies lazily, when they are imported for the first time.
+
+This is not used by fades itself: it's copied as a ``sitecustomize`` module to a
+directory in the child program's PYTHONPATH, so it's loaded by the child's Python
+when starting. So it must only use the stdlib.
+"""
+
+import contextlib
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# environment variable with the configuration, set by fades for the child program
+CONFIG_ENV_VAR = "FADES_LAZY_INSTALL"
+
+
+@contextlib.contextmanager
+def _venv_locked(lock_path):
+    """Lock the venv as fades does, so several processes don't install in it at the same time.
+
+    The lock file may be removed by fades when not in use, so if that happens while waiting
+    for it, the lock is taken again over the new file.
+    """
+    if lock_path is None or fcntl is None:
+        yield
+        return
+
+    while True:
+        fh = open(lock_path, 'a')
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            is_current = os.stat(lock_path).st_ino == os.fstat(fh.fileno()).st_ino
+        except FileNotFoundError:
+            is_current = False
+        if is_current:
+            break
+        fh.close()
+
+    # closing the file releases the lock
+    with fh:
+        yield
+
+
+class LazyInstallFinder(importlib.abc.MetaPathFinder):
+    """Install the dependency for a module that was not found, and find it again.
+
+    It's meant to be the last finder in the meta path, so it's only used when the module
+    couldn't be found otherwise.
+    """
+
+    def __init__(self, dependencies, pip_command, record_path, quiet=False, lock_path=None):
+        self.dependencies = dependencies  # top level module -> requirement
+        self.pip_command = pip_command
+        self.record_path = record_path
+        self.quiet = quiet
+        self.lock_path = lock_path
+
+    def find_spec(self, fullname, path=None, target=None):
+        """Install the dependency if it's for a known module, then find its spec."""
+        if path is not None or fullname not in self.dependencies:
+            # not a top level module, or not one we know how to install
+            return None
+
+        # only try once for each module
+        requirement = self.dependencies.pop(fullname)
+        if not self.quiet:
+            print("*** fades *** Installing {!r} to import {!r}".format(requirement, fullname),
+                  file=sys.stderr)
+        with _venv_locked(self.lock_path):
+            proc = subprocess.run(
+                self.pip_command + [requirement], capture_output=True, text=True)
+        if proc.returncode:
+            print("*** fades *** Installation of {!r} failed:\n{}".format(
+                requirement, proc.stdout + proc.stderr), file=sys.stderr)
+            return None
+
+        with open(self.record_path, 'at', encoding='utf8') as fh:
+            fh.write(requirement + '\n')
+        importlib.invalidate_caches()
+        return importlib.machinery.PathFinder.find_spec(fullname)
+
+
+def _chain_shadowed_sitecustomize():
+    """Run the sitecustomize that this module is shadowing, if any."""
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    other_paths = [path for path in sys.path if os.path.abspath(path or '.') != this_dir]
+    spec = importlib.machinery.PathFinder.find_spec("sitecustomize", other_paths)
+    if spec is not None:
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+
+def setup():
+    """Add the finder to the import system, using the configuration set by fades."""
+    config = json.loads(os.environ[CONFIG_ENV_VAR])
+    finder = LazyInstallFinder(
+        config['dependencies'], config['pip_command'], config['record_path'],
+        quiet=config['quiet'], lock_path=config.get('lock_path'))
+    sys.meta_path.append(finder)
+
+
+if __name__ == "sitecustomize":
+    if CONFIG_ENV_VAR in os.environ:
+        setup()
+    _chain_shadowed_sitecustomize()
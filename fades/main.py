@@ -18,9 +18,12 @@
 """Main 'fades' modules."""
 
 import argparse
+import concurrent.futures
 import logging
+import json
 import os
 import platform
+import shutil
 import signal
 import sys
 import subprocess
@@ -30,13 +33,20 @@ from pathlib import Path
 import fades
 from fades import (
     FadesError,
+    archive,
+    batch,
     cache,
     envbuilder,
     file_options,
+    forkserver,
     helpers,
+    lazyinstall,
+    matrix,
     parsing,
     pipmanager,
     pkgnamesdb,
+    prebuild,
+    remotecache,
 )
 from fades.logger import set_up as logger_set_up
 
@@ -85,6 +95,15 @@ AUTOIMPORT_MOD_SKIPPING = (
     """print("::fades:: autoimport skipped because not a PyPI package: {dependency!r}")\n""")
 
 
+def _get_module_name(dependency):
+    """Return the name of the module provided by the PyPI dependency."""
+    # the dependencies parsed by fades know it (e.g. the one imported in the script)
+    module = getattr(dependency, 'module', None)
+    if module is None:
+        module = pkgnamesdb.get_module_name(dependency.name)
+    return module
+
+
 def get_autoimport_scriptname(dependencies, is_ipython):
     """Return the path of script that will import dependencies for interactive mode.
 
@@ -110,8 +129,7 @@ def get_autoimport_scriptname(dependencies, is_ipython):
                     # Ignore this artificially added dependency.
                     continue
 
-                module = pkgnamesdb.PACKAGE_TO_MODULE.get(package, package)
-                fh.write(AUTOIMPORT_MOD_IMPORTER.format(module=module))
+                fh.write(AUTOIMPORT_MOD_IMPORTER.format(module=_get_module_name(dependency)))
             else:
                 fh.write(AUTOIMPORT_MOD_SKIPPING.format(dependency=dependency))
 
@@ -223,6 +241,239 @@ def detect_inside_virtualenv(prefix, real_prefix, base_prefix):
     return prefix != base_prefix
 
 
+def _get_matrix_fades_args(argv, child_program, child_options):
+    """Return the fades arguments to run each interpreter of the matrix (all but the matrix)."""
+    # what is for the child is left untouched
+    fades_qty = len(argv) - len(child_options) - (0 if child_program is None else 1)
+    fades_args = []
+    skip_next = False
+    for arg in argv[:fades_qty]:
+        if skip_next:
+            skip_next = False
+        elif arg == '--python-matrix':
+            skip_next = True
+        elif not arg.startswith('--python-matrix='):
+            fades_args.append(arg)
+    return fades_args + ['--running-in-matrix'] + argv[fades_qty:]
+
+
+def _get_fork_server_modules(dependencies):
+    """Return the modules to import in advance in the fork server."""
+    return sorted({
+        _get_module_name(dependency) for dependency in dependencies.get(fades.REPO_PYPI, [])})
+
+
+def _run_in_fork_server(venv_data, indicated_deps, argv, is_module):
+    """Run the child forking it from the server for the venv, starting it if not running.
+
+    The server is always the venv's plain Python. Return the forked process, or None if it
+    couldn't be done (the child needs to be run as usual).
+    """
+    if not forkserver.SUPPORTED:
+        logger.debug("Not using the fork server, not supported in this platform")
+        return None
+    socket_path = helpers.get_basedir() / 'forkservers' / (venv_data['env_path'].name + '.sock')
+    if len(str(socket_path)) > forkserver.MAX_SOCKET_PATH:
+        logger.debug("Not using the fork server, socket path too long: %s", socket_path)
+        return None
+
+    proc = forkserver.run(socket_path, argv, is_module)
+    if proc is None:
+        # start it for the next times, this one is run as usual
+        socket_path.parent.mkdir(exist_ok=True)
+        modules = _get_fork_server_modules(indicated_deps)
+        logger.debug("Starting the fork server for %s, importing %s", socket_path, modules)
+        python_exe = venv_data['env_bin_path'] / 'python'
+        helpers.spawn_detached(forkserver.get_server_command(python_exe, socket_path, modules))
+    return proc
+
+
+def _get_cached_venv(venvscache, indicated_deps, interpreter, uuid, options):
+    """Get the venv from the cache, if present and still valid."""
+    venv_data = venvscache.get_venv(indicated_deps, interpreter, uuid, options)
+    if venv_data:
+        env_path = venv_data['env_path']
+        # A venv was found in the cache check if its valid or re-generate it.
+        if not env_path.exists():
+            logger.warning("Missing directory (the virtualenv will be re-created): %r", env_path)
+            venvscache.remove(env_path)
+            return
+    return venv_data
+
+
+def _check_updates_in_background(indicated_deps, args, options):
+    """Launch other fades process to check for updates and create the updated venv."""
+    cmd = [sys.executable, "-m", "fades", "--check-updates", "--updating-in-background",
+           "--where", "-q"]
+    if args.python is not None:
+        cmd.append("--python={}".format(args.python))
+    cmd.extend("--venv-options={}".format(option) for option in options['venv_options'])
+    if options.get('shared_pip'):
+        cmd.append("--shared-pip")
+    cmd.extend("--pip-options={}".format(option) for option in args.pip_options)
+    for flag in ('no_precheck_availability', 'avoid_pip_upgrade', 'deferred_compile',
+                 'parallel_install'):
+        if getattr(args, flag):
+            cmd.append("--" + flag.replace("_", "-"))
+    if args.max_concurrent_builds:
+        cmd.append("--max-concurrent-builds={}".format(args.max_concurrent_builds))
+    cmd.extend("--cache-layer={}".format(layer) for layer in args.cache_layer or [])
+    if args.shared_cache is not None:
+        cmd.append("--shared-cache={}".format(args.shared_cache))
+    if args.remote_cache is not None:
+        cmd.append("--remote-cache={}".format(args.remote_cache))
+        if args.remote_cache_upload:
+            cmd.append("--remote-cache-upload")
+    for repo, dependencies in indicated_deps.items():
+        cmd.extend("--dependency={}::{}".format(repo, dependency) for dependency in dependencies)
+    helpers.spawn_detached(cmd)
+
+
+def _prepare_lazy_install(lazy_deps, venv_data, pip_options, shared_pip, quiet, venvscache):
+    """Prepare the child environment so those dependencies are installed when imported.
+
+    The child installs them holding the venv's lock, as other processes may be using the
+    same venv. Return the temporary directory used to do it.
+    """
+    tempdir = Path(tempfile.mkdtemp(prefix='fades-lazy-'))
+    shutil.copy(lazyinstall.__file__, tempdir / 'sitecustomize.py')
+
+    mgr = pipmanager.PipManager(
+        venv_data['env_bin_path'], options=pip_options, shared_pip=shared_pip)
+    dependencies = {
+        _get_module_name(dependency): str(dependency) for dependency in lazy_deps}
+    config = dict(
+        dependencies=dependencies, pip_command=[str(arg) for arg in mgr.get_install_command()],
+        record_path=str(tempdir / 'installed.txt'), quiet=quiet,
+        lock_path=str(venvscache.get_venv_lockpath(venv_data['env_path'].name)))
+    logger.debug("Lazy install of dependencies in the child program: %s", config)
+
+    python_path = str(tempdir)
+    if os.environ.get('PYTHONPATH'):
+        python_path += os.pathsep + os.environ['PYTHONPATH']
+    os.environ['PYTHONPATH'] = python_path
+    os.environ[lazyinstall.CONFIG_ENV_VAR] = json.dumps(config)
+    return tempdir
+
+
+def _finish_lazy_install(tempdir, venv_data, venvscache):
+    """Record in the cache what was installed by the child, and clean up.
+
+    It's recorded as installed in the venv, so it's not used for other requests that
+    don't need those dependencies (unless extra packages are allowed).
+    """
+    record_path = tempdir / 'installed.txt'
+    if record_path.exists():
+        logger.debug("Dependencies installed by the child program: %s", record_path.read_text())
+        distributions = envbuilder.get_distributions(venv_data['env_path'])
+        installed = {}
+        for line in record_path.read_text().splitlines():
+            _, dependency = parsing.parse_fade_requirement(line)
+            name = dependency.name
+            if name in distributions:
+                installed[name] = distributions[name]
+        venvscache.add_installed(
+            venv_data['env_path'], {fades.REPO_PYPI: installed}, distributions)
+    shutil.rmtree(tempdir, ignore_errors=True)
+
+
+def _precheck_while_preparing(indicated_deps, python, is_current, options, spare_pool):
+    """Check dependencies availability in PyPI, preparing the venv at the same time.
+
+    Both tasks are independent (network vs CPU and disk), so the empty virtualenv is
+    speculatively created in other thread; it's discarded (or recycled to the spare pool) if
+    the dependencies are not available.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(envbuilder.prepare_venv, python, is_current, options, spare_pool)
+        logger.info(
+            "Checking the availabilty of dependencies in PyPI. "
+            "You can use '--no-precheck-availability' to avoid it.")
+        try:
+            all_exist = helpers.check_pypi_exists(indicated_deps)
+        except FadesError:
+            envbuilder.recycle_venv(future.result(), spare_pool)
+            raise
+        prepared_venv = future.result()
+
+    if not all_exist:
+        logger.debug("Discarding the speculatively prepared virtualenv")
+        envbuilder.recycle_venv(prepared_venv, spare_pool)
+        logger.error("An indicated dependency doesn't exist. Exiting")
+        raise FadesError("Required dependency does not exist")
+    return prepared_venv
+
+
+def _build_venv(args, fingerprint, indicated_deps, interpreter, is_current, options,
+                venvscache, usage_manager, spare_pool, shared_cache, remote_cache, max_builds):
+    """Build the venv for the request (not present in the cache), and store it.
+
+    It's brought from the shared or remote caches, if there; else an incomplete venv for
+    the request is resumed, or a new one is created. Return its metadata.
+    """
+    if shared_cache is not None:
+        shared_venv = shared_cache.get_matching_entry(indicated_deps, interpreter, options)
+        if shared_venv is not None:
+            venv_data = envbuilder.materialize_venv(shared_venv, venvscache)
+            if venv_data is not None:
+                return venv_data
+    if remote_cache is not None:
+        venv_data = remote_cache.get_venv(fingerprint, interpreter, venvscache)
+        if venv_data is not None:
+            return venv_data
+
+    # the claimed incomplete venv stays in the cache until it's stored again; the build slot
+    # is taken for all the building, including the speculative creation while prechecking
+    with venvscache.claim_incomplete(indicated_deps, interpreter, options) as resumed, \
+            envbuilder.build_slot(max_builds):
+        already_installed = None
+        if resumed is not None:
+            # resume the creation of a venv that failed half way
+            logger.info("Resuming the virtualenv creation, previously left incomplete")
+            prepared_venv, already_installed = resumed
+        elif not args.no_precheck_availability and indicated_deps.get('pypi'):
+            # Check if the requested packages exists in pypi.
+            prepared_venv = _precheck_while_preparing(
+                indicated_deps, args.python, is_current, options, spare_pool)
+        else:
+            prepared_venv = None
+
+        # Create a new venv
+        try:
+            venv_data, installed = envbuilder.create_venv(
+                indicated_deps, args.python, is_current, options, args.pip_options,
+                args.avoid_pip_upgrade, spare_pool=spare_pool, venv_data=prepared_venv,
+                deferred_compile=args.deferred_compile,
+                parallel_install=args.parallel_install, fingerprint=fingerprint,
+                already_installed=already_installed)
+        except envbuilder.IncompleteVenvError as error:
+            # keep what was done, to resume it the next time
+            logger.info("Keeping the incomplete virtualenv to resume its creation later")
+            venvscache.store(
+                error.installed, error.venv_data, interpreter, options, fingerprint=fingerprint,
+                incomplete=True, replace=resumed is not None)
+            usage_manager.store_usage_stat(error.venv_data, venvscache)
+            raise
+        # store this new venv in the cache
+        distributions = envbuilder.get_distributions(venv_data['env_path'])
+        venvscache.store(
+            installed, venv_data, interpreter, options, fingerprint=fingerprint,
+            distributions=distributions, replace=resumed is not None)
+
+    if not args.prebuilding:
+        prebuild.record_recipe(
+            fingerprint, indicated_deps, args.python, options, args.pip_options)
+    if remote_cache is not None and args.remote_cache_upload:
+        remote_cache.put_venv(venvscache.get_entry(venv_data['env_path'].name))
+    if shared_cache is not None:
+        envbuilder.publish_venv(venvscache.get_entry(venv_data['env_path'].name), shared_cache)
+    if args.deferred_compile:
+        envbuilder.compile_in_background(venv_data)
+    if spare_pool is not None:
+        spare_pool.replenish_in_background(args.python, options)
+    return venv_data
+
+
 def go():
     """Make the magic happen."""
     parser = argparse.ArgumentParser(
@@ -233,6 +484,10 @@ def go():
     parser.add_argument(
         '-d', '--dependency', action='append',
         help="specify dependencies through command line (this option can be used multiple times)")
+    parser.add_argument(
+        '--lazy-dependency', action='append', metavar='DEPENDENCY',
+        help="specify a PyPI dependency that is installed only if the child program imports "
+             "it (this option can be used multiple times)")
     parser.add_argument(
         '-r', '--requirement', type=Path, action='append',
         help="indicate files to read dependencies from (this option can be used multiple times)")
@@ -262,6 +517,14 @@ def go():
     parser.add_argument(
         '--rm', dest='remove', metavar='UUID',
         help="remove a virtualenv by UUID; see --where option to easily find out the UUID")
+    parser.add_argument(
+        '--export', nargs=2, metavar=('UUID', 'FILEPATH'),
+        help="export a virtualenv by UUID to a compressed archive (use '-' for stdout), "
+             "to be imported in other machine")
+    parser.add_argument(
+        '--import', dest='import_venv', metavar='FILEPATH',
+        help="import a virtualenv from a compressed archive (use '-' for stdin) created "
+             "with --export")
     parser.add_argument(
         '--clean-unused-venvs', action='store',
         help="remove venvs that haven't been used for more than the indicated days and compact "
@@ -281,6 +544,92 @@ def go():
         '--avoid-pip-upgrade', action='store_true',
         help="disable the automatic pip upgrade that happens after the virtualenv is created "
              "and before the dependencies begin to be installed.")
+    parser.add_argument(
+        '--spare-venvs', action='store', metavar='QUANTITY',
+        help="keep that quantity of empty virtualenvs ready (for the used Python and venv "
+             "options) so new virtualenvs are created faster; they are replenished in "
+             "background")
+    parser.add_argument(
+        '--shared-pip', action='store_true',
+        help="create the virtualenvs without pip, installing the dependencies with a pip "
+             "shared by all of them (faster and smaller, but the virtualenv will not have "
+             "its own pip)")
+    parser.add_argument(
+        '--deferred-compile', action='store_true',
+        help="when creating a virtualenv, don't compile the installed modules to bytecode "
+             "before running the child program, but in background and in parallel")
+    parser.add_argument(
+        '--parallel-install', action='store_true',
+        help="when creating a virtualenv, get the wheels for all the dependencies first and "
+             "then install them in parallel")
+    parser.add_argument(
+        '--max-extra-packages', action='store', metavar='QUANTITY',
+        help="reuse a virtualenv even if it has up to that quantity of installed packages that "
+             "were not requested (instead of creating a new one), preferring the ones with "
+             "less extra packages")
+    parser.add_argument(
+        '--max-concurrent-builds', action='store', metavar='QUANTITY',
+        help="don't build more than that quantity of virtualenvs at the same time in the "
+             "machine (among all the fades processes): the rest wait for their turn, in "
+             "order of arrival")
+    parser.add_argument(
+        '--background-updates', action='store_true',
+        help="with --check-updates, don't wait for the updated virtualenv to be created: "
+             "use the best one already available, and check for updates and create the "
+             "new virtualenv in background, to be used the next time")
+    parser.add_argument(
+        '--cache-layer', action='append', metavar='DIRECTORY', type=Path,
+        help="a read-only cache (e.g. system wide) where to also search for virtualenvs, "
+             "which are used in place (this option can be used multiple times); the default "
+             "is: {}".format(helpers.SYSTEM_CACHE_DIR))
+    parser.add_argument(
+        '--shared-cache', action='store', metavar='DIRECTORY', type=Path,
+        help="a cache in a network filesystem shared by several machines: the virtualenvs "
+             "not found locally are searched there (and copied to the local cache, to use "
+             "them from there), and the ones built locally are also copied there")
+    parser.add_argument(
+        '--remote-cache', action='store', metavar='LOCATION',
+        help="before building a virtualenv, search it in this remote cache shared by several "
+             "machines: an HTTP URL (using GET and PUT requests) or a directory")
+    parser.add_argument(
+        '--remote-cache-upload', action='store_true',
+        help="upload the virtualenvs built locally to the remote cache")
+    parser.add_argument(
+        '--prebuild-popular', action='store', metavar='QUANTITY',
+        help="build (if not present) the virtualenvs for that quantity of the most used or "
+             "rebuilt dependencies sets, and quit (useful to run it periodically)")
+    parser.add_argument(
+        '--prebuild', nargs='+', metavar='PATH', type=Path,
+        help="build in parallel the virtualenvs needed by all the scripts and requirements "
+             "files found in the indicated paths (walking directories), and quit")
+    parser.add_argument(
+        '--python-matrix', action='store', metavar='PYTHONS',
+        help="run the child program with each one of these Python interpreters (separated "
+             "by commas, like '3.11,3.12,pypy3'), building their virtualenvs and running "
+             "them all in parallel; the output of each one is prefixed by its interpreter")
+    parser.add_argument(
+        '--map', action='store_true',
+        help="run the child program once for each input (which are the child options after "
+             "'--', or all of them if that separator is not used, or the lines from stdin if "
+             "none is given), several at the same time, and show a summary at the end")
+    parser.add_argument(
+        '--map-workers', action='store', metavar='QUANTITY',
+        help="with --map, how many runs to do at the same time; the default is the quantity "
+             "of processors")
+    parser.add_argument(
+        '--fork-server', action='store_true',
+        help="run the child program forking it from a server process that already imported "
+             "its dependencies, so it starts much faster (useful for short programs run "
+             "very often); the server is started the first time and leaves after some time "
+             "without being used")
+    parser.add_argument(
+        '--fill-spare-venvs', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument(
+        '--prebuilding', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument(
+        '--updating-in-background', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument(
+        '--running-in-matrix', action='store_true', help=argparse.SUPPRESS)
 
     mutexg = parser.add_mutually_exclusive_group()
     mutexg.add_argument(
@@ -327,6 +676,19 @@ def go():
         parser.print_usage()
         print("fades: error: argument -m/--module needs child_program (module) to be present")
         return -1
+    if args.map and not args.child_program:
+        parser.print_usage()
+        print("fades: error: argument --map needs child_program to be present")
+        return -1
+    use_matrix = args.python_matrix and not args.running_in_matrix
+    if use_matrix and not args.child_program:
+        parser.print_usage()
+        print("fades: error: argument --python-matrix needs child_program to be present")
+        return -1
+    if use_matrix and args.python is not None:
+        parser.print_usage()
+        print("fades: error: argument --python-matrix not allowed with argument -p/--python")
+        return -1
 
     # set up the logger and dump basic version info
     logger_set_up(args.verbose, args.quiet)
@@ -342,13 +704,49 @@ def go():
             "fades is running from inside a virtualenv (%r), which is not supported", sys.prefix)
         raise FadesError("Cannot run from a virtualenv")
 
+    if use_matrix:
+        pythons = matrix.resolve_interpreters(matrix.parse_matrix(args.python_matrix))
+        fades_args = _get_matrix_fades_args(
+            sys.argv[1:], args.child_program, args.child_options)
+        return matrix.run_matrix(pythons, fades_args)
+
     if args.verbose and args.quiet:
         logger.warning("Overriding 'quiet' option ('verbose' also requested)")
 
-    # start the virtualenvs manager
-    venvscache = cache.VEnvsCache(helpers.get_basedir() / 'venvs.idx')
+    max_extras = 0
+    if args.max_extra_packages:
+        try:
+            max_extras = int(args.max_extra_packages)
+        except ValueError:
+            logger.error("max_extra_packages must be an integer.")
+            raise FadesError('max_extra_packages not an integer')
+
+    max_builds = None
+    if args.max_concurrent_builds:
+        try:
+            max_builds = int(args.max_concurrent_builds)
+        except ValueError:
+            logger.error("max_concurrent_builds must be an integer.")
+            raise FadesError('max_concurrent_builds not an integer')
+
+    map_workers = os.cpu_count() or 1
+    if args.map_workers:
+        try:
+            map_workers = int(args.map_workers)
+        except ValueError:
+            logger.error("map_workers must be an integer.")
+            raise FadesError('map_workers not an integer')
+
+    # start the virtualenvs manager, also using other caches (if any) as lower layers
+    basedir = helpers.get_basedir()
+    cache_layers = args.cache_layer or [helpers.SYSTEM_CACHE_DIR]
+    lower_layers = [
+        Path(layer) / 'venvs.idx' for layer in cache_layers
+        if Path(layer).resolve() != basedir.resolve()]
+    venvscache = cache.VEnvsCache(
+        basedir / 'venvs.idx', max_extras=max_extras, lower_layers=lower_layers)
     # start usage manager
-    usage_manager = envbuilder.UsageManager(helpers.get_basedir() / 'usage_stats', venvscache)
+    usage_manager = envbuilder.UsageManager(basedir / 'usage_stats', venvscache)
 
     if args.clean_unused_venvs:
         try:
@@ -360,10 +758,23 @@ def go():
         usage_manager.clean_unused_venvs(max_days_to_keep)
         return 0
 
+    if args.prebuild_popular:
+        try:
+            prebuild_quantity = int(args.prebuild_popular)
+        except ValueError:
+            logger.error("prebuild_popular must be an integer.")
+            raise FadesError('prebuild_popular not an integer')
+
+        prebuild.prebuild_popular(venvscache, usage_manager, prebuild_quantity)
+        return 0
+
     uuid = args.remove
     if uuid:
         venv_data = venvscache.get_venv(uuid=uuid)
-        if venv_data:
+        if venv_data and venvscache.in_lower_layer(venv_data['env_path']):
+            logger.warning("The virtualenv is in a read-only cache layer, not removing it: %s",
+                           venv_data['env_path'])
+        elif venv_data:
             # remove this venv from the cache
             env_path = venv_data.get('env_path')
             if env_path:
@@ -376,6 +787,20 @@ def go():
             logger.warning('No virtualenv found with uuid: %s.', uuid)
         return 0
 
+    if args.export:
+        uuid, filepath = args.export
+        venv = venvscache.get_entry(uuid)
+        if venv is None:
+            logger.error('No virtualenv found with uuid: %s.', uuid)
+            raise FadesError('Virtualenv not found')
+        archive.export_venv(venv, filepath)
+        return 0
+
+    if args.import_venv:
+        venv_data = archive.import_venv(args.import_venv, venvscache)
+        usage_manager.store_usage_stat(venv_data, venvscache)
+        return 0
+
     # decided which the child program really is
     analyzable_child_program, child_program = decide_child_program(
         args.executable, args.module, args.child_program)
@@ -383,10 +808,11 @@ def go():
     # Group and merge dependencies
     indicated_deps = consolidate_dependencies(
         args.ipython, analyzable_child_program, args.requirement, args.dependency)
-
-    # Check for packages updates
-    if args.check_updates:
-        helpers.check_pypi_updates(indicated_deps)
+    lazy_deps = parsing.parse_manual(args.lazy_dependency)
+    if lazy_deps.get(fades.REPO_VCS):
+        logger.warning("Only PyPI dependencies can be installed lazily, ignoring: %s",
+                       lazy_deps[fades.REPO_VCS])
+    lazy_deps = lazy_deps.get(fades.REPO_PYPI, [])
 
     # get the interpreter version requested for the child_program
     interpreter, is_current = helpers.get_interpreter_version(args.python)
@@ -398,45 +824,91 @@ def go():
     options['venv_options'] = args.venv_options
     if args.system_site_packages:
         options['venv_options'].append("--system-site-packages")
+    options['venv_options'] = sorted(options['venv_options'])
+    if args.shared_pip:
+        options['shared_pip'] = True
 
-    create_venv = False
-    venv_data = venvscache.get_venv(indicated_deps, interpreter, uuid, options)
-    if venv_data:
-        env_path = venv_data['env_path']
-        # A venv was found in the cache check if its valid or re-generate it.
-        if not env_path.exists():
-            logger.warning("Missing directory (the virtualenv will be re-created): %r", env_path)
-            venvscache.remove(env_path)
-            create_venv = True
-    else:
-        create_venv = True
-
-    if create_venv:
-        # Check if the requested packages exists in pypi.
-        if not args.no_precheck_availability and indicated_deps.get('pypi'):
-            logger.info(
-                "Checking the availabilty of dependencies in PyPI. "
-                "You can use '--no-precheck-availability' to avoid it.")
-            if not helpers.check_pypi_exists(indicated_deps):
-                logger.error("An indicated dependency doesn't exist. Exiting")
-                raise FadesError("Required dependency does not exist")
+    spare_pool = None
+    if args.spare_venvs:
+        try:
+            spare_venvs = int(args.spare_venvs)
+        except ValueError:
+            logger.error("spare_venvs must be an integer.")
+            raise FadesError('spare_venvs not an integer')
+        spare_pool = envbuilder.SparePool(spare_venvs, interpreter, options)
+
+    shared_cache = None
+    if args.shared_cache:
+        shared_dir = Path(args.shared_cache)
+        shared_dir.mkdir(parents=True, exist_ok=True)
+        shared_cache = cache.SharedVEnvsCache(shared_dir / 'venvs.idx')
+
+    remote_cache = None
+    if args.remote_cache:
+        remote_cache = remotecache.RemoteCache(args.remote_cache)
+
+    if args.fill_spare_venvs:
+        # internal maintenance mode, launched in background by other fades process
+        if spare_pool is not None:
+            spare_pool.fill(args.python, is_current, options)
+        return 0
 
-        # Create a new venv
-        venv_data, installed = envbuilder.create_venv(
-            indicated_deps, args.python, is_current, options, pip_options, args.avoid_pip_upgrade)
-        # store this new venv in the cache
-        venvscache.store(installed, venv_data, interpreter, options)
+    if args.prebuild:
+        summary = prebuild.prebuild_paths(
+            args.prebuild, venvscache, args.python, interpreter, options, pip_options)
+        print("Found {sources} scripts/requirements needing {requests} different virtualenvs: "
+              "{present} already present, {built} built, {failed_qty} failed".format(
+                  failed_qty=summary['requests'] - summary['present'] - summary['built'],
+                  **summary))
+        for source in summary['failed']:
+            print("Failed:", source)
+        return 1 if summary['failed'] else 0
+
+    venv_data = None
+    if args.check_updates:
+        if args.background_updates and not args.updating_in_background:
+            # use what is already there, while the updated venv is created for the next time
+            venv_data = _get_cached_venv(venvscache, indicated_deps, interpreter, uuid, options)
+        if venv_data is None:
+            helpers.check_pypi_updates(indicated_deps)
+        else:
+            logger.debug("Checking for packages updates in background")
+            _check_updates_in_background(indicated_deps, args, options)
+
+    if venv_data is None:
+        venv_data = _get_cached_venv(venvscache, indicated_deps, interpreter, uuid, options)
+    if venv_data is None:
+        # only one process builds the venv for the same request, the rest wait and reuse it
+        fingerprint = cache.get_fingerprint(indicated_deps, interpreter, options)
+        with venvscache.lock_request(fingerprint):
+            venv_data = _get_cached_venv(venvscache, indicated_deps, interpreter, uuid, options)
+            if venv_data is not None:
+                logger.debug("Virtualenv built by other process while waiting for it")
+            else:
+                venv_data = _build_venv(
+                    args, fingerprint, indicated_deps, interpreter, is_current, options,
+                    venvscache, usage_manager, spare_pool, shared_cache, remote_cache, max_builds)
 
     if args.where:
         # all it was requested is the virtualenv's path, show it and quit (don't run anything)
         print(venv_data['env_path'])
         return 0
 
+    if options.get('shared_pip') and (args.freeze or lazy_deps):
+        shared_pip = pipmanager.get_shared_pip(args.avoid_pip_upgrade)
+    else:
+        shared_pip = None
+
     if args.freeze:
         # beyond all the rest of work, dump the dependencies versions to a file
-        mgr = pipmanager.PipManager(venv_data['env_bin_path'])
+        mgr = pipmanager.PipManager(venv_data['env_bin_path'], shared_pip=shared_pip)
         mgr.freeze(args.freeze)
 
+    lazy_tempdir = None
+    if lazy_deps:
+        lazy_tempdir = _prepare_lazy_install(
+            lazy_deps, venv_data, pip_options, shared_pip, args.quiet, venvscache)
+
     # run forest run!!
     python_exe = 'ipython' if args.ipython else 'python'
     python_exe = venv_data['env_bin_path'] / python_exe
@@ -474,15 +946,28 @@ def go():
         else:
             cmd = [python_exe] + python_options + [child_program]
 
+        if args.map:
+            # the venv is the same for all the runs, they just differ in the input
+            rc = batch.run_batch(cmd, args.child_options, map_workers)
+            if lazy_tempdir is not None:
+                _finish_lazy_install(lazy_tempdir, venv_data, venvscache)
+            return rc
+
         # Incorporate the child options, always at the end, log and run.
         cmd += args.child_options
         logger.debug("Calling %s", cmd)
 
-        try:
-            proc = subprocess.Popen(cmd)
-        except FileNotFoundError:
-            logger.error("Command not found: %s", child_program)
-            raise FadesError("Command not found")
+        proc = None
+        if args.fork_server and not (
+                args.executable or args.ipython or python_options or lazy_deps):
+            proc = _run_in_fork_server(
+                venv_data, indicated_deps, [child_program] + args.child_options, args.module)
+        if proc is None:
+            try:
+                proc = subprocess.Popen(cmd)
+            except FileNotFoundError:
+                logger.error("Command not found: %s", child_program)
+                raise FadesError("Command not found")
 
     def _signal_handler(signum, _):
         """Handle signals received by parent process, send them to child.
@@ -503,6 +988,8 @@ def go():
 
     # wait child to finish, end
     rc = proc.wait()
+    if lazy_tempdir is not None:
+        _finish_lazy_install(lazy_tempdir, venv_data, venvscache)
     if rc:
         logger.debug("Child process not finished correctly: returncode=%d", rc)
     return rc
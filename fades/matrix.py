@@ -0,0 +1,109 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Run the same child program with several Python interpreters at the same time.
+
+For each interpreter other fades process is launched, so each one gets (or builds) its
+virtualenv and runs the child program exactly as when requested separately, all in
+parallel. Their output is shown prefixed by the interpreter.
+"""
+
+import concurrent.futures
+import logging
+import re
+import subprocess
+import sys
+import threading
+
+from fades import FadesError, helpers
+
+logger = logging.getLogger(__name__)
+
+# a bare version (like "3.12") means the interpreter with that name (like "python3.12")
+BARE_VERSION_RE = re.compile(r"\d+(\.\d+)*$")
+
+
+def parse_matrix(matrix):
+    """Return the interpreters indicated in the matrix (separated by commas)."""
+    pythons = []
+    for python in matrix.split(','):
+        python = python.strip()
+        if not python:
+            continue
+        if BARE_VERSION_RE.match(python):
+            python = "python" + python
+        if python not in pythons:
+            pythons.append(python)
+    if not pythons:
+        logger.error("No interpreters indicated in the Python matrix: %r", matrix)
+        raise FadesError("Empty Python matrix")
+    return pythons
+
+
+def resolve_interpreters(pythons):
+    """Probe the interpreters in parallel, discarding those that are the same as a previous one.
+
+    A FadesError is raised if any of them can't be probed.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(pythons)) as executor:
+        resolved = list(executor.map(helpers.get_interpreter_version, pythons))
+
+    unique = {}
+    for python, (interpreter, _) in zip(pythons, resolved):
+        if interpreter in unique:
+            logger.warning("Ignoring %s as it is the same interpreter than %s",
+                           python, unique[interpreter])
+        else:
+            unique[interpreter] = python
+    return list(unique.values())
+
+
+def _relay_output(prefix, stream, output_lock):
+    """Show each line from the stream, prefixed."""
+    for line in stream:
+        with output_lock:
+            sys.stdout.write("[{}] {}".format(prefix, line))
+            sys.stdout.flush()
+
+
+def run_matrix(pythons, fades_args):
+    """Run fades with the same arguments for all the interpreters in parallel.
+
+    Return the worst of all their return codes.
+    """
+    output_lock = threading.Lock()
+    procs = []
+    relays = []
+    for python in pythons:
+        cmd = [sys.executable, "-m", "fades", "--python={}".format(python)] + fades_args
+        logger.debug("Calling %s", cmd)
+        # several children can't share the input, and the output is merged to relay it in lines
+        proc = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, errors='replace')
+        relay = threading.Thread(target=_relay_output, args=(python, proc.stdout, output_lock))
+        relay.start()
+        procs.append(proc)
+        relays.append(relay)
+
+    returncodes = []
+    for python, proc, relay in zip(pythons, procs, relays):
+        returncodes.append(proc.wait())
+        relay.join()
+        proc.stdout.close()
+        logger.debug("Run with %s finished with returncode=%d", python, proc.returncode)
+    return helpers.get_worst_returncode(returncodes)
@@ -17,40 +17,367 @@
 
 """Platform agnostic collection of utilities."""
 
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
 from contextlib import contextmanager
 from pathlib import Path
 
+from fades import FadesError
+
+logger = logging.getLogger(__name__)
+
+# limits for the exponential backoff used when polling for a lock
+BACKOFF_INITIAL_DELAY = .005
+BACKOFF_MAX_DELAY = .5
+
+# a lease lock not released after this seconds is considered abandoned (its holder died)
+LEASE_TIME = 300
+
+
+def _backoff_delays(timeout):
+    """Yield how much to sleep between lock attempts, until the timeout (if any) is reached."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = BACKOFF_INITIAL_DELAY
+    while True:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            delay = min(delay, remaining)
+        yield delay
+        delay = min(delay * 2, BACKOFF_MAX_DELAY)
+
+
+def _lock_timed_out(filepath, timeout):
+    """Report that a lock couldn't be acquired in time."""
+    logger.error("Couldn't get the lock on %s after waiting %.1f seconds", filepath, timeout)
+    return FadesError("Timeout waiting for a file lock")
+
+
+def atomic_write(filepath: Path, lines):
+    """Write the lines to the file atomically: readers see the old content or the new one."""
+    temp_path = filepath.with_name(
+        "{}.tmp-{}-{}".format(filepath.name, os.getpid(), threading.get_ident()))
+    with open(temp_path, 'wt', encoding='utf8') as fh:
+        fh.writelines(line + '\n' for line in lines)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(temp_path, filepath)
+
+
+def _remove_lease(filepath: Path, aside_path: Path, inode: int, mtime: float = None):
+    """Remove the lease file only if it's the expected one; return if it was removed.
+
+    The expected lease file has that inode (and modification time, if given).
+
+    Checking it in place and then removing it is not atomic (other process may take the
+    lock in between), so it's moved aside first and checked there; if it's not the expected
+    one it's put back.
+    """
+    try:
+        os.rename(filepath, aside_path)
+    except FileNotFoundError:
+        return False
+    try:
+        stat = os.stat(aside_path)
+        if stat.st_ino == inode and mtime in (None, stat.st_mtime):
+            return True
+        try:
+            os.link(aside_path, filepath)
+        except FileExistsError:
+            logger.warning("Lock %s taken by other process while being checked", filepath)
+        return False
+    finally:
+        aside_path.unlink()
+
+
+@contextmanager
+def leaselock(filepath: Path, timeout: float = None, lease_time: float = LEASE_TIME):
+    """Context manager to lock exclusively using a lease file, safe in network filesystems.
+
+    The lock is taken hard linking an unique file to the lock path, which is atomic even in
+    NFS (where flock is not reliable); as the link may succeed but its result get lost, the
+    links count of the unique file is what tells if the lock was got.
+
+    The lock file is removed when released; if its holder died, the lock is broken after
+    `lease_time` seconds, so it must be only held for short operations. In both cases it's
+    checked that the removed lock file is the expected one (by its inode), so the lock of
+    other holder is never removed.
+    """
+    unique_path = filepath.with_name("{}.{}-{}-{}".format(
+        filepath.name, socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]))
+    aside_path = unique_path.with_name(unique_path.name + ".aside")
+    unique_path.touch()
+    own_inode = os.stat(unique_path).st_ino
+    try:
+        for delay in _backoff_delays(timeout):
+            try:
+                os.link(unique_path, filepath)
+            except FileExistsError:
+                pass
+            if os.stat(unique_path).st_nlink == 2:
+                break
+
+            try:
+                lease = os.stat(filepath)
+            except FileNotFoundError:
+                # just released, try again right away
+                continue
+            lease_age = time.time() - lease.st_mtime
+            if lease_age > lease_time:
+                # other process may have broken it (and the lock be taken again) meanwhile
+                if _remove_lease(filepath, aside_path, lease.st_ino, lease.st_mtime):
+                    logger.warning(
+                        "Breaking abandoned lock %s (%d seconds old)", filepath, lease_age)
+                continue
+            time.sleep(delay)
+        else:
+            raise _lock_timed_out(filepath, timeout)
+
+        try:
+            yield
+        finally:
+            if not _remove_lease(filepath, aside_path, own_inode):
+                logger.warning("Lock %s was broken while held (for more than %d seconds)",
+                               filepath, lease_time)
+    finally:
+        unique_path.unlink()
+
+
 try:
     import fcntl
 
+    def _is_current_lockfile(fh, filepath):
+        """Tell if the open lock file is still the one in the path (it wasn't removed)."""
+        try:
+            return os.stat(filepath).st_ino == os.fstat(fh.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
     @contextmanager
-    def filelock(filepath: Path):
-        """Context manager to lock over a file using best method: fcntl."""
-        with open(filepath, 'w') as fh:
-            fcntl.flock(fh, fcntl.LOCK_EX)
-            yield
-            fcntl.flock(fh, fcntl.LOCK_UN)
+    def filelock(filepath: Path, shared: bool = False, timeout: float = None):
+        """Context manager to lock over a file using best method: fcntl.
+
+        The lock is exclusive unless `shared` is indicated (several shared holders can
+        coexist, but not with an exclusive one). Without timeout the kernel wakes us up
+        when the lock is released; with a timeout the lock is polled with an exponential
+        backoff until the time is exhausted.
+
+        The lock file may be removed by `remove_lockfile` when not in use; if that happens
+        while waiting for it, the lock is taken again over the new file.
+        """
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        while True:
+            fh = open(filepath, 'a')
+            try:
+                if timeout is None:
+                    fcntl.flock(fh, operation)
+                else:
+                    for delay in _backoff_delays(timeout):
+                        try:
+                            fcntl.flock(fh, operation | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            time.sleep(delay)
+                        else:
+                            break
+                    else:
+                        raise _lock_timed_out(filepath, timeout)
+            except BaseException:
+                fh.close()
+                raise
+            if _is_current_lockfile(fh, filepath):
+                break
+            fh.close()
+
+        with fh:
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def remove_lockfile(filepath: Path):
+        """Remove the lock file if nobody holds it nor waits for it; return if it was removed."""
         try:
-            filepath.unlink()
+            fh = open(filepath, 'r')
         except FileNotFoundError:
-            pass
+            return False
+        with fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            if not _is_current_lockfile(fh, filepath):
+                return False
+            # waiters that opened it before get the lock after this, and will see it's gone
+            filepath.unlink()
+            return True
+
+    def _try_flock(fh, operation):
+        """Try to lock the file without blocking, return if it could."""
+        try:
+            fcntl.flock(fh, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    @contextmanager
+    def trylock(filepath: Path):
+        """Context manager to lock exclusively over a file only if it's free, without waiting.
+
+        Yield if the lock was got.
+        """
+        while True:
+            fh = open(filepath, 'a')
+            if not _try_flock(fh, fcntl.LOCK_EX):
+                fh.close()
+                yield False
+                return
+            if _is_current_lockfile(fh, filepath):
+                break
+            fh.close()
+
+        with fh:
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _is_first_in_queue(queue_dir, ticket_name):
+        """Tell if the ticket is the first one of the queue, discarding those abandoned."""
+        for name in sorted(os.listdir(queue_dir)):
+            if name == ticket_name:
+                return True
+            if name.startswith('.'):
+                # a ticket still being taken
+                continue
+            try:
+                fh = open(queue_dir / name, 'r')
+            except FileNotFoundError:
+                # just left the queue
+                continue
+            with fh:
+                if not _try_flock(fh, fcntl.LOCK_SH):
+                    # its holder is alive and waiting
+                    return False
+                logger.debug("Removing abandoned ticket %s", name)
+                try:
+                    (queue_dir / name).unlink()
+                except FileNotFoundError:
+                    pass
+        # our ticket can't be missing, but don't hang forever if it happens
+        return True
+
+    def _get_free_slot(dirpath, slots):
+        """Return a locked free slot (an open file), None if all are taken."""
+        for idx in range(slots):
+            fh = open(dirpath / "slot-{}".format(idx), 'a')
+            if _try_flock(fh, fcntl.LOCK_EX):
+                return fh
+            fh.close()
+
+    @contextmanager
+    def semaphore(dirpath: Path, slots: int):
+        """Context manager to limit the holders to `slots` among all the processes of the machine.
+
+        Each holder locks one of the slot files in the directory. Waiters are served in
+        arrival order: each one holds the lock on its own ticket file in the queue (named
+        after the moment it arrived), and only the first of the queue tries to get a slot.
+        The kernel releases the locks of processes that die, so nothing is left taken forever.
+
+        Yield how many seconds had to wait for the slot.
+        """
+        queue_dir = dirpath / 'queue'
+        queue_dir.mkdir(parents=True, exist_ok=True)
+        started = time.monotonic()
+
+        # the ticket is locked before getting its final name, to not be seen as abandoned
+        ticket_name = "{:020d}-{}-{}".format(time.time_ns(), os.getpid(), uuid.uuid4().hex[:8])
+        temp_ticket_path = queue_dir / ('.' + ticket_name)
+        with open(temp_ticket_path, 'w') as ticket:
+            fcntl.flock(ticket, fcntl.LOCK_EX)
+            os.rename(temp_ticket_path, queue_dir / ticket_name)
+            try:
+                slot = None
+                for delay in _backoff_delays(None):
+                    if _is_first_in_queue(queue_dir, ticket_name):
+                        slot = _get_free_slot(dirpath, slots)
+                        if slot is not None:
+                            break
+                    if delay == BACKOFF_INITIAL_DELAY:
+                        logger.info("All the %d slots in %s are taken, waiting", slots, dirpath)
+                    time.sleep(delay)
+            finally:
+                (queue_dir / ticket_name).unlink()
+
+        with slot:
+            try:
+                yield time.monotonic() - started
+            finally:
+                fcntl.flock(slot, fcntl.LOCK_UN)
 
 except ImportError:
-    import time
 
     @contextmanager
-    def filelock(filepath: Path):
-        """Context manager to lock over a file where fcntl doesn't exist."""
+    def filelock(filepath: Path, shared: bool = False, timeout: float = None):
+        """Context manager to lock over a file where fcntl doesn't exist.
+
+        Here all locks are exclusive (the `shared` parameter is accepted for interface
+        compatibility), polling for the lock file with an exponential backoff.
+        """
+        for delay in _backoff_delays(timeout):
+            try:
+                fh = open(filepath, "x")
+            except FileExistsError:
+                time.sleep(delay)
+            else:
+                break
+        else:
+            raise _lock_timed_out(filepath, timeout)
+
         try:
-            while True:
-                try:
-                    with open(filepath, "x"):
-                        yield
-                    break
-                except FileExistsError:
-                    time.sleep(.5)
+            with fh:
+                yield
+        finally:
+            try:
+                filepath.unlink()
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def trylock(filepath: Path):
+        """Context manager to lock over a file only if it's free, without waiting.
+
+        Yield if the lock was got.
+        """
+        try:
+            fh = open(filepath, "x")
+        except FileExistsError:
+            yield False
+            return
+
+        try:
+            with fh:
+                yield True
         finally:
             try:
                 filepath.unlink()
             except FileNotFoundError:
                 pass
+
+    @contextmanager
+    def semaphore(dirpath: Path, slots: int):
+        """Context manager to limit the holders among all the processes; not supported here.
+
+        Without fcntl abandoned slots can't be told apart from taken ones, so nothing is
+        limited. Yield how many seconds had to wait for the slot (always zero).
+        """
+        logger.debug("Limiting concurrent processes is not supported in this platform")
+        yield 0
+
+    def remove_lockfile(filepath: Path):
+        """Remove the lock file if not in use; here they are removed when released anyway."""
+        return False
@@ -22,10 +22,11 @@ from pathlib import Path
 from typing import Generator
 
 from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
 from packaging.version import Version
 
 from fades import REPO_PYPI, REPO_VCS
-from fades.pkgnamesdb import MODULE_TO_PACKAGE
+from fades.pkgnamesdb import MODULE_TO_PACKAGE, get_module_name
 
 logger = logging.getLogger(__name__)
 
@@ -71,6 +72,19 @@ class VCSDependency:
         return hash(self.url)
 
 
+class PyPIDependency(Requirement):
+    """A PyPI requirement, with its name normalized (PEP 503) so equivalent names match.
+
+    It also knows the module it provides: the imported one if it comes from an import line,
+    else the one guessed from the name as written (to keep its case).
+    """
+
+    def __init__(self, requirement_string, module=None):
+        super().__init__(requirement_string)
+        self.module = get_module_name(self.name) if module is None else module
+        self.name = canonicalize_name(self.name)
+
+
 class NameVerDependency:
     """A dependency indicated by name and version."""
 
@@ -89,8 +103,11 @@ class NameVerDependency:
         return (self.name, self.version) < (other.name, other.version)
 
 
-def parse_fade_requirement(text):
-    """Return a requirement and repo from the given text, already parsed and converted."""
+def parse_fade_requirement(text, module=None):
+    """Return a requirement and repo from the given text, already parsed and converted.
+
+    The `module` is the one imported in the script for the requirement, if any.
+    """
     text = text.strip()
 
     if "::" in text:
@@ -110,7 +127,7 @@ def parse_fade_requirement(text):
     if repo == REPO_VCS:
         dependency = VCSDependency(requirement)
     else:
-        dependency = Requirement(requirement)
+        dependency = PyPIDependency(requirement, module=module)
     return repo, dependency
 
 
@@ -172,9 +189,6 @@ def _parse_content(fh):
         else:
             package = module
 
-        # To match the "safe" name
-        package = package.replace('_', '-')
-
         # get the fades info after 'fades' mark, if any
         if len(fades_part) == 5 or fades_part[5:].strip()[0] in "<>=!":
             # just the 'fades' mark, and maybe a version specification, the requirement is what
@@ -189,7 +203,7 @@ def _parse_content(fh):
             requirement = fades_part[5:]
 
         # parse and convert the requirement
-        parsed_req = parse_fade_requirement(requirement)
+        parsed_req = parse_fade_requirement(requirement, module=module)
         if parsed_req is None:
             continue
         repo, dependency = parsed_req
@@ -21,19 +21,37 @@ env that the child program. So we have to call the pip binary that is inside
 the created virtualenv.
 """
 
+import concurrent.futures
+import json
 import logging
+import os
 import shutil
 import contextlib
+import tempfile
+import venv
 from pathlib import Path
 
 from urllib import request
 
 from fades import helpers
+from fades.multiplatform import filelock
 
 logger = logging.getLogger(__name__)
 
 PIP_INSTALLER = "https://bootstrap.pypa.io/get-pip.py"
 
+# where the pip shared by all the venvs lives, inside fades base dir
+SHARED_PIP_DIRNAME = "shared-pip"
+
+# options that are only valid when installing (not when getting the wheels), so can not be used
+# when installing in parallel
+INSTALL_ONLY_OPTIONS = {
+    "--user", "-U", "--upgrade", "--upgrade-strategy", "--force-reinstall",
+    "-I", "--ignore-installed", "-t", "--target", "--prefix", "--root", "--compile",
+    "--no-compile", "--no-warn-script-location", "--no-warn-conflicts",
+    "--break-system-packages", "--report", "--dry-run", "--root-user-action",
+}
+
 
 class PipManager():
     """A manager for all PIP related actions."""
@@ -43,7 +61,10 @@ class PipManager():
         env_bin_path: Path,
         pip_installed: bool = False,
         options: bool = None,
-        avoid_pip_upgrade: bool = False
+        avoid_pip_upgrade: bool = False,
+        shared_pip: Path = None,
+        deferred_compile: bool = False,
+        capture_lock: bool = False,
     ):
         self.env_bin_path = env_bin_path
         self.pip_installed = pip_installed
@@ -52,44 +73,165 @@ class PipManager():
         basedir = helpers.get_basedir()
         self.pip_installer_fname = basedir / "get-pip.py"
         self.avoid_pip_upgrade = avoid_pip_upgrade
+        self.shared_pip = shared_pip
+        self.deferred_compile = deferred_compile
+        # the distributions resolved by pip when installing: name -> (version, sha256 or None)
+        self.capture_lock = capture_lock
+        self.resolved = {}
+        if shared_pip is None:
+            self.pip_cmd = [self.pip_exe]
+        else:
+            # the venv doesn't have pip, it's driven by the shared one
+            python_exe = self.env_bin_path / "python"
+            self.pip_cmd = [shared_pip, "-m", "pip", "--python", python_exe]
 
-    def install(self, dependency):
-        """Install a new dependency."""
-        if not self.pip_installed:
+    def _prepare_pip(self):
+        """Assure pip is ready to be used in the venv."""
+        if not self.pip_installed and self.shared_pip is None:
             logger.info("Need to install a dependency with pip, but no builtin, "
                         "doing it manually (just wait a little, all should go well)")
             self._brute_force_install_pip()
 
         # Always update pip to get latest behaviours (specially regarding security); this has
         # the nice side effect of getting logged the pip version that is used.
-        if not self.avoid_pip_upgrade:
+        if not self.avoid_pip_upgrade and self.shared_pip is None:
             python_exe = self.env_bin_path / "python"
             helpers.logged_exec([python_exe, '-m', 'pip', 'install', 'pip', '--upgrade'])
 
+    def install(self, dependency):
+        """Install a new dependency."""
+        self._prepare_pip()
+
         # split to pass several tokens on multiword dependency (this is very specific for '-e' on
         # external requirements, but implemented generically; note that this does not apply for
         # normal reqs, because even if it originally is 'foo > 1.2', after parsing it loses the
         # internal spaces)
         str_dep = str(dependency)
-        args = [self.pip_exe, "install"] + str_dep.split()
+        args = self.pip_cmd + ["install"] + str_dep.split()
+        if self.deferred_compile:
+            # bytecode will be compiled later, in parallel
+            args.append("--no-compile")
 
         if self.options:
             for option in self.options:
                 args.extend(option.split())
         logger.info("Installing dependency: %r", str_dep)
+        with tempfile.TemporaryDirectory(prefix="fades-pipreport-") as tempdir:
+            report_path = Path(tempdir) / "report.json"
+            if self.capture_lock:
+                args.extend(["--report", report_path])
+            try:
+                helpers.logged_exec(args)
+            except helpers.ExecutionError as error:
+                error.dump_to_log(logger)
+                raise error
+            except Exception as error:
+                logger.exception("Error installing %s: %s", str_dep, error)
+                raise error
+            if self.capture_lock:
+                self._collect_report(report_path)
+
+    def _collect_report(self, report_path):
+        """Collect what was resolved and installed from pip's installation report."""
+        with open(report_path, 'rt', encoding='utf8') as fh:
+            report = json.load(fh)
+        for item in report.get('install', []):
+            name = item['metadata']['name']
+            version = item['metadata']['version']
+            hashes = item.get('download_info', {}).get('archive_info', {}).get('hashes', {})
+            self.resolved[name] = (version, hashes.get('sha256'))
+
+    def get_lock_lines(self):
+        """Return the resolved distributions as hash-pinned requirements, if possible.
+
+        If something was not installed from an archive with known hash (e.g. a VCS or a
+        local directory) it's impossible to replay it pinned, so None is returned.
+        """
+        if not self.resolved:
+            return
+        lines = []
+        for name, (version, sha256) in sorted(self.resolved.items()):
+            if sha256 is None:
+                logger.debug("Can't lock dependencies, no hash for %s %s", name, version)
+                return
+            lines.append("{}=={} --hash=sha256:{}".format(name, version, sha256))
+        return lines
+
+    def install_locked(self, lockfile: Path):
+        """Install exactly what is in the lock file, without resolving anything."""
+        self._prepare_pip()
+        args = self.pip_cmd + ["install", "--no-deps", "--require-hashes", "-r", lockfile]
+        if self.deferred_compile:
+            args.append("--no-compile")
+        if self.options:
+            for option in self.options:
+                args.extend(option.split())
+        logger.info("Installing dependencies as previously resolved in %s", lockfile)
         try:
             helpers.logged_exec(args)
         except helpers.ExecutionError as error:
             error.dump_to_log(logger)
             raise error
-        except Exception as error:
-            logger.exception("Error installing %s: %s", str_dep, error)
+
+    def supports_parallel_install(self):
+        """Tell if the dependencies can be installed in parallel with the indicated options."""
+        for option in self.options or []:
+            for token in option.split():
+                if token.split("=")[0] in INSTALL_ONLY_OPTIONS:
+                    logger.debug(
+                        "Can't install in parallel, pip option only valid for installing: %r",
+                        token)
+                    return False
+        return True
+
+    def install_parallel(self, dependencies, workers=None):
+        """Install several dependencies at once, installing their wheels in parallel.
+
+        First everything is resolved and the wheels are built or fetched (normally from pip's
+        cache) to a wheelhouse; then, as files from different wheels don't conflict, the
+        wheels are installed concurrently without dependencies.
+        """
+        self._prepare_pip()
+        if workers is None:
+            workers = os.cpu_count()
+
+        str_deps = [str(dependency) for dependency in dependencies]
+        with tempfile.TemporaryDirectory(prefix="fades-wheelhouse-") as wheelhouse:
+            args = self.pip_cmd + ["wheel", "--wheel-dir", wheelhouse]
+            for str_dep in str_deps:
+                args.extend(str_dep.split())
+            if self.options:
+                for option in self.options:
+                    args.extend(option.split())
+            logger.info("Getting wheels for dependencies: %s", str_deps)
+            try:
+                helpers.logged_exec(args)
+            except helpers.ExecutionError as error:
+                error.dump_to_log(logger)
+                raise error
+
+            wheels = sorted(Path(wheelhouse).glob("*.whl"))
+            logger.info("Installing %d wheels using %d workers", len(wheels), workers)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                # consume all the results, to raise if any failed
+                list(executor.map(self._install_wheel, wheels))
+
+    def _install_wheel(self, wheel: Path):
+        """Install a wheel alone, without dependencies (they're installed at the same time)."""
+        args = self.pip_cmd + ["install", "--no-deps", "--no-index", "--no-warn-conflicts"]
+        if self.deferred_compile:
+            args.append("--no-compile")
+        args.append(wheel)
+        try:
+            helpers.logged_exec(args)
+        except helpers.ExecutionError as error:
+            error.dump_to_log(logger)
             raise error
 
     def get_version(self, dependency):
         """Return the installed version parsing the output of 'pip show'."""
         logger.debug("getting installed version for %s", dependency)
-        stdout = helpers.logged_exec([self.pip_exe, "show", str(dependency)])
+        stdout = helpers.logged_exec(self.pip_cmd + ["show", str(dependency)])
         version = [line for line in stdout if line.startswith('Version:')]
         if len(version) == 1:
             version = version[0].strip().split()[1]
@@ -121,9 +263,50 @@ class PipManager():
         helpers.logged_exec([python_exe, self.pip_installer_fname, '-I'])
         self.pip_installed = True
 
+    def get_install_command(self):
+        """Return the command to install dependencies (which need to be added at the end)."""
+        args = self.pip_cmd + ["install"]
+        if self.options:
+            for option in self.options:
+                args.extend(option.split())
+        return args
+
     def freeze(self, filepath: Path):
         """Dump venv contents to the indicated filepath."""
         logger.debug("running freeze to store in %r", filepath)
-        stdout = helpers.logged_exec([self.pip_exe, "freeze", "--all", "--local"])
+        stdout = helpers.logged_exec(self.pip_cmd + ["freeze", "--all", "--local"])
         with open(filepath, "wt", encoding='utf8') as fh:
             fh.writelines(line + '\n' for line in sorted(stdout))
+
+
+def _create_shared_pip(env_path: Path, avoid_pip_upgrade: bool):
+    """Create the venv holding the shared pip."""
+    logger.info("Creating the pip shared by all virtual environments")
+    try:
+        import ensurepip  # NOQA
+        has_ensurepip = True
+    except ImportError:
+        has_ensurepip = False
+
+    # build it aside and then rename, for other processes to never find it half done
+    building_path = env_path.with_name(env_path.name + ".building")
+    shutil.rmtree(building_path, ignore_errors=True)
+    venv.EnvBuilder(with_pip=has_ensurepip, symlinks=True).create(building_path)
+    env_bin_path = helpers.get_env_bin_path(building_path)
+    python_exe = env_bin_path / "python"
+    if not has_ensurepip:
+        PipManager(env_bin_path)._brute_force_install_pip()
+    if not avoid_pip_upgrade:
+        # the '--python' option of pip is needed, which is only present in modern versions
+        helpers.logged_exec([python_exe, "-m", "pip", "install", "pip", "--upgrade"])
+    building_path.rename(env_path)
+
+
+def get_shared_pip(avoid_pip_upgrade: bool = False) -> Path:
+    """Return the Python executable for the pip shared by all venvs, creating it if needed."""
+    basedir = helpers.get_basedir()
+    env_path = basedir / SHARED_PIP_DIRNAME
+    with filelock(basedir / (SHARED_PIP_DIRNAME + ".lock")):
+        if not env_path.exists():
+            _create_shared_pip(env_path, avoid_pip_upgrade)
+    return helpers.get_env_bin_path(env_path) / "python"
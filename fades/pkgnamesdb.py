@@ -19,6 +19,8 @@
 This is needed for names which don't match with the distrbution's name.
 """
 
+from packaging.utils import canonicalize_name
+
 MODULE_TO_PACKAGE = {
     'bs4': 'beautifulsoup4',
     'github3': 'github3.py',
@@ -29,4 +31,11 @@ MODULE_TO_PACKAGE = {
     'Crypto': 'pycrypto',
 }
 
-PACKAGE_TO_MODULE = {v: k for k, v in MODULE_TO_PACKAGE.items()}
+# keyed by the normalized name, as the packages are always handled that way
+PACKAGE_TO_MODULE = {canonicalize_name(v): k for k, v in MODULE_TO_PACKAGE.items()}
+
+
+def get_module_name(package):
+    """Return the name of the module provided by the package (named as written)."""
+    # dashes are never valid in a module name
+    return PACKAGE_TO_MODULE.get(canonicalize_name(package), package.replace('-', '_'))
@@ -0,0 +1,225 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Build in advance the virtualenvs that are most likely to be needed.
+
+Each time a venv is built its "recipe" (what was requested, and how) is recorded, so it
+can be built again after being removed. The most popular recipes are those whose venvs
+were used or built more times.
+
+Also, the venvs needed by a bunch of scripts and requirements files can be built all
+together, in parallel.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from fades import FadesError, cache, helpers, parsing
+from fades.multiplatform import atomic_write, filelock
+
+logger = logging.getLogger(__name__)
+
+# the most venvs to build at the same time (besides the cores, the network is also a limit)
+MAX_PARALLEL_BUILDS = 8
+
+
+def _get_recipes_path():
+    """Return the path of the file with the recipes."""
+    return helpers.get_basedir() / 'recipes.jsonl'
+
+
+def _make_recipe(fingerprint, dependencies, python, options, pip_options):
+    """Return the recipe (all that is needed to build it) for a venv."""
+    return dict(
+        fingerprint=fingerprint, python=python, options=options, pip_options=pip_options,
+        dependencies=[
+            "{}::{}".format(repo, dependency)
+            for repo, repo_deps in sorted(dependencies.items())
+            for dependency in sorted(str(dep) for dep in repo_deps)])
+
+
+def record_recipe(fingerprint, dependencies, python, options, pip_options):
+    """Record how a venv was built, to build it again later."""
+    recipe = _make_recipe(fingerprint, dependencies, python, options, pip_options)
+    recipe.update(timestamp=int(time.time()), builds=1)
+    recipes_path = _get_recipes_path()
+    # appends can be done in parallel, only need to exclude the compaction
+    with filelock(recipes_path.with_name(recipes_path.name + '.lock'), shared=True):
+        with open(recipes_path, 'at', encoding='utf8') as fh:
+            fh.write(json.dumps(recipe) + '\n')
+
+
+def _load_recipes():
+    """Load all the recipes, merging those for the same request, and compact the file.
+
+    The times each venv was built are accumulated, keeping the latest recipe.
+    """
+    recipes_path = _get_recipes_path()
+    if not recipes_path.exists():
+        return []
+
+    recipes = {}
+    with filelock(recipes_path.with_name(recipes_path.name + '.lock')):
+        with open(recipes_path, 'rt', encoding='utf8') as fh:
+            for line in fh:
+                if not line.endswith('\n'):
+                    continue
+                recipe = json.loads(line)
+                previous = recipes.get(recipe['fingerprint'])
+                if previous is not None:
+                    recipe['builds'] += previous['builds']
+                recipes[recipe['fingerprint']] = recipe
+        atomic_write(recipes_path, [json.dumps(recipe) for recipe in recipes.values()])
+    return list(recipes.values())
+
+
+def get_popular(venvscache, usage_manager, quantity):
+    """Return the most popular recipes, considering how many times they were used and built."""
+    uses = {}
+    usage_counts = usage_manager.get_usage_counts()
+    for venv in venvscache.get_entries():
+        fingerprint = venv.get('fingerprint')
+        if fingerprint is not None:
+            uses[fingerprint] = (
+                uses.get(fingerprint, 0) + usage_counts.get(venv['metadata']['env_path'].name, 0))
+
+    def popularity(recipe):
+        """Rank the recipe, preferring the latest in case of ties."""
+        return uses.get(recipe['fingerprint'], 0) + recipe['builds'], recipe['timestamp']
+
+    return sorted(_load_recipes(), key=popularity, reverse=True)[:quantity]
+
+
+def _build_command(recipe):
+    """Return the fades command to build the venv for the recipe."""
+    cmd = [sys.executable, "-m", "fades", "--where", "-q", "--prebuilding"]
+    if recipe['python'] is not None:
+        cmd.append("--python={}".format(recipe['python']))
+    cmd.extend("--venv-options={}".format(option) for option in recipe['options']['venv_options'])
+    if recipe['options'].get('shared_pip'):
+        cmd.append("--shared-pip")
+    cmd.extend("--pip-options={}".format(option) for option in recipe['pip_options'])
+    cmd.extend("--dependency={}".format(dependency) for dependency in recipe['dependencies'])
+    return cmd
+
+
+def _build(recipe):
+    """Build the venv for the recipe, return if it worked."""
+    # another fades process is used, so everything is done exactly as when requested
+    try:
+        helpers.logged_exec(_build_command(recipe))
+    except helpers.ExecutionError as error:
+        error.dump_to_log(logger)
+        logger.warning("Failed to prebuild virtualenv for %s", recipe['dependencies'])
+        return False
+    return True
+
+
+def prebuild_popular(venvscache, usage_manager, quantity):
+    """Build the venvs for the most popular recipes, if not already there.
+
+    Return how many venvs were built.
+    """
+    present = {venv.get('fingerprint') for venv in venvscache.get_entries()}
+    built = 0
+    for recipe in get_popular(venvscache, usage_manager, quantity):
+        if recipe['fingerprint'] in present:
+            logger.debug("Virtualenv already present for %s", recipe['dependencies'])
+            continue
+
+        logger.info("Prebuilding virtualenv for %s", recipe['dependencies'])
+        if _build(recipe):
+            built += 1
+    return built
+
+
+def _find_sources(paths):
+    """Yield the scripts and requirements files found in the paths (walking directories)."""
+    for path in paths:
+        path = Path(path)
+        if not path.is_dir():
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.endswith('.py') or (
+                        filename.startswith('requirements') and filename.endswith('.txt')):
+                    yield Path(dirpath) / filename
+
+
+def _parse_source(path):
+    """Return the dependencies indicated in a script or a requirements file."""
+    if path.suffix != '.py':
+        return parsing.parse_reqfile(path)
+
+    dependencies = {}
+    for parsed in (parsing.parse_srcfile(path), parsing.parse_docstring(path)):
+        for repo, repo_deps in parsed.items():
+            dependencies.setdefault(repo, set()).update(repo_deps)
+    return dependencies
+
+
+def prebuild_paths(paths, venvscache, python, interpreter, options, pip_options):
+    """Build in parallel the venvs needed by all the scripts and requirements files found.
+
+    Identical requests are built only once. Return the summary of what happened: a dict with
+    the sources and the requests found, the venvs already present, the built ones, and
+    the sources whose venvs couldn't be built.
+    """
+    requests = {}
+    sources_qty = 0
+    for source in _find_sources(paths):
+        try:
+            dependencies = _parse_source(source)
+        except (OSError, UnicodeDecodeError, FadesError) as error:
+            logger.warning("Error parsing dependencies from %s: %s", source, error)
+            continue
+        if not dependencies:
+            continue
+        sources_qty += 1
+        fingerprint = cache.get_fingerprint(dependencies, interpreter, options)
+        if fingerprint not in requests:
+            requests[fingerprint] = (dependencies, [])
+        requests[fingerprint][1].append(source)
+
+    summary = dict(sources=sources_qty, requests=len(requests), present=0, built=0, failed=[])
+    to_build = {}
+    for fingerprint, (dependencies, sources) in requests.items():
+        if venvscache.get_venv(dependencies, interpreter, options=options) is not None:
+            summary['present'] += 1
+        else:
+            to_build[fingerprint] = _make_recipe(
+                fingerprint, dependencies, python, options, pip_options)
+
+    workers = min(os.cpu_count() or 1, MAX_PARALLEL_BUILDS)
+    logger.info("Prebuilding %d virtualenvs (%d at the same time)", len(to_build), workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_build, recipe): fingerprint
+            for fingerprint, recipe in to_build.items()}
+        for future in concurrent.futures.as_completed(futures):
+            if future.result():
+                summary['built'] += 1
+            else:
+                summary['failed'].extend(requests[futures[future]][1])
+    return summary
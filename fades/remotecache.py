@@ -0,0 +1,149 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""A remote cache of virtualenvs, shared by several machines.
+
+The remote cache is just a place where the venvs archives (see `fades.archive`) are stored,
+named after the request fingerprint and the interpreter; it can be an HTTP server (getting
+and putting the archives with plain GET and PUT requests) or a directory (e.g. in a shared
+filesystem).
+
+The remote cache is just an optimization, so any problem using it is logged and ignored.
+"""
+
+import http.client
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from urllib import request
+from urllib.error import HTTPError, URLError
+
+from fades import FadesError, archive, helpers
+
+logger = logging.getLogger(__name__)
+
+# time to wait for the remote server
+HTTP_TIMEOUT = 30
+
+
+def get_key(fingerprint, interpreter):
+    """Return the name of the archive in the remote cache."""
+    return "{}-{}.tar.xz".format(interpreter, fingerprint)
+
+
+class _HTTPStorage:
+    """Get and put files using plain HTTP requests."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def get(self, key, filepath):
+        """Download the file; return if it was there."""
+        try:
+            with request.urlopen(self.url + '/' + key, timeout=HTTP_TIMEOUT) as resp:
+                with open(filepath, 'wb') as fh:
+                    shutil.copyfileobj(resp, fh)
+        except HTTPError as error:
+            if error.code != 404:
+                raise
+            return False
+        return True
+
+    def put(self, key, filepath):
+        """Upload the file."""
+        with open(filepath, 'rb') as fh:
+            req = request.Request(
+                self.url + '/' + key, data=fh, method='PUT',
+                headers={'Content-Length': str(os.fstat(fh.fileno()).st_size),
+                         'Content-Type': 'application/x-xz'})
+            with request.urlopen(req, timeout=HTTP_TIMEOUT):
+                pass
+
+
+class _DirectoryStorage:
+    """Get and put files in a directory."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def get(self, key, filepath):
+        """Copy the file from the directory; return if it was there."""
+        try:
+            shutil.copyfile(self.path / key, filepath)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, filepath):
+        """Copy the file to the directory, atomically so readers never see it half written."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        tempname = self.path / ".{}.{}".format(key, os.getpid())
+        try:
+            shutil.copyfile(filepath, tempname)
+            os.replace(tempname, self.path / key)
+        finally:
+            if tempname.exists():
+                tempname.unlink()
+
+
+class RemoteCache:
+    """The remote cache, with the venvs archives."""
+
+    def __init__(self, location):
+        if location.startswith(('http://', 'https://')):
+            self.storage = _HTTPStorage(location)
+        else:
+            if location.startswith('file://'):
+                location = location[len('file://'):]
+            self.storage = _DirectoryStorage(location)
+        self.location = location
+
+    def get_venv(self, fingerprint, interpreter, venvscache):
+        """Bring the venv from the remote cache and register it locally, if there.
+
+        Return the imported venv metadata, or None if not found in the remote cache.
+        """
+        key = get_key(fingerprint, interpreter)
+        logger.debug("Searching %s in the remote cache at %s", key, self.location)
+        fd, tempfilepath = tempfile.mkstemp(prefix='fades-remote-', dir=helpers.get_basedir())
+        os.close(fd)
+        try:
+            if not self.storage.get(key, tempfilepath):
+                logger.debug("Virtualenv not found in the remote cache")
+                return
+            logger.info("Using the virtualenv from the remote cache")
+            return archive.import_venv(tempfilepath, venvscache)
+        except (OSError, URLError, http.client.HTTPException, FadesError) as error:
+            logger.warning("Error getting the virtualenv from the remote cache: %s", error)
+        finally:
+            os.unlink(tempfilepath)
+
+    def put_venv(self, venv):
+        """Upload the venv (its whole cache entry) to the remote cache."""
+        key = get_key(venv['fingerprint'], venv['interpreter'])
+        logger.debug("Uploading %s to the remote cache at %s", key, self.location)
+        fd, tempfilepath = tempfile.mkstemp(prefix='fades-remote-', dir=helpers.get_basedir())
+        os.close(fd)
+        try:
+            archive.export_venv(venv, tempfilepath)
+            self.storage.put(key, tempfilepath)
+        except (OSError, URLError, http.client.HTTPException, FadesError) as error:
+            logger.warning("Error uploading the virtualenv to the remote cache: %s", error)
+        finally:
+            os.unlink(tempfilepath)
@@ -16,9 +16,12 @@
 
 import json
 import uuid
+from unittest.mock import patch
 
 from pytest import fixture
 
+from fades import helpers
+
 
 @fixture(scope="function")
 def tmp_file(tmp_path):
@@ -41,6 +44,15 @@ def create_tmpfile(tmp_path):
     yield add_content
 
 
+@fixture(scope="function")
+def basedir(tmp_path):
+    """Use a temporary fades base directory."""
+    basedir = tmp_path / "basedir"
+    basedir.mkdir()
+    with patch.object(helpers, 'get_basedir', return_value=basedir):
+        yield basedir
+
+
 def pytest_addoption(parser):
     """Define new pytest command line argument to be used by integration tests."""
     parser.addoption("--integtest-pyversion", action="store")
@@ -0,0 +1,138 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Tests for the export and import of virtualenvs."""
+
+import io
+import sys
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from fades import FadesError, archive, cache
+
+
+@pytest.fixture
+def exported_venv(tmp_path):
+    """Create a venv (in other "machine") and its cache entry."""
+    env_path = tmp_path / "othermachine" / "some-uuid"
+    env_bin_path = env_path / "bin"
+    env_bin_path.mkdir(parents=True)
+    (env_path / "pyvenv.cfg").write_text("command = python -m venv {}\n".format(env_path))
+    (env_bin_path / "somescript").write_text("#!{}/bin/python\nprint()\n".format(env_path))
+    (env_bin_path / "python").symlink_to(sys.executable)
+    return {
+        'metadata': {'env_path': env_path, 'env_bin_path': env_bin_path, 'pip_installed': True},
+        'installed': {'pypi': {'foo': '1.0'}},
+        'interpreter': 'cpython3.11-0123456789abcdef',
+        'options': {'pyvenv_options': {'system_site_packages': False, 'venv_options': []}},
+        'fingerprint': 'fprint',
+        'distributions': {'foo': '1.0', 'bar': '2.0'},
+    }
+
+
+def test_roundtrip(tmp_path, basedir, exported_venv):
+    archive_path = tmp_path / "venv.tar.xz"
+    lockfile = basedir / "lockfiles" / "fprint.txt"
+    lockfile.parent.mkdir()
+    lockfile.write_text("foo==1.0\nbar==2.0\n")
+    archive.export_venv(exported_venv, archive_path)
+
+    # import in a "new machine"
+    lockfile.unlink()
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    metadata = archive.import_venv(archive_path, venvscache)
+
+    env_path = metadata['env_path']
+    assert env_path.parent == basedir
+    assert metadata['env_bin_path'] == env_path / "bin"
+    assert metadata['pip_installed'] is True
+    assert (env_path / "pyvenv.cfg").read_text() == "command = python -m venv {}\n".format(
+        env_path)
+    assert (env_path / "bin" / "somescript").read_text().startswith(
+        "#!{}/bin/python\n".format(env_path))
+    assert (env_path / "bin" / "python").resolve() == Path(sys.executable).resolve()
+    assert lockfile.read_text() == "foo==1.0\nbar==2.0\n"
+    assert [p.name for p in basedir.iterdir() if p.name.startswith(".importing")] == []
+
+    venv = venvscache.get_entry(env_path.name)
+    assert venv['installed'] == exported_venv['installed']
+    assert venv['interpreter'] == exported_venv['interpreter']
+    assert venv['fingerprint'] == 'fprint'
+    assert venv['distributions'] == exported_venv['distributions']
+
+
+def test_export_incomplete(tmp_path, exported_venv):
+    exported_venv['incomplete'] = True
+    with pytest.raises(FadesError):
+        archive.export_venv(exported_venv, tmp_path / "venv.tar.xz")
+
+
+def test_import_unsafe_members(tmp_path, basedir, exported_venv, logs):
+    archive_path = tmp_path / "venv.tar.xz"
+    archive.export_venv(exported_venv, archive_path)
+
+    # add evil members to the archive
+    evil_path = tmp_path / "evil.tar"
+    with tarfile.open(archive_path) as src, tarfile.open(evil_path, "w") as dst:
+        for member in src:
+            dst.addfile(member, src.extractfile(member) if member.isfile() else None)
+        for name in ["../escaped", "/tmp/absolute", "venv/../../escaped", "other"]:
+            info = tarfile.TarInfo(name)
+            info.size = 4
+            dst.addfile(info, io.BytesIO(b"evil"))
+
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    metadata = archive.import_venv(evil_path, venvscache)
+    assert not (tmp_path / "escaped").exists()
+    assert not (basedir / "escaped").exists()
+    assert not (metadata['env_path'] / "other").exists()
+    assert "Ignoring unexpected member in the archive: '../escaped'" in logs.warning
+
+
+def test_import_without_filters(tmp_path, basedir, exported_venv, monkeypatch):
+    archive_path = tmp_path / "venv.tar.xz"
+    archive.export_venv(exported_venv, archive_path)
+    monkeypatch.delattr(tarfile, "tar_filter")
+
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    with pytest.raises(FadesError):
+        archive.import_venv(archive_path, venvscache)
+    assert list(basedir.iterdir()) == []
+
+
+def test_import_no_entry(tmp_path, basedir):
+    archive_path = tmp_path / "venv.tar.xz"
+    with tarfile.open(archive_path, "w:xz") as tar:
+        info = tarfile.TarInfo("venv/pyvenv.cfg")
+        tar.addfile(info, io.BytesIO(b""))
+
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    with pytest.raises(FadesError):
+        archive.import_venv(archive_path, venvscache)
+    assert list(basedir.iterdir()) == []
+
+
+def test_import_corrupted(tmp_path, basedir):
+    archive_path = tmp_path / "venv.tar.xz"
+    archive_path.write_bytes(b"not really an archive")
+
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    with pytest.raises(FadesError):
+        archive.import_venv(archive_path, venvscache)
+    assert list(basedir.iterdir()) == []
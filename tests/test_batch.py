@@ -0,0 +1,65 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Tests for the runs over many inputs."""
+
+import io
+import sys
+
+import pytest
+
+from fades import FadesError, batch
+
+# a child that records the input it got, failing for some of them
+CHILD = """
+import pathlib, sys
+outdir, item = sys.argv[1:]
+(pathlib.Path(outdir) / item).touch()
+sys.exit(3 if item.startswith('bad') else 0)
+"""
+
+
+@pytest.mark.parametrize('child_options, expected', [
+    (['--foo', '--', 'a', 'b'], (['--foo'], ['a', 'b'])),
+    (['a', 'b'], ([], ['a', 'b'])),
+    (['--', '--bar'], ([], ['--bar'])),
+])
+def test_split_inputs(child_options, expected):
+    assert batch.split_inputs(child_options) == expected
+
+
+def test_split_inputs_stdin(monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO("a\n\n  b c \n"))
+    assert batch.split_inputs(['--foo', '--']) == (['--foo'], ['a', 'b c'])
+
+
+def test_run_batch(tmp_path, logs):
+    cmd = [sys.executable, '-c', CHILD]
+    items = ['a', 'bad1', 'b', 'c', 'bad2']
+    rc = batch.run_batch(cmd, [str(tmp_path), '--'] + items, 3)
+
+    assert rc == 3
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(items)
+    assert "Ran 5 inputs: 3 succeeded, 2 failed" in logs.info
+    assert "Failed with returncode 3: bad1" in logs.warning
+    assert "Failed with returncode 3: bad2" in logs.warning
+
+
+def test_run_batch_command_not_found(tmp_path, logs):
+    with pytest.raises(FadesError):
+        batch.run_batch([str(tmp_path / 'nonexistent')], ['a'], 2)
+    assert "Command not found" in logs.error
@@ -14,9 +14,13 @@
 #
 # For further info, check  https://github.com/PyAr/fades
 
+from pathlib import Path
 from unittest.mock import patch
 
-from fades import cache
+import pytest
+from packaging.requirements import Requirement
+
+from fades import FadesError, cache
 
 
 def test_missing_file_pytest(tmp_file):
@@ -55,3 +59,234 @@ def test_get_by_uuid_pytest(tmp_file):
         resp = venvscache.get_venv(uuid='uuid')
     mock.assert_called_with(['foo', 'bar'], None, '', uuid='uuid', options=None)
     assert resp == 'resp'
+
+
+def test_get_entry(tmp_file, fake_venv):
+    with open(tmp_file, 'wt', encoding='utf8') as fh:
+        metadata = {'env_path': '/tmp/some-uuid', 'env_bin_path': '/tmp/some-uuid/bin'}
+        fh.write(fake_venv(metadata=metadata, fingerprint='fp') + '\n')
+    venvscache = cache.VEnvsCache(tmp_file)
+    venv = venvscache.get_entry('some-uuid')
+    assert venv['metadata']['env_path'] == Path('/tmp/some-uuid')
+    assert venv['fingerprint'] == 'fp'
+    assert venvscache.get_entry('other-uuid') is None
+
+
+def test_fingerprint_stable():
+    reqs1 = {'pypi': [Requirement('foo'), Requirement('bar>2')]}
+    reqs2 = {'pypi': {Requirement('bar>2'), Requirement('foo')}}
+    fp1 = cache.get_fingerprint(reqs1, 'interpreter', {'venv_options': []})
+    fp2 = cache.get_fingerprint(reqs2, 'interpreter', {'venv_options': []})
+    assert fp1 == fp2
+
+
+def test_fingerprint_different():
+    reqs = {'pypi': [Requirement('foo')]}
+    base = cache.get_fingerprint(reqs, 'interpreter', {'venv_options': []})
+    assert base != cache.get_fingerprint({'pypi': [Requirement('foo>1')]}, 'interpreter',
+                                         {'venv_options': []})
+    assert base != cache.get_fingerprint(reqs, 'other', {'venv_options': []})
+    assert base != cache.get_fingerprint(reqs, 'interpreter', {'venv_options': ['--foo']})
+
+
+def test_request_lock(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    with venvscache.lock_request('fingerprint'):
+        assert (tmp_file.parent / 'locks' / 'request-fingerprint.lock').exists()
+
+
+def test_compact_prunes_locks(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "path/env1", "env_bin_path": "path/env1/bin"}
+    venvscache.store({}, metadata, "interpreter", {}, fingerprint="fp1")
+    for fingerprint in ("fp1", "gone", "busy"):
+        with venvscache.lock_request(fingerprint):
+            pass
+    for uuid in ("env1", "gone"):
+        with venvscache.lock_venv(uuid):
+            pass
+
+    with venvscache.lock_request("busy"):
+        venvscache.compact()
+        remaining = sorted(path.name for path in (tmp_file.parent / 'locks').iterdir())
+    assert remaining == ["request-busy.lock", "request-fp1.lock", "venv-env1.lock"]
+
+
+def test_compact_migrates_old_interpreter_key(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    old_interpreter = tmp_path / "python3.8"
+    old_interpreter.touch()
+    metadata = {"env_path": "path/env1", "env_bin_path": "path/env1/bin"}
+    venvscache.store({}, metadata, str(old_interpreter), {}, fingerprint="fp1")
+
+    with patch.object(cache.helpers, 'get_interpreter_version',
+                      return_value=("cpython3.8.10-0123456789abcdef", False)) as probe_mock:
+        venvscache.compact()
+    probe_mock.assert_called_once_with(str(old_interpreter))
+    (entry,) = venvscache.get_entries()
+    assert entry["interpreter"] == "cpython3.8.10-0123456789abcdef"
+    assert "fingerprint" not in entry
+
+
+def test_compact_keeps_venvs_of_missing_interpreters(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    env_path = tmp_path / "env1"
+    env_path.mkdir()
+    metadata = {"env_path": env_path, "env_bin_path": env_path / "bin"}
+    venvscache.store({}, metadata, str(tmp_path / "python2.7"), {})
+
+    with patch.object(cache.helpers, 'get_interpreter_version') as probe_mock:
+        venvscache.compact()
+    probe_mock.assert_not_called()
+    (entry,) = venvscache.get_entries()
+    assert entry["interpreter"] == str(tmp_path / "python2.7")
+    assert entry[cache.UNKNOWN_INTERPRETER_KEY]
+    assert env_path.exists()
+
+    # not tried again when searching
+    with patch.object(venvscache, 'compact') as compact_mock:
+        venvscache.get_venv({}, "cpython3.8.10-0123456789abcdef", options={})
+    compact_mock.assert_not_called()
+
+
+def test_compact_keeps_venvs_if_probe_fails(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    old_interpreter = tmp_path / "python3.8"
+    old_interpreter.touch()
+    env_path = tmp_path / "env1"
+    env_path.mkdir()
+    metadata = {"env_path": env_path, "env_bin_path": env_path / "bin"}
+    venvscache.store({}, metadata, str(old_interpreter), {})
+
+    with patch.object(cache.helpers, 'get_interpreter_version', side_effect=FadesError("boom")):
+        venvscache.get_venv({}, "cpython3.8.10-0123456789abcdef", options={})
+    assert env_path.exists()
+    assert len(venvscache.get_entries()) == 1
+
+    # retried on next compaction
+    with patch.object(cache.helpers, 'get_interpreter_version',
+                      return_value=("cpython3.8.10-0123456789abcdef", False)):
+        venvscache.compact()
+    (entry,) = venvscache.get_entries()
+    assert entry["interpreter"] == "cpython3.8.10-0123456789abcdef"
+    assert cache.UNKNOWN_INTERPRETER_KEY not in entry
+
+
+def test_get_venv_migrates_old_interpreter_key(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    old_interpreter = tmp_path / "python3.8"
+    old_interpreter.touch()
+    metadata = {"env_path": "path/env1", "env_bin_path": "path/env1/bin"}
+    venvscache.store({}, metadata, str(old_interpreter), {})
+
+    with patch.object(cache.helpers, 'get_interpreter_version',
+                      return_value=("cpython3.8.10-0123456789abcdef", False)):
+        resp = venvscache.get_venv({}, "cpython3.8.10-0123456789abcdef", options={})
+    assert resp["env_path"] == Path("path/env1")
+
+
+def test_update_locks_the_venv(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "path/env1", "env_bin_path": "path/env1/bin"}
+    venvscache.store({}, metadata, "interpreter", {})
+    with patch.object(venvscache, 'lock_venv', wraps=venvscache.lock_venv) as lock_mock:
+        venvscache.update("path/env1", installed={"pypi": {"foo": "1"}})
+    lock_mock.assert_called_once_with("env1")
+    assert venvscache.get_entry("env1")["installed"] == {"pypi": {"foo": "1"}}
+
+
+def test_add_installed(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "path/env1", "env_bin_path": "path/env1/bin"}
+    venvscache.store({"pypi": {"foo": "1"}}, metadata, "interpreter", {})
+    venvscache.add_installed("path/env1", {"pypi": {"bar": "2"}}, {"foo": "1", "bar": "2"})
+
+    (entry,) = venvscache.get_entries()
+    assert entry["installed"] == {"pypi": {"foo": "1", "bar": "2"}}
+    assert entry["distributions"] == {"foo": "1", "bar": "2"}
+
+    # not matched anymore by a request without the added dependency
+    reqs = {"pypi": [Requirement("foo")]}
+    assert venvscache.get_venv(reqs, "interpreter", options={}) is None
+
+
+def _store_incomplete(venvscache, env_path, installed, options=None):
+    metadata = {"env_path": env_path, "env_bin_path": "bin/path"}
+    if options is None:
+        options = {"venv_options": []}
+    venvscache.store(installed, metadata, "interpreter", options, incomplete=True)
+
+
+def test_claim_incomplete(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    env_path = tmp_path / "env1"
+    env_path.mkdir()
+    _store_incomplete(venvscache, env_path, {"pypi": {"dep1": "2"}})
+    reqs = {"pypi": [Requirement("dep1>1"), Requirement("dep2")]}
+
+    with venvscache.claim_incomplete(reqs, "interpreter", {"venv_options": []}) as resumed:
+        metadata, installed = resumed
+        assert metadata["env_path"] == env_path
+        assert installed == {"pypi": {"dep1": "2"}}
+
+        # it's locked, so nobody else can claim it meanwhile
+        with venvscache.claim_incomplete(reqs, "interpreter", {"venv_options": []}) as other:
+            assert other is None
+
+        # resumed and stored again, replacing the incomplete one
+        installed = {"pypi": {"dep1": "2", "dep2": "1"}}
+        venvscache.store(installed, metadata, "interpreter", {"venv_options": []},
+                         replace=True)
+
+    (entry,) = venvscache.get_entries()
+    assert entry["installed"] == installed
+    assert "incomplete" not in entry
+
+
+def test_claim_incomplete_interrupted(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    env_path = tmp_path / "env1"
+    env_path.mkdir()
+    _store_incomplete(venvscache, env_path, {"pypi": {"dep1": "2"}})
+    reqs = {"pypi": [Requirement("dep1")]}
+
+    with pytest.raises(KeyboardInterrupt):
+        with venvscache.claim_incomplete(reqs, "interpreter", {"venv_options": []}):
+            raise KeyboardInterrupt()
+
+    # it's still there to be resumed later
+    with venvscache.claim_incomplete(reqs, "interpreter", {"venv_options": []}) as resumed:
+        assert resumed[0]["env_path"] == env_path
+
+
+def test_claim_incomplete_missing_directory(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    _store_incomplete(venvscache, tmp_path / "env1", {"pypi": {"dep1": "2"}})
+    reqs = {"pypi": [Requirement("dep1")]}
+
+    with venvscache.claim_incomplete(reqs, "interpreter", {"venv_options": []}) as resumed:
+        assert resumed is None
+    assert venvscache._read_cache() == []
+
+
+def test_claim_incomplete_uses_shared_lock_to_search(tmp_file, tmp_path):
+    venvscache = cache.VEnvsCache(tmp_file)
+    reqs = {"pypi": [Requirement("dep1")]}
+    with patch.object(venvscache, '_lock', wraps=venvscache._lock) as lock_mock:
+        with venvscache.claim_incomplete(reqs, "interpreter", {"venv_options": []}) as resumed:
+            assert resumed is None
+    lock_mock.assert_called_once_with(shared=True)
+
+
+def test_claim_incomplete_not_matching(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    _store_incomplete(venvscache, "path/env1", {"pypi": {"dep1": "2", "other": "1"}})
+    _store_incomplete(venvscache, "path/env2", {"pypi": {"dep1": "1"}})
+    _store_incomplete(venvscache, "path/env3", {"pypi": {"dep1": "2"}}, options={"foo": 1})
+    metadata = {"env_path": "path/env4", "env_bin_path": "bin/path"}
+    venvscache.store({"pypi": {"dep1": "2"}}, metadata, "interpreter", {"venv_options": []})
+
+    reqs = {"pypi": [Requirement("dep1>1")]}
+    with venvscache.claim_incomplete(reqs, "interpreter", {"venv_options": []}) as resumed:
+        assert resumed is None
+    assert len(venvscache._read_cache()) == 4
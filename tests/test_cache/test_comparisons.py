@@ -117,3 +117,13 @@ def test_check_versions(venvscache, fake_venv, req, installed, expected):
 def test_best_fit(venvscache, possible_venvs):
     """Check the venv best fitting decissor."""
     assert venvscache._select_better_fit(possible_venvs) == 'venv_best_fit'
+
+
+def test_best_fit_less_extras(venvscache):
+    """Less extra stuff is better than newer versions; then the newer wins."""
+    possible_venvs = [
+        (get_distrib(('dep', '5')), 'venv_1', 2),
+        (get_distrib(('dep', '4')), 'venv_best_fit', 1),
+        (get_distrib(('dep', '3')), 'venv_2', 1),
+    ]
+    assert venvscache._select_better_fit(possible_venvs) == 'venv_best_fit'
@@ -0,0 +1,87 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+from packaging.requirements import Requirement
+
+from fades import cache
+
+
+def _store(venvscache, basedir, uuid, installed, create_dir=True):
+    env_path = basedir / uuid
+    if create_dir:
+        env_path.mkdir(parents=True)
+    metadata = {"env_path": env_path, "env_bin_path": env_path / "bin"}
+    venvscache.store(installed, metadata, "interpreter", {"venv_options": []})
+    return env_path
+
+
+def _build_layers(tmp_path):
+    system_dir = tmp_path / "system"
+    system_dir.mkdir()
+    system_cache = cache.VEnvsCache(system_dir / "venvs.idx")
+    user_dir = tmp_path / "user"
+    user_dir.mkdir()
+    user_cache = cache.VEnvsCache(user_dir / "venvs.idx", lower_layers=[system_dir / "venvs.idx"])
+    return system_cache, system_dir, user_cache, user_dir
+
+
+def test_found_in_lower_layer(tmp_path):
+    system_cache, system_dir, user_cache, _ = _build_layers(tmp_path)
+    env_path = _store(system_cache, system_dir, "uuid1", {"pypi": {"dep": "1"}})
+
+    reqs = {"pypi": [Requirement("dep")]}
+    venv = user_cache.get_venv(reqs, "interpreter", options={"venv_options": []})
+    assert venv["env_path"] == env_path
+    assert user_cache.in_lower_layer(env_path)
+    assert user_cache.get_venv(uuid="uuid1")["env_path"] == env_path
+    assert user_cache.get_entry("uuid1")["installed"] == {"pypi": {"dep": "1"}}
+
+
+def test_upper_layer_preferred(tmp_path):
+    system_cache, system_dir, user_cache, user_dir = _build_layers(tmp_path)
+    _store(system_cache, system_dir, "uuid1", {"pypi": {"dep": "1"}})
+    env_path = _store(user_cache, user_dir, "uuid2", {"pypi": {"dep": "1"}})
+
+    reqs = {"pypi": [Requirement("dep")]}
+    venv = user_cache.get_venv(reqs, "interpreter", options={"venv_options": []})
+    assert venv["env_path"] == env_path
+    assert not user_cache.in_lower_layer(env_path)
+
+
+def test_missing_in_lower_layer_ignored(tmp_path):
+    system_cache, system_dir, user_cache, _ = _build_layers(tmp_path)
+    _store(system_cache, system_dir, "uuid1", {"pypi": {"dep": "1"}}, create_dir=False)
+
+    reqs = {"pypi": [Requirement("dep")]}
+    assert user_cache.get_venv(reqs, "interpreter", options={"venv_options": []}) is None
+
+
+def test_lower_layer_never_written(tmp_path):
+    system_cache, system_dir, user_cache, user_dir = _build_layers(tmp_path)
+    env_path = _store(system_cache, system_dir, "uuid1", {"pypi": {"dep": "1"}})
+    before = (system_dir / "venvs.idx").read_text()
+    before_listing = sorted(system_dir.iterdir())
+
+    _store(user_cache, user_dir, "uuid2", {"pypi": {"other": "1"}})
+    user_cache.remove(env_path)
+    user_cache.compact()
+    assert (system_dir / "venvs.idx").read_text() == before
+    assert sorted(system_dir.iterdir()) == before_listing
+
+
+def test_missing_lower_layer(tmp_path):
+    user_cache = cache.VEnvsCache(tmp_path / "venvs.idx", lower_layers=[tmp_path / "nope.idx"])
+    assert user_cache.get_venv(uuid="uuid1") is None
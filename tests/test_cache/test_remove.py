@@ -107,3 +107,96 @@ def test_lock_cache_for_remove(tmp_file):
     assert len(lines) == 1
     assert json.loads(lines[0])["metadata"]["env_path"] == "path/env3"
     assert not os.path.exists(venvscache.filepath.name + ".lock")
+
+
+def test_remove_appends_tombstone(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "path/env1", "env_bin_path": "other/path"}
+    venvscache.store("installed", metadata, "interpreter", options={})
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        original_content = fh.read()
+
+    venvscache.remove(Path("path/env1"))
+
+    # the original info is untouched, just a tombstone added
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        content = fh.read()
+    assert content.startswith(original_content)
+    assert json.loads(content.splitlines()[-1]) == {"removed": "path/env1"}
+    assert venvscache._read_cache() == []
+
+
+def test_remove_tombstone_only_previous_entries(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "path/env1", "env_bin_path": "other/path"}
+    venvscache.store("installed1", metadata, "interpreter", options={})
+    venvscache.remove(Path("path/env1"))
+    venvscache.store("installed2", metadata, "interpreter", options={})
+
+    lines = venvscache._read_cache()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["installed"] == "installed2"
+
+
+def test_remove_ignores_partial_lines(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "path/env1", "env_bin_path": "other/path"}
+    venvscache.store("installed", metadata, "interpreter", options={})
+    with open(tmp_file, 'at', encoding='utf8') as fh:
+        fh.write('{"half written by other pro')
+
+    lines = venvscache._read_cache()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["installed"] == "installed"
+
+
+def test_compact(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    for idx in range(3):
+        metadata = {"env_path": f"path/env{idx}", "env_bin_path": "other/path"}
+        venvscache.store(f"installed{idx}", metadata, "interpreter", options={})
+    venvscache.remove(Path("path/env1"))
+
+    venvscache.compact()
+
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        raw_lines = fh.readlines()
+    assert [json.loads(line)["installed"] for line in raw_lines] == ["installed0", "installed2"]
+
+
+def test_compact_automatically(tmp_file, monkeypatch):
+    monkeypatch.setattr(cache, "COMPACTION_THRESHOLD", 2)
+    venvscache = cache.VEnvsCache(tmp_file)
+    for idx in range(3):
+        metadata = {"env_path": f"path/env{idx}", "env_bin_path": "other/path"}
+        venvscache.store(f"installed{idx}", metadata, "interpreter", options={})
+
+    venvscache.remove(Path("path/env0"))
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        assert len(fh.readlines()) == 4
+
+    venvscache.remove(Path("path/env1"))
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        raw_lines = fh.readlines()
+    assert [json.loads(line)["installed"] for line in raw_lines] == ["installed2"]
+
+
+def test_compact_migrates(tmp_file):
+    # an entry stored by an old version, without normalizing names
+    old_entry = {
+        "metadata": {"env_path": "path/env1", "env_bin_path": "other/path"},
+        "installed": {"pypi": {"Py_Yaml": "5"}},
+        "interpreter": "interpreter",
+        "options": {"venv_options": ["--b", "--a"]},
+    }
+    with open(tmp_file, 'wt', encoding='utf8') as fh:
+        fh.write(json.dumps(old_entry) + "\n")
+    venvscache = cache.VEnvsCache(tmp_file)
+
+    venvscache.compact()
+
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        (raw_line,) = fh.readlines()
+    entry = json.loads(raw_line)
+    assert entry["installed"] == {"pypi": {"py-yaml": "5"}}
+    assert entry["options"] == {"venv_options": ["--a", "--b"]}
@@ -240,3 +240,105 @@ def test_match_uuid(venvscache, fake_venv):
     venv = fake_venv(metadata=metadata, installed={})
     resp = venvscache ._select([venv], uuid=venv_uuid)
     assert resp["extra"] == "foobar"
+
+
+def test_match_transitive_dependency(venvscache, fake_venv):
+    reqs = {'pypi': get_reqs('dep1', 'dep2 > 2')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    distributions = {'dep1': '5', 'dep2': '3', 'dep3': '1'}
+    venv = fake_venv("venv", installed={'pypi': {'dep1': '5'}}, distributions=distributions)
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp["extra"] == "venv"
+
+
+def test_nomatch_transitive_dependency_version(venvscache, fake_venv):
+    reqs = {'pypi': get_reqs('dep1', 'dep2 > 2')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    distributions = {'dep1': '5', 'dep2': '1'}
+    venv = fake_venv("venv", installed={'pypi': {'dep1': '5'}}, distributions=distributions)
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp is None
+
+
+def test_nomatch_only_transitive_dependencies(venvscache, fake_venv):
+    # the installed stuff must still be all requested
+    reqs = {'pypi': get_reqs('dep2')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    distributions = {'dep1': '5', 'dep2': '3'}
+    venv = fake_venv("venv", installed={'pypi': {'dep1': '5'}}, distributions=distributions)
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp is None
+
+
+def test_nomatch_extra_packages_by_default(venvscache, fake_venv):
+    reqs = {'pypi': get_reqs('dep1')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    venv = fake_venv("venv", installed={'pypi': {'dep1': '5', 'dep2': '3'}})
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp is None
+
+
+def test_match_extra_packages_allowed(venvscache, fake_venv):
+    venvscache.max_extras = 2
+    reqs = {'pypi': get_reqs('dep1')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    venv = fake_venv("venv", installed={'pypi': {'dep1': '5', 'dep2': '3', 'dep3': '1'}})
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp["extra"] == "venv"
+
+
+def test_nomatch_too_many_extra_packages(venvscache, fake_venv):
+    venvscache.max_extras = 1
+    reqs = {'pypi': get_reqs('dep1')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    venv = fake_venv("venv", installed={'pypi': {'dep1': '5', 'dep2': '3', 'dep3': '1'}})
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp is None
+
+
+def test_match_less_extra_packages(venvscache, fake_venv):
+    venvscache.max_extras = 5
+    reqs = {'pypi': get_reqs('dep1')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    venv1 = fake_venv("venv1", installed={'pypi': {'dep1': '5', 'dep2': '3', 'dep3': '1'}})
+    venv2 = fake_venv("venv2", installed={'pypi': {'dep1': '4', 'dep2': '3'}})
+    venv3 = fake_venv("venv3", installed={'pypi': {'dep1': '5', 'dep3': '3', 'dep4': '1'}})
+    resp = venvscache._select([venv1, venv2, venv3], reqs, interpreter, uuid='', options=options)
+    assert resp["extra"] == "venv2"
+
+
+def test_match_normalized_names(venvscache, fake_venv):
+    # stored by an old version, without normalizing names
+    reqs = {'pypi': get_reqs('py-yaml', 'foo-bar')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    venv = fake_venv(
+        "venv", installed={'pypi': {'Py_Yaml': '5'}}, distributions={'Foo.Bar': '1'})
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp["extra"] == "venv"
+
+
+def test_match_venv_options_order(venvscache, fake_venv):
+    reqs = {'pypi': get_reqs('dep')}
+    interpreter = 'pythonX.Y'
+    venv = fake_venv(
+        "venv", installed={'pypi': {'dep': '5'}}, options={'venv_options': ['--b', '--a']})
+    options = {'venv_options': ['--a', '--b']}
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp["extra"] == "venv"
+
+
+def test_nomatch_incomplete(venvscache, fake_venv):
+    reqs = {'pypi': get_reqs('dep')}
+    interpreter = 'pythonX.Y'
+    options = {'foo': 'bar'}
+    venv = fake_venv("venv", installed={'pypi': {'dep': '5'}}, incomplete=True)
+    resp = venvscache._select([venv], reqs, interpreter, uuid='', options=options)
+    assert resp is None
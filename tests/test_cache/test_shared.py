@@ -0,0 +1,66 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3, as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+from unittest.mock import patch
+
+from packaging.requirements import Requirement
+
+from fades import cache
+
+
+def _store(venvscache, env_path, installed):
+    metadata = {"env_path": env_path, "env_bin_path": env_path / "bin"}
+    venvscache.store(installed, metadata, "interpreter", {"venv_options": []}, fingerprint="fp")
+
+
+def test_store_rewrites_under_lease(tmp_path):
+    venvscache = cache.SharedVEnvsCache(tmp_path / "venvs.idx")
+    with patch.object(cache, 'leaselock', wraps=cache.leaselock) as lease_mock:
+        with patch.object(cache, 'atomic_write', wraps=cache.atomic_write) as write_mock:
+            _store(venvscache, tmp_path / "env1", {"pypi": {"dep": "1"}})
+            _store(venvscache, tmp_path / "env2", {"pypi": {"dep": "2"}})
+    assert lease_mock.call_count == 2
+    assert write_mock.call_count == 2  # the whole index is rewritten, never appended
+    assert len(venvscache._read_cache()) == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["venvs.idx"]
+
+
+def test_remove_and_nested_lock(tmp_path):
+    venvscache = cache.SharedVEnvsCache(tmp_path / "venvs.idx")
+    _store(venvscache, tmp_path / "env1", {"pypi": {"dep": "1"}})
+    _store(venvscache, tmp_path / "env2", {"pypi": {"dep": "2"}})
+    venvscache.remove(tmp_path / "env1")
+    venvscache.update(tmp_path / "env2", distributions={"dep": "2", "other": "3"})
+    venvscache.compact()
+
+    (entry,) = venvscache.get_entries()
+    assert entry["metadata"]["env_path"] == tmp_path / "env2"
+    assert entry["distributions"] == {"dep": "2", "other": "3"}
+
+
+def test_get_matching_entry(tmp_path):
+    venvscache = cache.SharedVEnvsCache(tmp_path / "venvs.idx")
+    _store(venvscache, tmp_path / "env1", {"pypi": {"dep": "1"}})
+    reqs = {"pypi": [Requirement("dep")]}
+
+    # the venv directory is missing
+    assert venvscache.get_matching_entry(reqs, "interpreter", {"venv_options": []}) is None
+
+    (tmp_path / "env1").mkdir()
+    venv = venvscache.get_matching_entry(reqs, "interpreter", {"venv_options": []})
+    assert venv["fingerprint"] == "fp"
+    assert venv["installed"] == {"pypi": {"dep": "1"}}
+    assert venvscache.get_matching_entry(reqs, "other", {"venv_options": []}) is None
@@ -51,3 +51,55 @@ def test_with_previous_content(tmp_file):
         assert data['metadata'] == metadata
         assert data['interpreter'] == 'interpreter'
         assert data['options'] == 'options'
+
+
+def test_with_fingerprint(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "some/path", "env_bin_path": "other/path"}
+    venvscache.store('installed', metadata, 'interpreter', 'options', fingerprint='abc123')
+
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        data = json.loads(fh.readline())
+    assert data['fingerprint'] == 'abc123'
+
+
+def test_with_distributions(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "some/path", "env_bin_path": "other/path"}
+    distributions = {"dep1": "1.0", "dep2": "2.0"}
+    venvscache.store('installed', metadata, 'interpreter', 'options', distributions=distributions)
+
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        data = json.loads(fh.readline())
+    assert data['distributions'] == distributions
+
+
+def test_update(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata1 = {"env_path": "path/env1", "env_bin_path": "other/path"}
+    metadata2 = {"env_path": "path/env2", "env_bin_path": "other/path"}
+    venvscache.store('installed1', metadata1, 'interpreter', 'options')
+    venvscache.store('installed2', metadata2, 'interpreter', 'options')
+
+    venvscache.update("path/env1", distributions={"dep": "1.0"})
+
+    entries = [json.loads(line) for line in venvscache._read_cache()]
+    assert [entry['installed'] for entry in entries] == ['installed2', 'installed1']
+    assert entries[1]['distributions'] == {"dep": "1.0"}
+    assert entries[1]['metadata'] == metadata1
+
+
+def test_update_missing(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    venvscache.update("path/env1", distributions={"dep": "1.0"})
+    assert venvscache._read_cache() == []
+
+
+def test_incomplete(tmp_file):
+    venvscache = cache.VEnvsCache(tmp_file)
+    metadata = {"env_path": "some/path", "env_bin_path": "other/path"}
+    venvscache.store('installed', metadata, 'interpreter', 'options', incomplete=True)
+
+    with open(tmp_file, 'rt', encoding='utf8') as fh:
+        data = json.loads(fh.readline())
+    assert data['incomplete'] is True
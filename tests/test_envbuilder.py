@@ -23,9 +23,10 @@ import unittest
 from datetime import datetime, timedelta
 from packaging.requirements import Requirement
 from pathlib import Path
-from unittest.mock import Mock, patch, call
+from unittest.mock import MagicMock, Mock, patch, call
 
 import logassert
+import pytest
 
 from fades import FadesError, REPO_PYPI, REPO_VCS
 from fades import cache, envbuilder, parsing
@@ -89,7 +90,8 @@ class EnvCreationTestCase(unittest.TestCase):
         })
         expected_pipmanager_call = call(
             'env_bin_path', pip_installed='pip_installed', options=[],
-            avoid_pip_upgrade=avoid_pip_upgrade)
+            avoid_pip_upgrade=avoid_pip_upgrade, shared_pip=None, deferred_compile=False,
+            capture_lock=False)
         self.assertEqual(mock_mgr_c.call_args, expected_pipmanager_call)
 
     def test_create_vcs(self):
@@ -201,6 +203,15 @@ class EnvCreationTestCase(unittest.TestCase):
             self.assertFalse(env_builder.system_site_packages)
             self.assertTrue(mock_create.called)
 
+    def test_create_without_pip_for_shared_pip(self):
+        env_builder = envbuilder._FadesEnvBuilder()
+        options = {"venv_options": [], "shared_pip": True}
+        with patch.object(EnvBuilder, 'create') as mock_create:
+            env_builder.create_env('python3', True, options)
+            self.assertFalse(env_builder.with_pip)
+            self.assertFalse(env_builder.pip_installed)
+            self.assertTrue(mock_create.called)
+
     def test_create_virtual_environment(self):
         env_builder = envbuilder._FadesEnvBuilder()
         interpreter = 'pythonX.Y'
@@ -232,7 +243,7 @@ class EnvDestructionTestCase(unittest.TestCase):
         builder.create_env('python', False, options=options)
         assert os.path.exists(builder.env_path)
 
-        cache_mock = Mock()
+        cache_mock = MagicMock()
         envbuilder.destroy_venv(builder.env_path, cache_mock)
         self.assertFalse(os.path.exists(builder.env_path))
         cache_mock.remove.assert_called_with(builder.env_path)
@@ -241,7 +252,7 @@ class EnvDestructionTestCase(unittest.TestCase):
         builder = envbuilder._FadesEnvBuilder()
         assert not os.path.exists(builder.env_path)
 
-        cache_mock = Mock()
+        cache_mock = MagicMock()
         envbuilder.destroy_venv(builder.env_path, cache_mock)
         self.assertFalse(os.path.exists(builder.env_path))
         cache_mock.remove.assert_called_with(builder.env_path)
@@ -329,6 +340,32 @@ class UsageManagerTestCase(unittest.TestCase):
                 else:
                     self.assertEqual(old_date, d, msg="Others envs have old date")
 
+    def test_venvs_in_lower_layers_are_not_removed(self):
+        old_date = datetime.now()
+        new_date = old_date + timedelta(days=5)
+        system_dir = Path(self.temp_folder) / 'system'
+        system_dir.mkdir()
+        system_cache = cache.VEnvsCache(system_dir / 'venvs.idx')
+        system_cache.store('', {'env_path': system_dir / 'sysenv', "env_bin_path": ""}, '', '')
+        (system_dir / 'sysenv').mkdir()
+        venvscache = cache.VEnvsCache(
+            Path(self.tempfile), lower_layers=[system_dir / 'venvs.idx'])
+
+        with patch('fades.envbuilder.datetime') as mock_datetime:
+            mock_datetime.now.return_value = old_date
+            mock_datetime.strptime.side_effect = lambda *args, **kw: datetime.strptime(*args, **kw)
+            mock_datetime.strftime.side_effect = lambda *args, **kw: datetime.strftime(*args, **kw)
+
+            manager = envbuilder.UsageManager(self.file_path, venvscache)
+            manager.store_usage_stat(venvscache.get_venv(uuid='sysenv'), venvscache)
+
+            mock_datetime.now.return_value = new_date
+            with patch('fades.envbuilder.destroy_venv') as destroy_venv_mock:
+                manager.clean_unused_venvs(4)
+
+        destroyed = [call[0][0].name for call in destroy_venv_mock.call_args_list]
+        self.assertEqual(sorted(destroyed), self.uuids)
+
     def test_executionerror_exception(self):
         env_builder = envbuilder._FadesEnvBuilder()
         interpreter = 'python3'
@@ -387,3 +424,395 @@ class UsageManagerTestCase(unittest.TestCase):
                 for uuid in self.uuids[1:]:
                     env_path = self.venvscache.get_venv(uuid=uuid)['env_path']
                     destroy_venv_mock.assert_any_call(env_path, self.venvscache)
+
+
+def _fake_venv_create(env_builder, interpreter, is_current, options):
+    """Create a minimal venv structure, with the venv path in the pip's shebang."""
+    bin_path = env_builder.env_path / "bin"
+    bin_path.mkdir(parents=True)
+    (bin_path / "pip").write_text("#!{}/bin/python\n".format(env_builder.env_path))
+    (env_builder.env_path / "pyvenv.cfg").write_text(
+        "home = /usr/bin\ncommand = /usr/bin/python3 -m venv {}\n".format(env_builder.env_path))
+    env_builder.env_bin_path = bin_path
+    return env_builder.env_path, bin_path, True
+
+
+def test_relocate_venv(tmp_path):
+    old_path = tmp_path / "old"
+    _fake_venv_create(Mock(env_path=old_path), None, None, None)
+    (old_path / "bin" / "python").symlink_to("/usr/bin/python3")
+    new_path = tmp_path / "new"
+    old_path.rename(new_path)
+
+    envbuilder.relocate_venv(new_path, old_path)
+
+    assert (new_path / "bin" / "pip").read_text() == "#!{}/bin/python\n".format(new_path)
+    assert str(old_path) not in (new_path / "pyvenv.cfg").read_text()
+    assert os.readlink(new_path / "bin" / "python") == "/usr/bin/python3"
+
+
+def _shared_venv_entry(env_path):
+    """Build a cache entry for a fake venv."""
+    _fake_venv_create(Mock(env_path=env_path), None, None, None)
+    return {
+        'metadata': {'env_path': env_path, 'env_bin_path': env_path / "bin",
+                     'pip_installed': True},
+        'installed': {'pypi': {'dep': '1'}}, 'interpreter': 'interpreter',
+        'options': {'venv_options': []}, 'fingerprint': 'fp', 'distributions': {'dep': '1'},
+    }
+
+
+def test_materialize_venv(tmp_path, basedir):
+    shared_venv = _shared_venv_entry(tmp_path / "shared" / "uuid1")
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    metadata = envbuilder.materialize_venv(shared_venv, venvscache)
+
+    env_path = metadata['env_path']
+    assert env_path.parent == basedir
+    assert metadata['env_bin_path'] == env_path / "bin"
+    assert (env_path / "bin" / "pip").read_text() == "#!{}/bin/python\n".format(env_path)
+    assert (tmp_path / "shared" / "uuid1" / "pyvenv.cfg").exists()  # the original is kept
+    venv = venvscache.get_entry(env_path.name)
+    assert venv['fingerprint'] == 'fp'
+    assert venv['distributions'] == {'dep': '1'}
+
+
+def test_materialize_venv_failing(tmp_path, basedir, logs):
+    shared_venv = _shared_venv_entry(tmp_path / "shared" / "uuid1")
+    shutil.rmtree(tmp_path / "shared")
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    assert envbuilder.materialize_venv(shared_venv, venvscache) is None
+    assert "Error copying the virtualenv from the shared cache" in logs.warning
+    assert list(basedir.iterdir()) == []
+
+
+def test_publish_venv(tmp_path):
+    local_venv = _shared_venv_entry(tmp_path / "local" / "uuid1")
+    shared_dir = tmp_path / "shared"
+    shared_dir.mkdir()
+    shared_cache = cache.SharedVEnvsCache(shared_dir / "venvs.idx")
+    envbuilder.publish_venv(local_venv, shared_cache)
+
+    shared_path = shared_dir / "uuid1"
+    assert (shared_path / "bin" / "pip").read_text() == "#!{}/bin/python\n".format(shared_path)
+    (venv,) = shared_cache.get_entries()
+    assert venv['metadata']['env_path'] == shared_path
+    assert venv['fingerprint'] == 'fp'
+
+    # published again (e.g. by other machine) is ignored
+    other_venv = _shared_venv_entry(tmp_path / "other" / "uuid2")
+    envbuilder.publish_venv(other_venv, shared_cache)
+    assert len(shared_cache.get_entries()) == 1
+    assert not (shared_dir / "uuid2").exists()
+
+
+def test_build_slot_unlimited(basedir):
+    with envbuilder.build_slot(None):
+        pass
+    assert list(basedir.iterdir()) == []
+
+
+def test_build_slot_limited(basedir, logs):
+    with envbuilder.build_slot(2):
+        assert (basedir / "build-slots" / "slot-0").exists()
+    assert "Got a build slot after" in logs.debug
+
+
+def test_sparepool_empty(basedir):
+    pool = envbuilder.SparePool(2, 'pythonX.Y', {'venv_options': []})
+    assert pool.claim() is None
+
+
+def test_sparepool_fill_and_claim(basedir):
+    with patch.object(envbuilder._FadesEnvBuilder, 'create_env', _fake_venv_create):
+        pool = envbuilder.SparePool(2, 'pythonX.Y', {'venv_options': []})
+        pool.fill('python', True, {'venv_options': []})
+        assert len(pool._get_spares()) == 2
+
+        venv_data = pool.claim()
+
+    assert len(pool._get_spares()) == 1
+    env_path = venv_data['env_path']
+    assert env_path.parent == basedir
+    assert venv_data['env_bin_path'] == env_path / "bin"
+    assert venv_data['pip_installed']
+    assert (env_path / "bin" / "pip").read_text() == "#!{}/bin/python\n".format(env_path)
+
+
+def test_sparepool_fill_completes(basedir):
+    created = []
+
+    def fake_create(env_builder, *args):
+        created.append(env_builder.env_path)
+        return _fake_venv_create(env_builder, *args)
+
+    with patch.object(envbuilder._FadesEnvBuilder, 'create_env', fake_create):
+        pool = envbuilder.SparePool(2, 'pythonX.Y', {'venv_options': []})
+        pool.fill('python', True, {'venv_options': []})
+        pool.claim()
+        pool.fill('python', True, {'venv_options': []})
+    assert len(pool._get_spares()) == 2
+    assert len(created) == 3  # just created the missing one in the second fill
+
+
+def test_sparepool_separated_by_options(basedir):
+    pool1 = envbuilder.SparePool(2, 'pythonX.Y', {'venv_options': []})
+    pool2 = envbuilder.SparePool(2, 'pythonX.Y', {'venv_options': ['--foo']})
+    pool3 = envbuilder.SparePool(2, 'pythonZ.W', {'venv_options': []})
+    assert len({pool1.pooldir, pool2.pooldir, pool3.pooldir}) == 3
+
+
+def test_create_venv_from_spare_pool():
+    requested = {REPO_PYPI: [get_req('dep1 == v1')]}
+    pool = Mock()
+    pool.claim.return_value = {
+        'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    with patch.object(envbuilder._FadesEnvBuilder, 'create_env') as mock_create:
+        with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+            mock_mgr_c.return_value = fake_manager = EnvCreationTestCase.FakeManager()
+            fake_manager.really_installed = {'dep1': 'v1'}
+            venv_data, installed = envbuilder.create_venv(
+                requested, 'python3', True, {"venv_options": []}, [], False, spare_pool=pool)
+
+    assert not mock_create.called
+    assert venv_data['env_path'] == 'env_path'
+    assert installed == {REPO_PYPI: {'dep1': 'v1'}}
+
+
+def test_sparepool_give_back(basedir):
+    venv_data = {'env_path': basedir / 'someuuid'}
+    _fake_venv_create(Mock(env_path=venv_data['env_path']), None, None, None)
+    pool = envbuilder.SparePool(1, 'pythonX.Y', {'venv_options': []})
+    assert pool.give_back(venv_data)
+
+    spare_path = pool.pooldir / 'someuuid'
+    assert pool._get_spares() == [spare_path]
+    assert (spare_path / "bin" / "pip").read_text() == "#!{}/bin/python\n".format(spare_path)
+
+    # pool is full now
+    other_data = {'env_path': basedir / 'otheruuid'}
+    _fake_venv_create(Mock(env_path=other_data['env_path']), None, None, None)
+    assert not pool.give_back(other_data)
+    assert other_data['env_path'].exists()
+
+
+def test_recycle_venv_no_pool():
+    with patch.object(envbuilder, 'destroy_venv') as mock_destroy:
+        envbuilder.recycle_venv({'env_path': 'env_path'})
+    mock_destroy.assert_called_once_with('env_path')
+
+
+def test_recycle_venv_pool_full():
+    pool = Mock()
+    pool.give_back.return_value = False
+    with patch.object(envbuilder, 'destroy_venv') as mock_destroy:
+        envbuilder.recycle_venv({'env_path': 'env_path'}, pool)
+    mock_destroy.assert_called_once_with('env_path')
+
+
+def test_create_venv_prepared():
+    requested = {REPO_PYPI: [get_req('dep1 == v1')]}
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    with patch.object(envbuilder, 'prepare_venv') as mock_prepare:
+        with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+            mock_mgr_c.return_value = fake_manager = EnvCreationTestCase.FakeManager()
+            fake_manager.really_installed = {'dep1': 'v1'}
+            venv_data, _ = envbuilder.create_venv(
+                requested, 'python3', True, {"venv_options": []}, [], False, venv_data=prepared)
+
+    assert not mock_prepare.called
+    assert venv_data is prepared
+
+
+def test_compile_in_background(tmp_path):
+    site_packages = tmp_path / "lib" / "python3.X" / "site-packages"
+    site_packages.mkdir(parents=True)
+    venv_data = {'env_path': tmp_path, 'env_bin_path': tmp_path / "bin"}
+    with patch.object(envbuilder.helpers, 'spawn_detached') as mock_spawn:
+        envbuilder.compile_in_background(venv_data)
+    mock_spawn.assert_called_once_with(
+        [tmp_path / "bin" / "python", "-m", "compileall", "-q", "-j", "0", site_packages])
+
+
+def test_compile_in_background_no_site_packages(tmp_path):
+    venv_data = {'env_path': tmp_path, 'env_bin_path': tmp_path / "bin"}
+    with patch.object(envbuilder.helpers, 'spawn_detached') as mock_spawn:
+        envbuilder.compile_in_background(venv_data)
+    assert not mock_spawn.called
+
+
+def test_create_venv_parallel_install():
+    requested = {
+        REPO_PYPI: [get_req('dep1 == v1'), get_req('dep2 == v2')],
+        REPO_VCS: [parsing.VCSDependency("someurl")],
+    }
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.get_version.side_effect = lambda name: {'dep1': 'v1', 'dep2': 'v2'}[name]
+        _, installed = envbuilder.create_venv(
+            requested, 'python3', True, {"venv_options": []}, [], False, venv_data=prepared,
+            parallel_install=True)
+
+    # pypi ones all together, vcs as usual
+    mgr.install_parallel.assert_called_once_with(requested[REPO_PYPI])
+    mgr.install.assert_called_once_with(parsing.VCSDependency("someurl"))
+    assert installed == {REPO_PYPI: {'dep1': 'v1', 'dep2': 'v2'}, REPO_VCS: {'someurl': None}}
+
+
+def test_create_venv_parallel_install_not_supported():
+    requested = {REPO_PYPI: [get_req('dep1 == v1'), get_req('dep2 == v2')]}
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.supports_parallel_install.return_value = False
+        mgr.get_version.side_effect = lambda name: {'dep1': 'v1', 'dep2': 'v2'}[name]
+        envbuilder.create_venv(
+            requested, 'python3', True, {"venv_options": []}, ['--user'], False,
+            venv_data=prepared, parallel_install=True)
+
+    # installed one by one, as usual
+    assert not mgr.install_parallel.called
+    assert mgr.install.call_args_list == [call(dep) for dep in requested[REPO_PYPI]]
+
+
+def test_create_venv_capturing_lock(basedir):
+    requested = {REPO_PYPI: [get_req('dep1 == v1')]}
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.get_version.return_value = 'v1'
+        mgr.get_lock_lines.return_value = ['dep1==v1 --hash=sha256:f00']
+        envbuilder.create_venv(
+            requested, 'python3', True, {"venv_options": []}, [], False, venv_data=prepared,
+            fingerprint='fprint')
+
+    assert mock_mgr_c.call_args[1]['capture_lock']
+    mgr.install.assert_called_once_with(requested[REPO_PYPI][0])
+    lockfile = basedir / 'lockfiles' / 'fprint.txt'
+    assert lockfile.read_text() == 'dep1==v1 --hash=sha256:f00\n'
+
+
+def test_create_venv_replaying_lock(basedir):
+    requested = {REPO_PYPI: [get_req('dep1 == v1')]}
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    lockfile = basedir / 'lockfiles' / 'fprint.txt'
+    lockfile.parent.mkdir()
+    lockfile.write_text('dep1==v1 --hash=sha256:f00\n')
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.get_version.return_value = 'v1'
+        _, installed = envbuilder.create_venv(
+            requested, 'python3', True, {"venv_options": []}, [], False, venv_data=prepared,
+            fingerprint='fprint')
+
+    mgr.install_locked.assert_called_once_with(lockfile)
+    assert not mgr.install.called
+    assert not mgr.get_lock_lines.called
+    assert installed == {REPO_PYPI: {'dep1': 'v1'}}
+
+
+def test_create_venv_replaying_lock_failing(basedir, logs):
+    requested = {REPO_PYPI: [get_req('dep1 == v1')]}
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    lockfile = basedir / 'lockfiles' / 'fprint.txt'
+    lockfile.parent.mkdir()
+    lockfile.write_text('dep1==v1 --hash=sha256:f00\n')
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.get_version.return_value = 'v1'
+        mgr.install_locked.side_effect = ValueError("hash mismatch")
+        envbuilder.create_venv(
+            requested, 'python3', True, {"venv_options": []}, [], False, venv_data=prepared,
+            fingerprint='fprint')
+
+    mgr.install.assert_called_once_with(requested[REPO_PYPI][0])
+    assert "Couldn't install from the lock file" in logs.warning
+
+
+def test_get_distributions(tmp_path):
+    site_packages = tmp_path / "lib" / "python3.X" / "site-packages"
+    for name, version in [("foo", "1.0"), ("Bar_Baz", "2.3")]:
+        dist_info = site_packages / "{}-{}.dist-info".format(name, version)
+        dist_info.mkdir(parents=True)
+        (dist_info / "METADATA").write_text(
+            "Metadata-Version: 2.1\nName: {}\nVersion: {}\n".format(name, version))
+
+    distributions = envbuilder.get_distributions(tmp_path)
+    assert distributions == {"foo": "1.0", "bar-baz": "2.3"}
+
+
+def test_create_venv_partially_failing():
+    requested = {REPO_PYPI: [get_req('dep1 == v1'), get_req('dep2'), get_req('dep3')]}
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.install.side_effect = [None, Exception("Kapow!")]
+        mgr.get_version.return_value = 'v1'
+        with patch.object(envbuilder, 'destroy_venv') as mock_destroy:
+            with pytest.raises(envbuilder.IncompleteVenvError) as cm:
+                envbuilder.create_venv(
+                    requested, 'python3', True, {"venv_options": []}, [], False,
+                    venv_data=prepared)
+
+    assert not mock_destroy.called
+    assert str(cm.value) == 'Dependency installation failed'
+    assert cm.value.venv_data == prepared
+    assert cm.value.installed == {REPO_PYPI: {'dep1': 'v1'}}
+
+
+def test_create_venv_resuming():
+    requested = {
+        REPO_PYPI: [get_req('dep1 >= 1'), get_req('dep2')],
+        REPO_VCS: [parsing.VCSDependency("someurl"), parsing.VCSDependency("otherurl")],
+    }
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    already_installed = {REPO_PYPI: {'dep1': '2'}, REPO_VCS: {'someurl': None}}
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.get_version.side_effect = lambda name: {'dep1': '2', 'dep2': '3'}[name]
+        _, installed = envbuilder.create_venv(
+            requested, 'python3', True, {"venv_options": []}, [], False, venv_data=prepared,
+            fingerprint='fprint', already_installed=already_installed)
+
+    assert mgr.install.call_args_list == [
+        call(get_req('dep2')), call(parsing.VCSDependency("otherurl"))]
+    assert not mock_mgr_c.call_args[1]['capture_lock']
+    assert installed == {
+        REPO_PYPI: {'dep1': '2', 'dep2': '3'},
+        REPO_VCS: {'someurl': None, 'otherurl': None},
+    }
+
+
+def test_create_venv_resuming_failing_in_other_repo():
+    requested = {
+        REPO_VCS: [parsing.VCSDependency("someurl")],
+        REPO_PYPI: [get_req('dep1 >= 1')],
+    }
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    already_installed = {REPO_PYPI: {'dep1': '2'}}
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.install.side_effect = Exception("Kapow!")
+        with patch.object(envbuilder, 'destroy_venv') as mock_destroy:
+            with pytest.raises(envbuilder.IncompleteVenvError) as cm:
+                envbuilder.create_venv(
+                    requested, 'python3', True, {"venv_options": []}, [], False,
+                    venv_data=prepared, already_installed=already_installed)
+
+    assert not mock_destroy.called
+    assert cm.value.installed == {REPO_PYPI: {'dep1': '2'}, REPO_VCS: {}}
+    assert already_installed == {REPO_PYPI: {'dep1': '2'}}
+
+
+def test_create_venv_resuming_old_version():
+    requested = {REPO_PYPI: [get_req('dep1 >= 3')]}
+    prepared = {'env_path': 'env_path', 'env_bin_path': 'env_bin_path', 'pip_installed': True}
+    with patch.object(envbuilder, 'PipManager') as mock_mgr_c:
+        mgr = mock_mgr_c.return_value
+        mgr.get_version.return_value = '3'
+        envbuilder.create_venv(
+            requested, 'python3', True, {"venv_options": []}, [], False, venv_data=prepared,
+            already_installed={REPO_PYPI: {'dep1': '2'}})
+
+    mgr.install.assert_called_once_with(get_req('dep1 >= 3'))
@@ -0,0 +1,103 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Tests for the fork server."""
+
+import ast
+import subprocess
+import sys
+import time
+
+import pytest
+
+from fades import forkserver
+
+# a child that records what it got
+CHILD = """
+import os, sys
+with open(os.environ['OUTPUT'], 'wt') as fh:
+    fh.write(repr([sys.argv, __name__, 'xml.dom.minidom' in sys.modules, os.getcwd()]))
+sys.exit(7)
+"""
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Start the server, importing a module in advance; return its socket path."""
+    socket_path = tmp_path / "server.sock"
+    cmd = forkserver.get_server_command(sys.executable, socket_path, ['xml.dom.minidom'])
+    proc = subprocess.Popen(cmd)
+    deadline = time.monotonic() + 10
+    while not socket_path.exists():
+        assert time.monotonic() < deadline
+        time.sleep(.01)
+    yield socket_path
+    proc.terminate()
+    proc.wait()
+
+
+def test_no_server(tmp_path):
+    assert forkserver.run(tmp_path / "missing.sock", ['script.py'], False) is None
+
+
+def test_abandoned_socket(tmp_path):
+    socket_path = tmp_path / "abandoned.sock"
+    socket_path.touch()
+    assert forkserver.run(socket_path, ['script.py'], False) is None
+
+
+def test_run_script(tmp_path, server, monkeypatch):
+    script = tmp_path / "script.py"
+    script.write_text(CHILD)
+    output = tmp_path / "output"
+    monkeypatch.setenv('OUTPUT', str(output))
+    monkeypatch.chdir(tmp_path)
+
+    proc = forkserver.run(server, [str(script), '--foo'], False)
+    assert proc.wait() == 7
+
+    argv, name, preimported, cwd = ast.literal_eval(output.read_text())
+    assert argv == [str(script), '--foo']
+    assert name == '__main__'
+    assert preimported
+    assert cwd == str(tmp_path)
+
+
+def test_run_module(tmp_path, server, monkeypatch):
+    (tmp_path / "somemodule.py").write_text(CHILD)
+    output = tmp_path / "output"
+    monkeypatch.setenv('OUTPUT', str(output))
+    monkeypatch.chdir(tmp_path)
+
+    proc = forkserver.run(server, ['somemodule', '--bar'], True)
+    assert proc.wait() == 7
+
+    argv, name, _, _ = ast.literal_eval(output.read_text())
+    assert argv == [str(tmp_path / "somemodule.py"), '--bar']
+    assert name == '__main__'
+
+
+def test_run_failing(tmp_path, server, capfd):
+    script = tmp_path / "script.py"
+    script.write_text("raise ValueError('boom')\n")
+
+    proc = forkserver.run(server, [str(script)], False)
+    assert proc.wait() == 1
+
+    err = capfd.readouterr().err
+    assert err.startswith("Traceback (most recent call last):\n  File \"{}\"".format(script))
+    assert "ValueError: boom" in err
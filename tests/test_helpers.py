@@ -32,7 +32,7 @@ import logassert
 import pytest
 from xdg import BaseDirectory
 
-from fades import helpers, parsing
+from fades import FadesError, helpers, parsing
 
 
 PATH_TO_EXAMPLES = "tests/examples/"
@@ -76,72 +76,86 @@ class GetInterpreterVersionTestCase(unittest.TestCase):
         self.assertTrue(mock.call_count, 1)
 
 
-class GetInterpreterInfoTestCase(unittest.TestCase):
-    """Some tests for _get_interpreter_info."""
+PROBE_INFO = {
+    "path": "/path/to/python9.8", "version": "9.8.7", "implementation": "cpython",
+    "soabi": "cpython-98-x86_64-linux-gnu", "platform": "linux-x86_64",
+    "build": ["main", "Jan  1 2030 00:00:00"],
+}
 
-    def setUp(self):
-        logassert.setup(self, 'fades.helpers')
 
-    def test_none_requested(self):
-        with patch.object(sys, 'version_info', (9, 8)), patch.object(sys,
-                                                                     'executable',
-                                                                     '/path/to/python'):
-            interpreter = helpers._get_interpreter_info(None)
-        self.assertEqual(interpreter, '/path/to/python9.8')
-
-    def test_requested_fullpath_nodigit(self):
-        response = [('{"serial": 0,"path": "/path/to/python","minor": 8,"major": 9,"micro": 0,'
-                    '"releaselevel": "ultimate"}')]
-        with patch.object(helpers, 'logged_exec', return_value=response):
-            interpreter = helpers._get_interpreter_info('/path/to/python')
-        self.assertEqual(interpreter, '/path/to/python9.8')
-
-    def test_requested_fullpath_with_major(self):
-        response = [('{"serial": 0,"path": "/path/to/python9","minor": 8,"major": 9,"micro": 0,'
-                    '"releaselevel": "ultimate"}')]
-        with patch.object(helpers, 'logged_exec', return_value=response):
-            interpreter = helpers._get_interpreter_info('/path/to/python9')
-        self.assertEqual(interpreter, '/path/to/python9.8')
-
-    def test_requested_fullpath_with_minor(self):
-        response = [('{"serial": 0,"path": "/path/to/python9.8","minor": 8,"major": 9,"micro": 0,'
-                    '"releaselevel": "ultimate"}')]
-        with patch.object(helpers, 'logged_exec', return_value=response):
-            interpreter = helpers._get_interpreter_info('/path/to/python9.8')
-        self.assertEqual(interpreter, '/path/to/python9.8')
-
-    def test_requested_nodigit(self):
-        response = [('{"serial": 0,"path": "/path/to/python","minor": 8,"major": 9,"micro": 0,'
-                    '"releaselevel": "ultimate"}')]
-        with patch.object(helpers, 'logged_exec', return_value=response):
-            interpreter = helpers._get_interpreter_info('python')
-        self.assertEqual(interpreter, '/path/to/python9.8')
-
-    def test_requested_with_major(self):
-        response = [('{"serial": 0,"path": "/path/to/python9","minor": 8,"major": 9,"micro": 0,'
-                    '"releaselevel": "ultimate"}')]
-        with patch.object(helpers, 'logged_exec', return_value=response):
-            interpreter = helpers._get_interpreter_info('python9')
-        self.assertEqual(interpreter, '/path/to/python9.8')
-
-    def test_requested_with_minor(self):
-        response = [('{"serial": 0,"path": "/path/to/python9.8","minor": 8,"major": 9,"micro": 0,'
-                    '"releaselevel": "ultimate"}')]
-        with patch.object(helpers, 'logged_exec', return_value=response):
-            interpreter = helpers._get_interpreter_info('python9.8')
-        self.assertEqual(interpreter, '/path/to/python9.8')
-
-    def test_requested_not_exists(self):
-        side_effect = IOError("[Errno 2] No such file or directory: 'pythonME'")
-
-        with patch('fades.helpers.logged_exec') as mock_lexec:
-            mock_lexec.side_effect = side_effect
-
-            with self.assertRaises(Exception):
-                helpers._get_interpreter_info('pythonME')
-
-        self.assertLoggedError("Error getting requested interpreter version:"
-                               " [Errno 2] No such file or directory: 'pythonME'")
+@pytest.fixture
+def fake_python(tmp_path, basedir):
+    """A fake interpreter binary, with the basedir also in the temp dir."""
+    python = tmp_path / "python9.8"
+    python.write_bytes(b"\x7fELF fake binary")
+    python.chmod(0o755)
+    return python
+
+
+def _fake_probe(info=PROBE_INFO):
+    return patch.object(helpers, 'logged_exec', return_value=[json.dumps(info)])
+
+
+def test_interpreter_info_current():
+    with patch.object(helpers, '_probe_interpreter', return_value=PROBE_INFO) as mock:
+        interpreter = helpers._get_interpreter_info(None)
+    mock.assert_called_once_with(sys.executable)
+    assert interpreter.startswith("cpython9.8.7-")
+
+
+def test_interpreter_info_same_build(fake_python):
+    alias = fake_python.with_name("python")
+    alias.symlink_to(fake_python)
+    with _fake_probe():
+        assert helpers._get_interpreter_info(str(fake_python)) == helpers._get_interpreter_info(
+            str(alias))
+
+
+@pytest.mark.parametrize("key,value", [
+    ("path", "/other/path/python9.8"),
+    ("version", "9.8.8"),
+    ("soabi", "cpython-98d-x86_64-linux-gnu"),
+    ("platform", "linux-aarch64"),
+    ("build", ["main", "Feb  2 2030 00:00:00"]),
+])
+def test_interpreter_info_different(basedir, key, value):
+    with _fake_probe():
+        interpreter1 = helpers._get_interpreter_info('python1')
+    with _fake_probe(dict(PROBE_INFO, **{key: value})):
+        interpreter2 = helpers._get_interpreter_info('python2')
+    assert interpreter1 != interpreter2
+
+
+def test_interpreter_probe_cached(fake_python):
+    with _fake_probe() as mock:
+        info1 = helpers._probe_interpreter(str(fake_python))
+        info2 = helpers._probe_interpreter(str(fake_python))
+    assert info1 == info2 == PROBE_INFO
+    assert mock.call_count == 1
+
+
+def test_interpreter_probe_cache_invalidated(fake_python):
+    with _fake_probe() as mock:
+        helpers._probe_interpreter(str(fake_python))
+        fake_python.write_bytes(b"\x7fELF upgraded fake binary")
+        helpers._probe_interpreter(str(fake_python))
+    assert mock.call_count == 2
+
+
+def test_interpreter_probe_script_not_cached(fake_python):
+    fake_python.write_text("#!/bin/sh\nexec something\n")
+    with _fake_probe() as mock:
+        helpers._probe_interpreter(str(fake_python))
+        helpers._probe_interpreter(str(fake_python))
+    assert mock.call_count == 2
+
+
+def test_interpreter_probe_not_exists(basedir, logs):
+    side_effect = IOError("[Errno 2] No such file or directory: 'pythonME'")
+    with patch.object(helpers, 'logged_exec', side_effect=side_effect):
+        with pytest.raises(FadesError):
+            helpers._get_interpreter_info('pythonME')
+    assert "Error getting requested interpreter version: .* 'pythonME'" in logs.error
 
 
 class GetLatestVersionNumberTestCase(unittest.TestCase):
@@ -582,3 +596,13 @@ def test_getbinpath_windows(tmp_path):
 def test_getbinpath_missing(tmp_path):
     with pytest.raises(ValueError):
         helpers.get_env_bin_path(tmp_path)
+
+
+@pytest.mark.parametrize('returncodes, expected', [
+    ([], 0),
+    ([0, 0], 0),
+    ([0, 1, 3, 0], 3),
+    ([2, -9], -9),
+])
+def test_worst_returncode(returncodes, expected):
+    assert helpers.get_worst_returncode(returncodes) == expected
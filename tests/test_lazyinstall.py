@@ -0,0 +1,91 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Tests for the lazy installation of dependencies in the child program."""
+
+import fcntl
+import importlib
+import subprocess
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from fades import lazyinstall
+
+
+@pytest.fixture
+def install_finder(tmp_path, monkeypatch):
+    """Build a finder whose "pip" just creates the module, and put it in the import system."""
+    monkeypatch.syspath_prepend(str(tmp_path))
+    record_path = tmp_path / "installed.txt"
+
+    def build(module, requirement, exit_code=0):
+        script = (
+            "import pathlib, sys; pathlib.Path({!r}, {!r}).write_text('VALUE = 42'); "
+            "sys.exit({})".format(str(tmp_path), module + ".py", exit_code))
+        finder = lazyinstall.LazyInstallFinder(
+            {module: requirement}, [sys.executable, "-c", script], record_path, quiet=True)
+        monkeypatch.setattr(sys, "meta_path", sys.meta_path + [finder])
+        return finder
+
+    return build
+
+
+def test_install_on_import(install_finder, tmp_path):
+    install_finder("fades_lazymod_ok", "fades-lazymod-ok>=1")
+    module = importlib.import_module("fades_lazymod_ok")
+    assert module.VALUE == 42
+    assert (tmp_path / "installed.txt").read_text() == "fades-lazymod-ok>=1\n"
+
+
+def test_install_failing(install_finder, tmp_path, capsys):
+    install_finder("fades_lazymod_fail", "fades-lazymod-fail", exit_code=1)
+    with pytest.raises(ImportError):
+        importlib.import_module("fades_lazymod_fail")
+    assert "Installation of 'fades-lazymod-fail' failed" in capsys.readouterr().err
+    assert not (tmp_path / "installed.txt").exists()
+
+
+def test_unknown_module(install_finder):
+    finder = install_finder("fades_lazymod_known", "fades-lazymod-known")
+    assert finder.find_spec("fades_lazymod_other") is None
+    assert finder.find_spec("fades_lazymod_known.sub", path=["whatever"]) is None
+    assert finder.dependencies == {"fades_lazymod_known": "fades-lazymod-known"}
+
+
+def test_install_locking_the_venv(install_finder, tmp_path):
+    finder = install_finder("fades_lazymod_locked", "fades-lazymod-locked")
+    finder.lock_path = str(tmp_path / "venv.lock")
+    real_run = subprocess.run
+
+    def locked_run(*args, **kwargs):
+        # the venv lock is held while installing
+        with open(finder.lock_path) as fh:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return real_run(*args, **kwargs)
+
+    with patch.object(subprocess, "run", side_effect=locked_run):
+        module = importlib.import_module("fades_lazymod_locked")
+    assert module.VALUE == 42
+
+
+def test_install_tried_once(install_finder):
+    finder = install_finder("fades_lazymod_once", "fades-lazymod-once", exit_code=1)
+    assert finder.find_spec("fades_lazymod_once") is None
+    assert finder.dependencies == {}
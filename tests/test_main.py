@@ -16,14 +16,21 @@
 
 """Tests for some code in main."""
 
+import argparse
+import contextlib
+import json
 import os
+import shutil
 import unittest
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+import pytest
 from packaging.requirements import Requirement
 
-from fades import VERSION, FadesError, __version__, main, parsing, REPO_PYPI, REPO_VCS
+from fades import (
+    VERSION, FadesError, __version__, cache, envbuilder, lazyinstall, main, parsing,
+    REPO_PYPI, REPO_VCS)
 from tests import create_tempfile
 
 
@@ -270,6 +277,25 @@ def test_autoimport_several_dependencies():
     assert main.AUTOIMPORT_MOD_IMPORTER.format(module='mymod2') in content
 
 
+def test_autoimport_normalized_dependency():
+    """Normalized names are converted to a valid module name."""
+    dependencies = {
+        REPO_PYPI: {Requirement('my-mod'), Requirement('github3-py')},
+    }
+    content = _autoimport_safe_call(dependencies, is_ipython=False)
+
+    assert main.AUTOIMPORT_MOD_IMPORTER.format(module='my_mod') in content
+    assert main.AUTOIMPORT_MOD_IMPORTER.format(module='github3') in content
+
+
+def test_autoimport_mixed_case_module():
+    """The module is imported as written, even if the dependency name is normalized."""
+    dependencies = parsing.parse_manual(['PyQt5'])
+    content = _autoimport_safe_call(dependencies, is_ipython=False)
+
+    assert main.AUTOIMPORT_MOD_IMPORTER.format(module='PyQt5') in content
+
+
 def test_autoimport_including_ipython():
     """Call with ipython modifier."""
     dependencies = {
@@ -309,3 +335,256 @@ def test_autoimport_importer_mod_fail(capsys):
     code = main.AUTOIMPORT_MOD_IMPORTER.format(module='not_there_should_explode')
     exec(code)
     assert capsys.readouterr().out == "::fades:: FAILED to autoimport 'not_there_should_explode'\n"
+
+
+# ---------------------------------------
+# precheck overlapped with venv preparation tests
+
+def test_precheck_while_preparing_ok():
+    deps = {REPO_PYPI: {Requirement('foo')}}
+    with patch('fades.envbuilder.prepare_venv', return_value='venv_data') as mock_prepare:
+        with patch('fades.helpers.check_pypi_exists', return_value=True):
+            with patch('fades.envbuilder.recycle_venv') as mock_recycle:
+                prepared = main._precheck_while_preparing(
+                    deps, 'python', True, 'options', 'spare_pool')
+
+    assert prepared == 'venv_data'
+    mock_prepare.assert_called_once_with('python', True, 'options', 'spare_pool')
+    assert not mock_recycle.called
+
+
+def test_precheck_while_preparing_missing_dep():
+    deps = {REPO_PYPI: {Requirement('foo')}}
+    with patch('fades.envbuilder.prepare_venv', return_value='venv_data'):
+        with patch('fades.helpers.check_pypi_exists', return_value=False):
+            with patch('fades.envbuilder.recycle_venv') as mock_recycle:
+                with pytest.raises(FadesError):
+                    main._precheck_while_preparing(deps, 'python', True, 'options', 'pool')
+
+    mock_recycle.assert_called_once_with('venv_data', 'pool')
+
+
+def test_precheck_while_preparing_check_error():
+    deps = {REPO_PYPI: {Requirement('foo')}}
+    with patch('fades.envbuilder.prepare_venv', return_value='venv_data'):
+        with patch('fades.helpers.check_pypi_exists', side_effect=FadesError("boom")):
+            with patch('fades.envbuilder.recycle_venv') as mock_recycle:
+                with pytest.raises(FadesError):
+                    main._precheck_while_preparing(deps, 'python', True, 'options', 'pool')
+
+    mock_recycle.assert_called_once_with('venv_data', 'pool')
+
+
+# ---------------------------------------
+# building the venv for a request tests
+
+def _build_args(**kwargs):
+    values = dict(
+        python='python3.X', pip_options=[], no_precheck_availability=True,
+        avoid_pip_upgrade=False, deferred_compile=False, parallel_install=False,
+        prebuilding=False, remote_cache_upload=False)
+    values.update(kwargs)
+    return argparse.Namespace(**values)
+
+
+def _build_venvscache(resumed=None):
+    venvscache = MagicMock()
+    venvscache.claim_incomplete.return_value.__enter__.return_value = resumed
+    return venvscache
+
+
+def test_build_venv_from_shared_cache():
+    venvscache = _build_venvscache()
+    shared_cache = MagicMock()
+    with patch('fades.envbuilder.materialize_venv', return_value='venv_data') as mock_mat:
+        with patch('fades.envbuilder.create_venv') as mock_create:
+            venv_data = main._build_venv(
+                _build_args(), 'fp', {}, 'interpreter', True, {}, venvscache, MagicMock(),
+                None, shared_cache, None, None)
+
+    assert venv_data == 'venv_data'
+    mock_mat.assert_called_once_with(
+        shared_cache.get_matching_entry.return_value, venvscache)
+    assert not mock_create.called
+
+
+def test_build_venv_creating(tmp_path):
+    venvscache = _build_venvscache()
+    created = {'env_path': tmp_path / 'uuid'}
+    spare_pool = MagicMock()
+    with patch('fades.envbuilder.create_venv', return_value=(created, 'installed')):
+        with patch('fades.envbuilder.get_distributions', return_value='dists'):
+            with patch('fades.prebuild.record_recipe') as mock_record:
+                venv_data = main._build_venv(
+                    _build_args(), 'fp', {}, 'interpreter', True, {}, venvscache, MagicMock(),
+                    spare_pool, None, None, None)
+
+    assert venv_data is created
+    venvscache.store.assert_called_once_with(
+        'installed', created, 'interpreter', {}, fingerprint='fp', distributions='dists',
+        replace=False)
+    mock_record.assert_called_once_with('fp', {}, 'python3.X', {}, [])
+    spare_pool.replenish_in_background.assert_called_once_with('python3.X', {})
+
+
+def test_build_venv_slot_while_prechecking(tmp_path):
+    venvscache = _build_venvscache()
+    created = {'env_path': tmp_path / 'uuid'}
+    calls = []
+
+    @contextlib.contextmanager
+    def fake_slot(max_builds):
+        calls.append(('slot taken', max_builds))
+        yield
+        calls.append('slot released')
+
+    def fake_precheck(*args):
+        calls.append('precheck')
+        return 'prepared'
+
+    def fake_create(*args, **kwargs):
+        calls.append('create')
+        return created, 'installed'
+
+    args = _build_args(no_precheck_availability=False)
+    deps = {REPO_PYPI: [Requirement('foo')]}
+    with patch('fades.envbuilder.build_slot', fake_slot):
+        with patch.object(main, '_precheck_while_preparing', side_effect=fake_precheck):
+            with patch('fades.envbuilder.create_venv', side_effect=fake_create):
+                with patch('fades.envbuilder.get_distributions', return_value='dists'):
+                    with patch('fades.prebuild.record_recipe'):
+                        main._build_venv(
+                            args, 'fp', deps, 'interpreter', True, {}, venvscache, MagicMock(),
+                            None, None, None, 2)
+
+    assert calls == [('slot taken', 2), 'precheck', 'create', 'slot released']
+
+
+def test_build_venv_resuming_incomplete_again(tmp_path):
+    resumed_venv = {'env_path': tmp_path / 'uuid'}
+    venvscache = _build_venvscache(resumed=(resumed_venv, {REPO_PYPI: {'foo': '1'}}))
+    usage_manager = MagicMock()
+    error = envbuilder.IncompleteVenvError(resumed_venv, {REPO_PYPI: {'foo': '1'}})
+    with patch('fades.envbuilder.create_venv', side_effect=error) as mock_create:
+        with pytest.raises(envbuilder.IncompleteVenvError):
+            main._build_venv(
+                _build_args(), 'fp', {}, 'interpreter', True, {}, venvscache, usage_manager,
+                None, None, None, None)
+
+    assert mock_create.call_args[1]['venv_data'] is resumed_venv
+    assert mock_create.call_args[1]['already_installed'] == {REPO_PYPI: {'foo': '1'}}
+    venvscache.store.assert_called_once_with(
+        {REPO_PYPI: {'foo': '1'}}, resumed_venv, 'interpreter', {}, fingerprint='fp',
+        incomplete=True, replace=True)
+    usage_manager.store_usage_stat.assert_called_once_with(resumed_venv, venvscache)
+
+
+def test_check_updates_in_background():
+    deps = {
+        REPO_PYPI: [Requirement('foo'), Requirement('bar>2')],
+        REPO_VCS: [parsing.VCSDependency('git+http://whatever')],
+    }
+    args = argparse.Namespace(
+        python='python3.X', pip_options=['--pre'], no_precheck_availability=True,
+        avoid_pip_upgrade=False, deferred_compile=False, parallel_install=True,
+        max_concurrent_builds='3', cache_layer=[Path('/srv/layer')],
+        shared_cache=Path('/nfs/fades'), remote_cache='http://cache/', remote_cache_upload=True)
+    options = {'venv_options': ['--system-site-packages'], 'shared_pip': True}
+    with patch('fades.helpers.spawn_detached') as mock_spawn:
+        main._check_updates_in_background(deps, args, options)
+
+    (cmd,), _ = mock_spawn.call_args
+    assert cmd[1:] == [
+        '-m', 'fades', '--check-updates', '--updating-in-background', '--where', '-q',
+        '--python=python3.X', '--venv-options=--system-site-packages', '--shared-pip',
+        '--pip-options=--pre', '--no-precheck-availability', '--parallel-install',
+        '--max-concurrent-builds=3', '--cache-layer=/srv/layer', '--shared-cache=/nfs/fades',
+        '--remote-cache=http://cache/', '--remote-cache-upload',
+        '--dependency=pypi::foo', '--dependency=pypi::bar>2',
+        '--dependency=vcs::git+http://whatever',
+    ]
+
+
+def test_prepare_lazy_install(tmp_path, monkeypatch):
+    monkeypatch.setenv('PYTHONPATH', 'previous')
+    venv_data = {'env_path': tmp_path / 'uuid', 'env_bin_path': tmp_path / 'bin'}
+    deps = [Requirement('pyyaml>=5'), Requirement('foo-bar')]
+    venvscache = cache.VEnvsCache(tmp_path / 'venvs.idx')
+    tempdir = main._prepare_lazy_install(
+        deps, venv_data, ['--pre'], None, quiet=True, venvscache=venvscache)
+    try:
+        assert (tempdir / 'sitecustomize.py').read_text() == Path(
+            lazyinstall.__file__).read_text()
+        assert os.environ['PYTHONPATH'] == str(tempdir) + os.pathsep + 'previous'
+        config = json.loads(os.environ[lazyinstall.CONFIG_ENV_VAR])
+    finally:
+        shutil.rmtree(tempdir)
+        os.environ.pop(lazyinstall.CONFIG_ENV_VAR)
+
+    assert config == {
+        'dependencies': {'yaml': 'pyyaml>=5', 'foo_bar': 'foo-bar'},
+        'pip_command': [str(tmp_path / 'bin' / 'pip'), 'install', '--pre'],
+        'record_path': str(tempdir / 'installed.txt'),
+        'quiet': True,
+        'lock_path': str(tmp_path / 'locks' / 'venv-uuid.lock'),
+    }
+
+
+def test_finish_lazy_install_nothing_installed(tmp_path):
+    venv_data = {'env_path': tmp_path}
+    with patch('fades.envbuilder.get_distributions') as mock_distribs:
+        with patch('fades.cache.VEnvsCache') as mock_cache:
+            main._finish_lazy_install(tmp_path, venv_data, mock_cache)
+    assert not mock_distribs.called
+    assert not mock_cache.add_installed.called
+    assert not tmp_path.exists()
+
+
+def test_finish_lazy_install_something_installed(tmp_path):
+    (tmp_path / 'installed.txt').write_text('PyYAML>=5\n')
+    venv_data = {'env_path': 'env_path'}
+    distribs = {'pyyaml': '6.0', 'other': '1.0'}
+    with patch('fades.envbuilder.get_distributions', return_value=distribs):
+        with patch('fades.cache.VEnvsCache') as mock_cache:
+            main._finish_lazy_install(tmp_path, venv_data, mock_cache)
+    mock_cache.add_installed.assert_called_once_with(
+        'env_path', {REPO_PYPI: {'pyyaml': '6.0'}}, distribs)
+    assert not tmp_path.exists()
+
+
+@pytest.mark.parametrize('argv, child_program, child_options, expected', [
+    (['--python-matrix', '3.11,3.12', '-d', 'foo', 'script.py', '--python-matrix', 'x'],
+     'script.py', ['--python-matrix', 'x'],
+     ['-d', 'foo', '--running-in-matrix', 'script.py', '--python-matrix', 'x']),
+    (['-v', '--python-matrix=3.11', '-x', 'pytest'], 'pytest', [],
+     ['-v', '-x', '--running-in-matrix', 'pytest']),
+])
+def test_get_matrix_fades_args(argv, child_program, child_options, expected):
+    assert main._get_matrix_fades_args(argv, child_program, child_options) == expected
+
+
+def test_get_fork_server_modules():
+    deps = {
+        REPO_PYPI: [Requirement('beautifulsoup4'), Requirement('requests>2'), Requirement('foo')],
+        REPO_VCS: [parsing.VCSDependency('git+http://whatever')],
+    }
+    assert main._get_fork_server_modules(deps) == ['bs4', 'foo', 'requests']
+
+
+def test_get_fork_server_modules_mixed_case():
+    deps = parsing.parse_manual(['PyQt5', 'PyYAML'])
+    assert main._get_fork_server_modules(deps) == ['PyQt5', 'yaml']
+
+
+def test_run_in_fork_server_starting_it(tmp_path):
+    venv_data = {'env_path': tmp_path / 'some-uuid', 'env_bin_path': tmp_path / 'bin'}
+    deps = {REPO_PYPI: [Requirement('foo')]}
+    with patch('fades.helpers.get_basedir', return_value=tmp_path):
+        with patch('fades.helpers.spawn_detached') as mock_spawn:
+            proc = main._run_in_fork_server(venv_data, deps, ['script.py'], False)
+
+    assert proc is None
+    (cmd,), _ = mock_spawn.call_args
+    assert cmd[0] == str(tmp_path / 'bin' / 'python')
+    assert cmd[2:] == [str(tmp_path / 'forkservers' / 'some-uuid.sock'), 'foo']
+    assert (tmp_path / 'forkservers').is_dir()
@@ -0,0 +1,69 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Tests for the runs with several interpreters."""
+
+from unittest.mock import patch
+
+import pytest
+
+from fades import FadesError, helpers, matrix
+
+
+def test_parse_matrix():
+    pythons = matrix.parse_matrix("3.11, 3,pypy3,/opt/py/bin/python,3.11,")
+    assert pythons == ["python3.11", "python3", "pypy3", "/opt/py/bin/python"]
+
+
+def test_parse_matrix_empty(logs):
+    with pytest.raises(FadesError):
+        matrix.parse_matrix(" , ")
+    assert "No interpreters indicated in the Python matrix" in logs.error
+
+
+def test_resolve_interpreters(logs):
+    interpreters = {
+        'python3.11': ('cpython3.11-a', True),
+        'python3': ('cpython3.11-a', True),
+        'python3.12': ('cpython3.12-b', False),
+    }
+    with patch.object(helpers, 'get_interpreter_version', side_effect=interpreters.get):
+        pythons = matrix.resolve_interpreters(['python3.11', 'python3', 'python3.12'])
+    assert pythons == ['python3.11', 'python3.12']
+    assert "Ignoring python3 as it is the same interpreter than python3.11" in logs.warning
+
+
+def test_run_matrix(tmp_path, capsys):
+    # fake the fades execution, showing the arguments and failing for one interpreter
+    fake_python = tmp_path / "fake_python"
+    fake_python.write_text(
+        '#!/bin/sh\necho "$@"\necho "second line"\n[ "$3" = "--python=bad" ] && exit 5\nexit 0\n')
+    fake_python.chmod(0o755)
+    with patch.object(matrix.sys, 'executable', str(fake_python)):
+        rc = matrix.run_matrix(['good', 'bad'], ['script.py', '--foo'])
+    assert rc == 5
+
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines) == [
+        "[bad] -m fades --python=bad script.py --foo",
+        "[bad] second line",
+        "[good] -m fades --python=good script.py --foo",
+        "[good] second line",
+    ]
+    # the lines from each interpreter are shown in order
+    assert lines.index("[good] second line") > lines.index(
+        "[good] -m fades --python=good script.py --foo")
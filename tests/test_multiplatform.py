@@ -17,12 +17,17 @@
 
 """Tests for the helpers in multiplatform."""
 
+import os
 import threading
 import time
 import unittest
 from pathlib import Path
 
-from fades.multiplatform import filelock
+import pytest
+
+from fades import FadesError
+from fades.multiplatform import (
+    _remove_lease, atomic_write, filelock, leaselock, remove_lockfile, semaphore, trylock)
 
 
 class LockChecker(threading.Thread):
@@ -32,14 +37,15 @@ class LockChecker(threading.Thread):
     granularity in different platforms to not mess our tests.
     """
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, shared=False):
         self.filepath = filepath
+        self.shared = shared
         self.in_lock = self.post_work = None
         self.middle_work = threading.Event()
         super().__init__()
 
     def run(self):
-        with filelock(self.filepath):
+        with filelock(self.filepath, shared=self.shared):
             time.sleep(.01)
             self.in_lock = time.time()
             self.middle_work.wait()
@@ -100,3 +106,253 @@ class LockCacheTestCase(unittest.TestCase):
         # get the lock again
         with filelock(self.test_path):
             pass
+
+    def test_shared_locks_coexist(self):
+        lc1 = LockChecker(self.test_path, shared=True)
+        lc1.start()
+        self.wait(lc1, 'in_lock')
+
+        # the second one gets in while the first one is still holding it
+        lc2 = LockChecker(self.test_path, shared=True)
+        lc2.start()
+        self.wait(lc2, 'in_lock')
+
+        lc1.middle_work.set()
+        lc2.middle_work.set()
+        self.wait(lc1, 'post_work')
+        self.wait(lc2, 'post_work')
+        self.assertLess(lc2.in_lock, lc1.post_work)
+
+    def test_exclusive_waits_shared(self):
+        lc1 = LockChecker(self.test_path, shared=True)
+        lc1.start()
+        self.wait(lc1, 'in_lock')
+
+        lc2 = LockChecker(self.test_path)
+        lc2.start()
+
+        lc1.middle_work.set()
+        self.wait(lc1, 'post_work')
+
+        lc2.middle_work.set()
+        self.wait(lc2, 'post_work')
+
+        # check LC 2 waited to enter
+        self.assertGreater(lc2.in_lock, lc1.post_work)
+
+    def test_lock_timeout(self):
+        lc = LockChecker(self.test_path)
+        lc.start()
+        self.wait(lc, 'in_lock')
+
+        try:
+            with self.assertRaises(FadesError):
+                with filelock(self.test_path, timeout=.05):
+                    pass
+        finally:
+            lc.middle_work.set()
+            self.wait(lc, 'post_work')
+
+        # free now
+        with filelock(self.test_path, timeout=.05):
+            pass
+
+
+def test_remove_lockfile(tmp_path):
+    lockpath = tmp_path / "lock"
+    assert not remove_lockfile(lockpath)
+
+    with filelock(lockpath):
+        assert not remove_lockfile(lockpath)
+        assert lockpath.exists()
+    assert remove_lockfile(lockpath)
+    assert not lockpath.exists()
+
+
+def test_lockfile_removed_while_waiting(tmp_path):
+    lockpath = tmp_path / "lock"
+    got_it = threading.Event()
+    release = threading.Event()
+
+    def waiter():
+        with filelock(lockpath):
+            got_it.set()
+            release.wait()
+
+    with filelock(lockpath):
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(.05)
+        # removed (as remove_lockfile does) while the other thread waits for it
+        lockpath.unlink()
+    # the waiter got the old file, and then locked the new one
+    assert got_it.wait(5)
+    assert lockpath.exists()
+    # so nobody else can get it now
+    with pytest.raises(FadesError):
+        with filelock(lockpath, timeout=.05):
+            pass
+    release.set()
+    thread.join()
+
+
+def test_trylock(tmp_path):
+    lockpath = tmp_path / "lock"
+    with trylock(lockpath) as locked:
+        assert locked
+        with trylock(lockpath) as other_locked:
+            assert not other_locked
+    with filelock(lockpath, timeout=.1):
+        with trylock(lockpath) as locked:
+            assert not locked
+
+
+def test_atomic_write(tmp_path):
+    filepath = tmp_path / "somefile"
+    filepath.write_text("old content\n")
+
+    atomic_write(filepath, ["foo", "bar"])
+
+    assert filepath.read_text() == "foo\nbar\n"
+    assert [p.name for p in tmp_path.iterdir()] == ["somefile"]
+
+
+def test_leaselock(tmp_path):
+    lockpath = tmp_path / "lease"
+    with leaselock(lockpath):
+        assert lockpath.exists()
+        with pytest.raises(FadesError):
+            with leaselock(lockpath, timeout=.05):
+                pass
+    assert list(tmp_path.iterdir()) == []
+
+    # free now
+    with leaselock(lockpath, timeout=.05):
+        pass
+
+
+def test_leaselock_abandoned(tmp_path, logs):
+    lockpath = tmp_path / "lease"
+    lockpath.touch()
+    old = time.time() - 10
+    os.utime(lockpath, (old, old))
+    with leaselock(lockpath, timeout=.05, lease_time=5):
+        pass
+    assert "Breaking abandoned lock" in logs.warning
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_leaselock_abandoned_two_breakers(tmp_path, logs):
+    lockpath = tmp_path / "lease"
+    lockpath.touch()
+    old = time.time() - 10
+    os.utime(lockpath, (old, old))
+    stale = os.stat(lockpath)
+
+    # first breaker removes the abandoned lock, and then other process takes it
+    assert _remove_lease(lockpath, tmp_path / "aside1", stale.st_ino, stale.st_mtime)
+    with leaselock(lockpath, timeout=.05, lease_time=5):
+        taken = os.stat(lockpath)
+
+        # the second breaker found the same abandoned lock, but it's not there anymore
+        assert not _remove_lease(lockpath, tmp_path / "aside2", stale.st_ino, stale.st_mtime)
+        assert os.stat(lockpath).st_ino == taken.st_ino
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_leaselock_abandoned_concurrent_breakers(tmp_path):
+    lockpath = tmp_path / "lease"
+    lockpath.touch()
+    old = time.time() - 10
+    os.utime(lockpath, (old, old))
+
+    holders = []
+    max_holders = []
+    barrier = threading.Barrier(4)
+
+    def breaker():
+        barrier.wait()
+        with leaselock(lockpath, timeout=5, lease_time=5):
+            holders.append(1)
+            max_holders.append(len(holders))
+            time.sleep(.01)
+            holders.pop()
+
+    threads = [threading.Thread(target=breaker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(max_holders) == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_leaselock_broken_while_held(tmp_path, logs):
+    lockpath = tmp_path / "lease"
+    with leaselock(lockpath, timeout=.05):
+        # broken by other process, which then took the lock
+        lockpath.unlink()
+        lockpath.touch()
+    assert lockpath.exists()
+    assert "Lock .* was broken while held" in logs.warning
+
+
+def _wait_for(condition):
+    """Wait until the condition is true (failing if it doesn't happen in reasonable time)."""
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(.005)
+
+
+def test_semaphore_limits(tmp_path):
+    running = []
+    max_running = []
+
+    def work():
+        with semaphore(tmp_path, 2):
+            running.append(1)
+            max_running.append(len(running))
+            time.sleep(.05)
+            running.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(max_running) == 5
+    assert max(max_running) == 2
+    assert list((tmp_path / "queue").iterdir()) == []
+
+
+def test_semaphore_fifo(tmp_path):
+    order = []
+    queue_dir = tmp_path / "queue"
+
+    def work(name):
+        with semaphore(tmp_path, 1):
+            order.append(name)
+
+    with semaphore(tmp_path, 1) as waited:
+        assert waited < 1
+        threads = []
+        for name in "abc":
+            thread = threading.Thread(target=work, args=(name,))
+            thread.start()
+            threads.append(thread)
+            _wait_for(lambda: len(list(queue_dir.iterdir())) == len(threads))
+    for thread in threads:
+        thread.join()
+
+    assert order == ["a", "b", "c"]
+
+
+def test_semaphore_abandoned_ticket(tmp_path):
+    queue_dir = tmp_path / "queue"
+    queue_dir.mkdir()
+    (queue_dir / "00000000000000000001-1-deadbeef").touch()
+
+    with semaphore(tmp_path, 1):
+        assert list(queue_dir.iterdir()) == []
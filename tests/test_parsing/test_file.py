@@ -26,6 +26,16 @@ def test_simple_default():
     assert parsed == {REPO_PYPI: get_reqs('foo')}
 
 
+def test_module_as_imported():
+    parsed = parsing._parse_content(io.StringIO("""
+        import PyQt5    # fades
+        from PIL import Image  # fades
+        import Foo_Bar  # fades OtherName
+    """))
+    assert parsed == {REPO_PYPI: get_reqs('pyqt5') + get_reqs('pillow') + get_reqs('othername')}
+    assert [dep.module for dep in parsed[REPO_PYPI]] == ['PyQt5', 'PIL', 'Foo_Bar']
+
+
 def test_double():
     parsed = parsing._parse_content(io.StringIO("""
         import time  # fades
@@ -56,3 +56,13 @@ def test_mixed():
         REPO_PYPI: get_reqs("foo"),
         REPO_VCS: [parsing.VCSDependency("git+git://server.com/etc")],
     }
+
+
+def test_name_normalized():
+    parsed = parsing.parse_manual(["Py_Yaml", "pypi::Foo.Bar >= 2"])
+    assert [str(req) for req in parsed[REPO_PYPI]] == ["py-yaml", "foo-bar>=2"]
+
+
+def test_module_as_written():
+    parsed = parsing.parse_manual(["PyQt5", "PyYAML", "Foo-Bar"])
+    assert [req.module for req in parsed[REPO_PYPI]] == ["PyQt5", "yaml", "Foo_Bar"]
@@ -16,6 +16,7 @@
 
 """Tests for pip related code."""
 
+import json
 import os
 import io
 import pytest
@@ -197,3 +198,157 @@ def test_freeze(tmp_path):
     with open(tmp_file, 'rt', encoding='utf8') as fh:
         stored = fh.read()
     assert stored == 'foo==1.2\nmoño>11\n'
+
+
+def test_install_shared_pip():
+    shared_python = Path("sharedpath") / "python"
+    mgr = PipManager(BIN_PATH, pip_installed=False, shared_pip=shared_python)
+    with patch.object(helpers, "logged_exec") as mocked_exec:
+        with patch.object(mgr, "_brute_force_install_pip") as mocked_install_pip:
+            mgr.install("foo")
+
+    # no pip installed nor upgraded in the venv, just used the shared one
+    assert mocked_install_pip.call_count == 0
+    python_path = Path(BIN_PATH) / "python"
+    mocked_exec.assert_called_once_with(
+        [shared_python, "-m", "pip", "--python", python_path, "install", "foo"])
+
+
+def test_freeze_shared_pip(tmp_path):
+    shared_python = Path("sharedpath") / "python"
+    mgr = PipManager(BIN_PATH, shared_pip=shared_python)
+    with patch.object(helpers, "logged_exec") as mock:
+        mock.return_value = ['foo==1.2']
+        mgr.freeze(tmp_path / "reqtest.txt")
+
+    python_path = Path(BIN_PATH) / "python"
+    mock.assert_called_with(
+        [shared_python, "-m", "pip", "--python", python_path, "freeze", "--all", "--local"])
+
+
+def test_get_shared_pip_existing(basedir):
+    (basedir / "shared-pip" / "bin").mkdir(parents=True)
+    with patch.object(pipmanager, "_create_shared_pip") as mock_create:
+        python_exe = pipmanager.get_shared_pip()
+
+    assert not mock_create.called
+    assert python_exe == basedir / "shared-pip" / "bin" / "python"
+
+
+def test_get_shared_pip_creating(basedir):
+    def fake_create(env_path, avoid_pip_upgrade):
+        (env_path / "bin").mkdir(parents=True)
+
+    with patch.object(pipmanager, "_create_shared_pip", side_effect=fake_create) as mock:
+        python_exe = pipmanager.get_shared_pip(avoid_pip_upgrade=True)
+
+    mock.assert_called_once_with(basedir / "shared-pip", True)
+    assert python_exe == basedir / "shared-pip" / "bin" / "python"
+
+
+def test_install_deferred_compile():
+    mgr = PipManager(BIN_PATH, pip_installed=True, avoid_pip_upgrade=True, deferred_compile=True)
+    pip_path = Path(BIN_PATH) / "pip"
+    with patch.object(helpers, "logged_exec") as mock:
+        mgr.install("foo")
+    mock.assert_called_with([pip_path, "install", "foo", "--no-compile"])
+
+
+def test_install_parallel():
+    mgr = PipManager(BIN_PATH, pip_installed=True, avoid_pip_upgrade=True, options=["--pre"])
+    pip_path = Path(BIN_PATH) / "pip"
+    calls = []
+
+    def fake_exec(args):
+        calls.append(args)
+        if args[1] == "wheel":
+            wheelhouse = Path(args[3])
+            (wheelhouse / "foo-1.0-py3-none-any.whl").touch()
+            (wheelhouse / "bar-2.0-py3-none-any.whl").touch()
+
+    with patch.object(helpers, "logged_exec", side_effect=fake_exec):
+        mgr.install_parallel(["foo", "baz > 2"], workers=2)
+
+    wheel_call, *install_calls = calls
+    wheelhouse = wheel_call[3]
+    assert wheel_call == [pip_path, "wheel", "--wheel-dir", wheelhouse, "foo", "baz", ">", "2",
+                          "--pre"]
+    base_install = [pip_path, "install", "--no-deps", "--no-index", "--no-warn-conflicts"]
+    assert sorted(install_calls) == [
+        base_install + [Path(wheelhouse) / "bar-2.0-py3-none-any.whl"],
+        base_install + [Path(wheelhouse) / "foo-1.0-py3-none-any.whl"],
+    ]
+
+
+@pytest.mark.parametrize('options, supported', [
+    (None, True),
+    (["--pre", "--index-url=http://myindex/simple", "-q"], True),
+    (["--user"], False),
+    (["--pre", "--upgrade"], False),
+    (["--target=/some/dir"], False),
+    (["--upgrade-strategy eager"], False),
+])
+def test_supports_parallel_install(options, supported):
+    mgr = PipManager(BIN_PATH, pip_installed=True, avoid_pip_upgrade=True, options=options)
+    assert mgr.supports_parallel_install() == supported
+
+
+def test_install_parallel_wheel_failing(logs):
+    mgr = PipManager(BIN_PATH, pip_installed=True, avoid_pip_upgrade=True)
+
+    def fake_exec(args):
+        if args[1] == "wheel":
+            (Path(args[3]) / "foo-1.0-py3-none-any.whl").touch()
+        else:
+            raise helpers.ExecutionError(1, args, ["broken wheel"])
+
+    with patch.object(helpers, "logged_exec", side_effect=fake_exec):
+        with pytest.raises(helpers.ExecutionError):
+            mgr.install_parallel(["foo"])
+    assert "broken wheel" in logs.error
+
+
+def test_install_capturing_lock():
+    mgr = PipManager(BIN_PATH, pip_installed=True, avoid_pip_upgrade=True, capture_lock=True)
+    report = {"install": [
+        {"metadata": {"name": "foo", "version": "1.0"},
+         "download_info": {"archive_info": {"hashes": {"sha256": "f00"}}}},
+        {"metadata": {"name": "bar", "version": "2.0"},
+         "download_info": {"archive_info": {"hashes": {"sha256": "ba7"}}}},
+    ]}
+
+    def fake_exec(args):
+        assert args[-2] == "--report"
+        with open(args[-1], "wt", encoding="utf8") as fh:
+            json.dump(report, fh)
+
+    with patch.object(helpers, "logged_exec", side_effect=fake_exec):
+        mgr.install("foo")
+
+    assert mgr.get_lock_lines() == [
+        "bar==2.0 --hash=sha256:ba7",
+        "foo==1.0 --hash=sha256:f00",
+    ]
+
+
+def test_lock_lines_missing_hash():
+    mgr = PipManager(BIN_PATH, pip_installed=True, capture_lock=True)
+    mgr.resolved = {"foo": ("1.0", "f00"), "bar": ("2.0", None)}
+    assert mgr.get_lock_lines() is None
+
+
+def test_lock_lines_nothing_resolved():
+    mgr = PipManager(BIN_PATH, pip_installed=True, capture_lock=True)
+    assert mgr.get_lock_lines() is None
+
+
+def test_install_locked():
+    mgr = PipManager(
+        BIN_PATH, pip_installed=True, avoid_pip_upgrade=True, options=["--pre"],
+        deferred_compile=True)
+    pip_path = Path(BIN_PATH) / "pip"
+    with patch.object(helpers, "logged_exec") as mock:
+        mgr.install_locked("lockfile.txt")
+    mock.assert_called_with([
+        pip_path, "install", "--no-deps", "--require-hashes", "-r", "lockfile.txt",
+        "--no-compile", "--pre"])
@@ -22,3 +22,15 @@ from fades import pkgnamesdb
 def test_db_consistency():
     """Ensure multiple DB entrypoints are consistent between them."""
     assert len(pkgnamesdb.MODULE_TO_PACKAGE) == len(pkgnamesdb.PACKAGE_TO_MODULE)
+
+
+def test_package_to_module_normalized():
+    """The packages are normalized, as the dependencies always are."""
+    assert pkgnamesdb.PACKAGE_TO_MODULE['github3-py'] == 'github3'
+
+
+def test_get_module_name():
+    assert pkgnamesdb.get_module_name('pyyaml') == 'yaml'
+    assert pkgnamesdb.get_module_name('foo-bar') == 'foo_bar'
+    assert pkgnamesdb.get_module_name('PyYAML') == 'yaml'
+    assert pkgnamesdb.get_module_name('PyQt5') == 'PyQt5'
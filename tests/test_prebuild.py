@@ -0,0 +1,163 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Tests for the prebuilding of popular virtualenvs."""
+
+import json
+from unittest.mock import patch
+
+import pytest
+from packaging.requirements import Requirement
+
+from fades import cache, envbuilder, helpers, prebuild
+from fades.parsing import VCSDependency
+
+OPTIONS = {'venv_options': ['--system-site-packages']}
+
+
+@pytest.fixture
+def managers(basedir):
+    """Provide the venvs cache and the usage manager."""
+    venvscache = cache.VEnvsCache(basedir / 'venvs.idx')
+    usage_manager = envbuilder.UsageManager(basedir / 'usage_stats', venvscache)
+    return venvscache, usage_manager
+
+
+def _record(fingerprint, *deps):
+    prebuild.record_recipe(
+        fingerprint, {'pypi': [Requirement(dep) for dep in deps]}, 'python3', OPTIONS, [])
+
+
+def _store_used(venvscache, usage_manager, fingerprint, uses, basedir):
+    metadata = {'env_path': basedir / fingerprint, 'env_bin_path': basedir / fingerprint / 'bin'}
+    venvscache.store({}, metadata, 'interpreter', OPTIONS, fingerprint=fingerprint)
+    for _ in range(uses):
+        usage_manager.store_usage_stat(metadata, venvscache)
+
+
+def test_record_recipe(basedir):
+    deps = {'vcs': [VCSDependency('git+http://foo')], 'pypi': [Requirement('foo>1')]}
+    prebuild.record_recipe('fp', deps, None, OPTIONS, ['--pre'])
+
+    (recipe,) = [json.loads(line) for line in (basedir / 'recipes.jsonl').read_text().splitlines()]
+    assert recipe['fingerprint'] == 'fp'
+    assert recipe['dependencies'] == ['pypi::foo>1', 'vcs::git+http://foo']
+    assert recipe['python'] is None
+    assert recipe['options'] == OPTIONS
+    assert recipe['pip_options'] == ['--pre']
+    assert recipe['builds'] == 1
+
+
+def test_popular_by_builds_and_uses(basedir, managers):
+    venvscache, usage_manager = managers
+    _record('fp1', 'foo')
+    _record('fp2', 'bar')
+    _record('fp2', 'bar')
+    _record('fp3', 'baz')
+    _store_used(venvscache, usage_manager, 'fp3', 3, basedir)
+
+    popular = prebuild.get_popular(venvscache, usage_manager, 2)
+    assert [recipe['fingerprint'] for recipe in popular] == ['fp3', 'fp2']
+    assert popular[1]['builds'] == 2
+
+    # the recipes file was compacted
+    assert len((basedir / 'recipes.jsonl').read_text().splitlines()) == 3
+
+
+def test_popular_no_recipes(managers):
+    venvscache, usage_manager = managers
+    assert prebuild.get_popular(venvscache, usage_manager, 5) == []
+
+
+def test_build_command():
+    recipe = dict(
+        fingerprint='fp', python='python3.X', pip_options=['--pre'],
+        options={'venv_options': ['--foo'], 'shared_pip': True},
+        dependencies=['pypi::foo>1', 'vcs::git+http://foo'])
+    cmd = prebuild._build_command(recipe)
+    assert cmd[1:] == [
+        '-m', 'fades', '--where', '-q', '--prebuilding', '--python=python3.X',
+        '--venv-options=--foo', '--shared-pip', '--pip-options=--pre',
+        '--dependency=pypi::foo>1', '--dependency=vcs::git+http://foo',
+    ]
+
+
+def test_prebuild_only_missing(basedir, managers):
+    venvscache, usage_manager = managers
+    _record('fp1', 'foo')
+    _record('fp2', 'bar')
+    _store_used(venvscache, usage_manager, 'fp1', 1, basedir)
+
+    with patch.object(helpers, 'logged_exec') as exec_mock:
+        built = prebuild.prebuild_popular(venvscache, usage_manager, 5)
+    assert built == 1
+    (cmd,), _ = exec_mock.call_args
+    assert cmd[-1] == '--dependency=pypi::bar'
+
+
+def test_prebuild_failing(basedir, managers, logs):
+    venvscache, usage_manager = managers
+    _record('fp1', 'foo')
+    with patch.object(helpers, 'logged_exec') as exec_mock:
+        exec_mock.side_effect = helpers.ExecutionError(1, 'cmd', ['boom'])
+        built = prebuild.prebuild_popular(venvscache, usage_manager, 5)
+    assert built == 0
+    assert "Failed to prebuild virtualenv for" in logs.warning
+
+
+def _write_sources(basedir):
+    scripts = basedir / 'scripts'
+    (scripts / 'sub').mkdir(parents=True)
+    (scripts / 'a.py').write_text("import foo  # fades\n")
+    (scripts / 'sub' / 'b.py').write_text('"""Doc.\n\nfades:\n    foo\n"""\n')
+    (scripts / 'c.py').write_text("import bar  # fades\n")
+    (scripts / 'nodeps.py').write_text("import os\n")
+    (scripts / 'requirements.txt').write_text("baz\n")
+    (scripts / 'notes.txt').write_text("not a requirement\n")
+    return scripts
+
+
+def test_prebuild_paths(basedir, managers):
+    venvscache, _ = managers
+    scripts = _write_sources(basedir)
+    metadata = {'env_path': basedir / 'env', 'env_bin_path': basedir / 'env' / 'bin'}
+    venvscache.store({'pypi': {'baz': '1'}}, metadata, 'interpreter', OPTIONS)
+
+    def fake_exec(cmd):
+        if '--dependency=pypi::bar' in cmd:
+            raise helpers.ExecutionError(1, cmd, ['boom'])
+
+    with patch.object(helpers, 'logged_exec', side_effect=fake_exec) as exec_mock:
+        summary = prebuild.prebuild_paths(
+            [scripts], venvscache, 'python3', 'interpreter', OPTIONS, ['--pre'])
+
+    assert summary == dict(
+        sources=4, requests=3, present=1, built=1, failed=[scripts / 'c.py'])
+    built_deps = sorted(call[0][0][-1] for call in exec_mock.call_args_list)
+    assert built_deps == ['--dependency=pypi::bar', '--dependency=pypi::foo']
+
+
+def test_prebuild_paths_explicit_file(basedir, managers):
+    venvscache, _ = managers
+    reqfile = basedir / 'deps.txt'
+    reqfile.write_text("foo\nbar\n")
+    with patch.object(helpers, 'logged_exec') as exec_mock:
+        summary = prebuild.prebuild_paths(
+            [reqfile], venvscache, None, 'interpreter', OPTIONS, [])
+    assert summary == dict(sources=1, requests=1, present=0, built=1, failed=[])
+    (cmd,), _ = exec_mock.call_args
+    assert cmd[-2:] == ['--dependency=pypi::bar', '--dependency=pypi::foo']
@@ -0,0 +1,153 @@
+# Copyright 2026 Facundo Batista, Nicolás Demarchi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General
+# Public License version 3, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranties of
+# MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For further info, check  https://github.com/PyAr/fades
+
+"""Tests for the remote cache of virtualenvs."""
+
+import functools
+import http.client
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+
+from fades import cache, remotecache
+
+
+class _CacheHandler(SimpleHTTPRequestHandler):
+    """Serve files from a directory, also accepting PUTs to store them."""
+
+    def do_PUT(self):
+        """Store the file."""
+        size = int(self.headers['Content-Length'])
+        with open(self.translate_path(self.path), 'wb') as fh:
+            fh.write(self.rfile.read(size))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        """Be quiet."""
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """Start a simple HTTP server serving a directory; return that directory and the URL."""
+    served = tmp_path / "served"
+    served.mkdir()
+    handler = functools.partial(_CacheHandler, directory=str(served))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served, "http://127.0.0.1:{}/".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def built_venv(tmp_path):
+    """Create a venv (as built in other machine) and its cache entry."""
+    env_path = tmp_path / "othermachine" / "some-uuid"
+    env_bin_path = env_path / "bin"
+    env_bin_path.mkdir(parents=True)
+    (env_path / "pyvenv.cfg").write_text("command = python -m venv {}\n".format(env_path))
+    return {
+        'metadata': {'env_path': env_path, 'env_bin_path': env_bin_path, 'pip_installed': True},
+        'installed': {'pypi': {'foo': '1.0'}},
+        'interpreter': 'cpython3.11-0123456789abcdef',
+        'options': {'venv_options': []},
+        'fingerprint': 'fprint',
+    }
+
+
+def test_key():
+    assert remotecache.get_key('fprint', 'cpython3.11-abc') == 'cpython3.11-abc-fprint.tar.xz'
+
+
+@pytest.mark.parametrize('prefix', ['', 'file://'])
+def test_directory_roundtrip(tmp_path, basedir, built_venv, prefix):
+    remote = remotecache.RemoteCache(prefix + str(tmp_path / "remote"))
+    remote.put_venv(built_venv)
+    assert (tmp_path / "remote" / "cpython3.11-0123456789abcdef-fprint.tar.xz").exists()
+
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    metadata = remote.get_venv('fprint', 'cpython3.11-0123456789abcdef', venvscache)
+    assert metadata['env_path'].parent == basedir
+    assert (metadata['env_path'] / "pyvenv.cfg").read_text() == (
+        "command = python -m venv {}\n".format(metadata['env_path']))
+    assert venvscache.get_entry(metadata['env_path'].name)['fingerprint'] == 'fprint'
+    assert not [path for path in basedir.iterdir() if path.name.startswith("fades-remote-")]
+
+
+def test_directory_miss(tmp_path, basedir):
+    remote = remotecache.RemoteCache(str(tmp_path / "remote"))
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    assert remote.get_venv('fprint', 'cpython3.11-abc', venvscache) is None
+    assert list(basedir.iterdir()) == []
+
+
+def test_http_roundtrip(http_server, basedir, built_venv):
+    served, url = http_server
+    remote = remotecache.RemoteCache(url)
+    remote.put_venv(built_venv)
+    assert (served / "cpython3.11-0123456789abcdef-fprint.tar.xz").exists()
+
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    metadata = remote.get_venv('fprint', 'cpython3.11-0123456789abcdef', venvscache)
+    assert metadata['env_path'].parent == basedir
+    assert venvscache.get_venv(uuid=metadata['env_path'].name) == metadata
+
+
+def test_http_miss(http_server, basedir, logs):
+    _, url = http_server
+    remote = remotecache.RemoteCache(url)
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    assert remote.get_venv('fprint', 'cpython3.11-abc', venvscache) is None
+    assert "Virtualenv not found in the remote cache" in logs.debug
+    assert list(basedir.iterdir()) == []
+
+
+def test_http_broken(http_server, basedir, logs):
+    served, url = http_server
+    (served / "cpython3.11-abc-fprint.tar.xz").write_bytes(b"not really an archive")
+    remote = remotecache.RemoteCache(url)
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    assert remote.get_venv('fprint', 'cpython3.11-abc', venvscache) is None
+    assert "Error getting the virtualenv from the remote cache" in logs.warning
+
+
+def test_http_unreachable(basedir, built_venv, logs):
+    remote = remotecache.RemoteCache("http://127.0.0.1:1/")
+    remote.put_venv(built_venv)
+    assert "Error uploading the virtualenv to the remote cache" in logs.warning
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    assert remote.get_venv('fprint', 'cpython3.11-abc', venvscache) is None
+    assert "Error getting the virtualenv from the remote cache" in logs.warning
+    assert list(basedir.iterdir()) == []
+
+
+def test_http_broken_connection(basedir, built_venv, logs):
+    remote = remotecache.RemoteCache("http://127.0.0.1:1/")
+    error = http.client.RemoteDisconnected("Remote end closed connection without response")
+    with patch.object(remotecache.request, 'urlopen', side_effect=error):
+        remote.put_venv(built_venv)
+    assert "Error uploading the virtualenv to the remote cache" in logs.warning
+
+    venvscache = cache.VEnvsCache(basedir / "venvs.idx")
+    with patch.object(remotecache.request, 'urlopen', side_effect=http.client.IncompleteRead(b'')):
+        assert remote.get_venv('fprint', 'cpython3.11-abc', venvscache) is None
+    assert "Error getting the virtualenv from the remote cache" in logs.warning
+    assert list(basedir.iterdir()) == []